@@ -99,6 +99,9 @@ class Constants:
     GRANT = "grant"
     LOG = "log"
     META = "meta"
+    MESSAGE = "message"
+    REMINDER = "reminder"
+    COUNTER = "counter"
 
     # CouchDB upper value.
     CEILING = "ZZZZZZZZ"
@@ -216,10 +219,22 @@ class Constants:
     # Call order (sorting) key alternatives.
     CALL_ORDER_KEYS = frozenset(["closes", "title", "identifier"])
 
+    # Uploaded files; spooled to a temporary file when larger, in bytes.
+    MEGABYTE = 1024 * 1024
+    UPLOAD_SPOOL_SIZE = 1024 * 1024
+
+    # Content-addressed store for attachment files; chunk size in bytes,
+    # and the time in seconds during which a new file is not deleted.
+    BLOB_CHUNK_SIZE = 65536
+    BLOB_GRACE_PERIOD = 3600
+
     # Site files, caching timeout.
     SITE_FILES = frozenset(["name_logo", "host_logo"])
     SITE_FILE_MAX_AGE = 24 * 3600
 
+    # Max age for responses from URLs containing the digest of the content.
+    IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
     # MIME types
     DOCX_MIMETYPE = (
         "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
@@ -228,6 +243,59 @@ class Constants:
     ZIP_MIMETYPE = "application/zip"
     XML_MIMETYPE = "text/xml"
     JSON_MIMETYPE = "application/json"
+    CSV_MIMETYPE = "text/csv"
+    JSONL_MIMETYPE = "application/jsonl"
+    BINARY_MIMETYPE = "application/octet-stream"
+
+    # Number of documents fetched per request when streaming exports.
+    EXPORT_CHUNK_SIZE = 200
+
+    # Server-side processing of DataTables list tables.
+    DATATABLES_PAGE_LENGTH = 25
+    DATATABLES_MAX_LENGTH = 500
+
+    # Paging of the log pages, and max length of a displayed log item.
+    LOGS_PAGE_SIZE = 50
+    LOGS_MAX_PAGE_SIZE = 500
+    LOGS_MAX_ITEM_LENGTH = 2000
+
+    # Number of documents per bulk database request.
+    BULK_DOCS_CHUNK_SIZE = 500
+
+    # Retries when saving a document on update conflict; time in seconds.
+    SAVER_MAX_ATTEMPTS = 5
+    SAVER_BACKOFF = 0.05
+
+    # Proposal counter documents; retries on update conflict, time in seconds.
+    COUNTER_MAX_ATTEMPTS = 10
+    COUNTER_BACKOFF = 0.01
+
+    # Page cache for anonymous visitors; an expired entry is served if the
+    # database cannot be reached, for at most the stale time in seconds.
+    PAGE_CACHE_MAX_ENTRIES = 500
+    PAGE_CACHE_STALE_TIME = 3600
+
+    # Outbox for email; times in seconds.
+    OUTBOX_POLL_INTERVAL = 60
+    OUTBOX_BATCH_SIZE = 50
+    OUTBOX_CLAIM_TIMEOUT = 600
+    OUTBOX_BACKOFF = 30
+    OUTBOX_MAX_ATTEMPTS = 8
+    OUTBOX_SEND_INTERVAL = 0.2
+    OUTBOX_FAILED_RETENTION = 7 * 24 * 3600
+
+    # API key authentication, and paging of API results.
+    API_KEY_HEADER = "X-API-key"
+    API_PAGE_LIMIT = 100
+    API_PAGE_MAX_LIMIT = 1000
+    API_CHANGES_DOCTYPES = (PROPOSAL, REVIEW, DECISION, GRANT)
+
+    # Server-sent events for a call; times in seconds.
+    EVENTS_POLL_TIMEOUT = 25
+    EVENTS_STREAM_DURATION = 300
+    EVENTS_RETRY = 5
+    # Each stream holds a request thread; keep some for ordinary requests.
+    EVENTS_MAX_STREAMS = 2
 
     ALLOWED_ID_CHARACTERS = frozenset(string.ascii_lowercase + string.digits + "-_")
 
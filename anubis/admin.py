@@ -10,6 +10,9 @@ from anubis import utils
 
 import anubis.database
 import anubis.config
+import anubis.outbox
+import anubis.saver
+import anubis.uploads
 
 
 blueprint = flask.Blueprint("admin", __name__)
@@ -155,6 +158,9 @@ def database():
         "admin/database.html",
         doc=anubis.database.get_doc(identifier),
         counts=json.dumps(anubis.database.get_counts(), indent=2),
+        uploads=json.dumps(anubis.uploads.get_metrics(), indent=2),
+        conflicts=json.dumps(anubis.saver.get_conflict_metrics(), indent=2),
+        n_failed_messages=anubis.database.get_count("messages", "failed"),
         db_info=json.dumps(flask.g.db.get_info(), indent=2),
         server_data=json.dumps(server(), indent=2),
         databases=", ".join([str(d) for d in server]),
@@ -163,6 +169,15 @@ def database():
     )
 
 
+@blueprint.route("/purge_failed_messages", methods=["POST"])
+@utils.admin_required
+def purge_failed_messages():
+    "Delete the email messages that could not be sent."
+    count = anubis.outbox.purge_failed()
+    utils.flash_message(f"Deleted {count} failed email messages.")
+    return flask.redirect(flask.url_for("admin.database"))
+
+
 @blueprint.route("/document/<identifier>")
 @utils.admin_required
 def document(identifier):
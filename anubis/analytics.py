@@ -0,0 +1,165 @@
+"Analytics of the score and rank values in the reviews of a call."
+
+import statistics
+
+import flask
+
+from anubis import constants, utils
+
+
+def get_call_analytics(call):
+    """Return the analytics for the reviews in the call.
+    It is computed at most once per request.
+    """
+    key = f"analytics {call['identifier']}"
+    try:
+        return utils.cache_get(key)
+    except KeyError:
+        return utils.cache_put(key, CallAnalytics(call))
+
+
+def get_score_fields(call):
+    "Return a dictionary of the score banner fields in the reviews of the call."
+    return {
+        f["identifier"]: f
+        for f in call["review"]
+        if f.get("banner") and f["type"] == constants.SCORE
+    }
+
+
+def get_rank_fields(call):
+    "Return a dictionary of the rank banner fields in the reviews of the call."
+    return {
+        f["identifier"]: f
+        for f in call["review"]
+        if f.get("banner") and f["type"] == constants.RANK
+    }
+
+
+def get_rank_errors(call):
+    """Return the set of reviewers who have rank values that do not start
+    with 1 and are consecutive, in any rank banner field, in the finalized
+    non-conflict-of-interest reviews of the call. Obtained by one grouped
+    query of the 'reviews/call_reviewer_rank' view for all reviewers.
+    It is computed at most once per request.
+    """
+    key = f"rank errors {call['identifier']}"
+    try:
+        return utils.cache_get(key)
+    except KeyError:
+        pass
+    rank_fields = get_rank_fields(call)
+    # Key: (reviewer, field identifier); value: set of values.
+    series = {}
+    if rank_fields:
+        for row in flask.g.db.view(
+            "reviews",
+            "call_reviewer_rank",
+            startkey=[call["identifier"], ""],
+            endkey=[call["identifier"], constants.CEILING],
+            group_level=4,
+            reduce=True,
+        ):
+            if row.key[2] in rank_fields and row.value:
+                series.setdefault((row.key[1], row.key[2]), set()).add(row.key[3])
+    result = set()
+    for (reviewer, id), values in series.items():
+        if values != set(range(1, int(max(values)) + 1)):
+            result.add(reviewer)
+    return utils.cache_put(key, result)
+
+
+class CallAnalytics:
+    """Matrix of the values of the score and rank banner fields in
+    all finalized non-conflict-of-interest reviews of a call, indexed
+    by field, reviewer and proposal. It is obtained by a single query
+    of the 'reviews/call_proposal_score' view; no review documents are loaded.
+    """
+
+    def __init__(self, call):
+        self.call = call
+        self.score_fields = get_score_fields(call)
+        self.rank_fields = get_rank_fields(call)
+        # Key: field identifier; value: dict(reviewer: dict(proposal: value))
+        self.matrix = {
+            id: {} for id in list(self.score_fields) + list(self.rank_fields)
+        }
+        if self.matrix:
+            result = flask.g.db.view(
+                "reviews",
+                "call_proposal_score",
+                startkey=[call["identifier"], ""],
+                endkey=[call["identifier"], constants.CEILING],
+                reduce=False,
+            )
+            for row in result:
+                try:
+                    reviewers = self.matrix[row.key[2]]
+                except KeyError:
+                    continue
+                reviewers.setdefault(row.key[3], {})[row.key[1]] = row.value
+        self.rank_errors = get_rank_errors(call)
+        self.ranking = {id: self.compute_ranking(id) for id in self.rank_fields}
+        self.normalized = {id: self.compute_normalized(id) for id in self.score_fields}
+
+    def compute_ranking(self, id):
+        """Return the ranking factor and its stdev for each proposal in the rank field.
+        The factor is 10 if all reviewers ranked the proposal first, 0 if last.
+        """
+        factors = {}  # key: proposal, value: list of factors.
+        for values in self.matrix[id].values():
+            n = len(values)
+            for pid, value in values.items():
+                factors.setdefault(pid, []).append(float(n - value + 1) / n)
+        result = {}
+        for pid, series in factors.items():
+            result[pid] = {"factor": get_mean(series), "stdev": get_stdev(series)}
+            for key in ["factor", "stdev"]:
+                if result[pid][key] is not None:
+                    result[pid][key] = round(10.0 * result[pid][key], 1)
+        return result
+
+    def compute_normalized(self, id):
+        """Return the mean reviewer-normalized score (z-score) for each
+        proposal in the score field. The scores of each reviewer are
+        normalized by the mean and stdev of all the scores of that reviewer,
+        which compensates for reviewers being generally strict or lenient.
+        Reviewers with fewer than two scores, or no spread, are not included.
+        """
+        zscores = {}  # key: proposal, value: list of z-scores.
+        for values in self.matrix[id].values():
+            series = list(values.values())
+            mean = get_mean(series)
+            stdev = get_stdev(series)
+            if not stdev:
+                continue
+            for pid, value in values.items():
+                zscores.setdefault(pid, []).append((value - mean) / stdev)
+        result = {}
+        for pid, series in zscores.items():
+            result[pid] = round(get_mean(series), 2)
+        return result
+
+    def get_ranking(self, id, pid):
+        "Return the ranking factor and stdev for the proposal in the rank field."
+        return self.ranking[id].get(pid) or {"factor": None, "stdev": None}
+
+    def get_normalized(self, id, pid):
+        "Return the mean normalized score for the proposal in the score field."
+        return self.normalized[id].get(pid)
+
+
+def get_mean(series):
+    "Return the mean of the values, or None if no values."
+    try:
+        return statistics.mean(series)
+    except statistics.StatisticsError:
+        return None
+
+
+def get_stdev(series):
+    "Return the sample stdev of the values, or None if fewer than two values."
+    try:
+        return statistics.stdev(series)
+    except statistics.StatisticsError:
+        return None
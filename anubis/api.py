@@ -1,43 +1,88 @@
 """API endpoints.
 
-Currently only one single fetch endpoint.
+The open and closed calls are public. The proposals, reviews, decisions
+and grants of a call require authentication, either by a session or by
+the API key of the user account given in the request header.
+Those lists are paged by a cursor, which is the key of the first item
+of the next page, and have an ETag so that an unchanged page is not resent.
+
+The changes of the documents in a call are obtained from the CouchDB
+changes feed, so that external systems can keep a copy in sync.
+The same feed is used for the server-sent events of a call, which
+are used to update the proposals and reviews list pages live, when
+the user asks for it. Each stream holds a request thread, so the number
+of concurrent streams in a server process is limited.
 """
 
+import base64
+import hashlib
+import json
+import threading
+import time
+
+import couchdb2
 import flask
 
+import anubis.call
 import anubis.calls
+import anubis.database
+import anubis.decision
+import anubis.display
+import anubis.grant
+import anubis.proposal
+import anubis.review
+from anubis import constants
 from anubis import utils
 
 
 blueprint = flask.Blueprint("api", __name__)
 
+# Limits the number of concurrent event streams in this process.
+_streams = threading.BoundedSemaphore(constants.EVENTS_MAX_STREAMS)
+
 
 @blueprint.route("/calls/open")
 def calls_open():
     "Return JSON for open calls."
-    data = {
-        "$id": flask.request.url,
-        "timestamp": utils.get_now(),
-        "title": "All open calls.",
-    }
-    data["calls"] = [get_call_json(c) for c in anubis.calls.get_open_calls()]
-    response = flask.jsonify(data)
+    calls = anubis.calls.get_open_calls()
+    etag = get_calls_etag(calls)
+    response = utils.get_not_modified(etag)
+    if response is None:
+        data = {
+            "$id": flask.request.url,
+            "timestamp": utils.get_now(),
+            "title": "All open calls.",
+        }
+        data["calls"] = [get_call_json(c) for c in calls]
+        response = flask.jsonify(data)
     response.headers.add("Access-Control-Allow-Origin", "*")
-    return response
+    return utils.set_validators(response, etag, private=False)
 
 
 @blueprint.route("/calls/closed")
 def calls_closed():
     "Return JSON for closed calls."
-    data = {
-        "$id": flask.request.url,
-        "timestamp": utils.get_now(),
-        "title": "All closed calls.",
-    }
-    data["calls"] = [get_call_json(c) for c in anubis.calls.get_closed_calls()]
-    response = flask.jsonify(data)
+    calls = anubis.calls.get_closed_calls()
+    etag = get_calls_etag(calls)
+    response = utils.get_not_modified(etag)
+    if response is None:
+        data = {
+            "$id": flask.request.url,
+            "timestamp": utils.get_now(),
+            "title": "All closed calls.",
+        }
+        data["calls"] = [get_call_json(c) for c in calls]
+        response = flask.jsonify(data)
     response.headers.add("Access-Control-Allow-Origin", "*")
-    return response
+    return utils.set_validators(response, etag, private=False)
+
+
+def get_calls_etag(calls):
+    """Return the ETag for the list of calls. The current user is irrelevant,
+    since the lists are public. No last modified datetime is used, since
+    calls leave the lists as time passes without being modified.
+    """
+    return utils.get_etag([[c["identifier"], c["_rev"]] for c in calls], user=False)
 
 
 def get_call_json(call):
@@ -51,3 +96,454 @@ def get_call_json(call):
         "description": call["description"],
         "labels": call.get("labels", []),
     }
+
+
+@blueprint.route("/calls/<cid>/proposals")
+def call_proposals(cid):
+    "Return JSON for a page of the proposals in the call."
+    call, error = get_call_access(cid, anubis.call.allow_view_proposals)
+    if error:
+        return error
+    if anubis.call.allow_view(call):
+        allow = None
+    else:
+        allow = anubis.proposal.allow_view
+    return get_page_response(
+        call,
+        "proposals",
+        "call_identifier",
+        allow,
+        get_proposal_json,
+        f"Proposals in call {cid}.",
+    )
+
+
+@blueprint.route("/calls/<cid>/reviews")
+def call_reviews(cid):
+    "Return JSON for a page of the reviews in the call."
+    call, error = get_call_access(cid, anubis.call.allow_view_reviews)
+    if error:
+        return error
+    return get_page_response(
+        call,
+        "reviews",
+        "call_proposal_reviewer",
+        anubis.review.allow_view,
+        get_review_json,
+        f"Reviews in call {cid}.",
+    )
+
+
+@blueprint.route("/calls/<cid>/decisions")
+def call_decisions(cid):
+    "Return JSON for a page of the decisions in the call."
+    call, error = get_call_access(cid, anubis.call.allow_view_decisions)
+    if error:
+        return error
+    return get_page_response(
+        call,
+        "decisions",
+        "call_proposal",
+        anubis.decision.allow_view,
+        get_decision_json,
+        f"Decisions in call {cid}.",
+    )
+
+
+@blueprint.route("/calls/<cid>/grants")
+def call_grants(cid):
+    "Return JSON for a page of the grants in the call."
+    call, error = get_call_access(cid, anubis.call.allow_view_grants)
+    if error:
+        return error
+    return get_page_response(
+        call,
+        "grants",
+        "call_identifier",
+        anubis.grant.allow_view,
+        get_grant_json,
+        f"Grants in call {cid}.",
+    )
+
+
+@blueprint.route("/calls/<cid>/changes")
+def call_changes(cid):
+    """Return JSON for the documents in the call changed since the given
+    'since' sequence value, which is the value 'since' of the previous
+    response. The doctypes may be given as a comma-separated list.
+    Only documents that the current user may view are included.
+    Deleted documents are given by identifier and doctype only.
+    """
+    call, error = get_call_access(cid, anubis.call.allow_view)
+    if error:
+        return error
+    doctypes = flask.request.args.get("doctype")
+    if doctypes:
+        doctypes = [d.strip() for d in doctypes.split(",") if d.strip()]
+    else:
+        doctypes = list(constants.API_CHANGES_DOCTYPES)
+    if set(doctypes).difference(constants.API_CHANGES_DOCTYPES):
+        return get_error_response("Invalid 'doctype' value.", 400)
+    try:
+        limit = int(flask.request.args.get("limit") or constants.API_PAGE_LIMIT)
+        if limit <= 0:
+            raise ValueError
+        limit = min(limit, constants.API_PAGE_MAX_LIMIT)
+    except ValueError:
+        return get_error_response("Invalid 'limit' value.", 400)
+    since = flask.request.args.get("since") or None
+
+    # Deleted documents keep their doctype and call; see 'database.delete'.
+    selector = {"doctype": {"$in": doctypes}, "call": cid}
+    try:
+        result = anubis.database.get_changes(selector, since=since, limit=limit)
+    except (couchdb2.CouchDB2Exception, OSError):
+        return get_error_response("Invalid 'since' value.", 400)
+
+    items = []
+    for change in result["results"]:
+        rev = change["changes"][0]["rev"]
+        doc = change["doc"]
+        if change.get("deleted"):
+            items.append(
+                {
+                    "id": change["id"],
+                    "rev": rev,
+                    "doctype": doc["doctype"],
+                    "deleted": True,
+                }
+            )
+            continue
+        allow_func, item_func = CHANGES_DOCTYPES[doc["doctype"]]
+        if not allow_func(doc):
+            continue
+        items.append(
+            {
+                "id": change["id"],
+                "rev": rev,
+                "doctype": doc["doctype"],
+                "item": item_func(call, doc),
+            }
+        )
+    since = result["last_seq"]
+    response = flask.jsonify(
+        {
+            "$id": flask.request.url,
+            "timestamp": utils.get_now(),
+            "title": f"Changes in call {cid}.",
+            "call": {
+                "identifier": cid,
+                "href": flask.url_for("call.display", cid=cid, _external=True),
+            },
+            "items": items,
+            "since": since,
+            "pending": result.get("pending", 0),
+            "next": flask.url_for(
+                "api.call_changes",
+                cid=cid,
+                since=since,
+                doctype=",".join(doctypes),
+                limit=limit,
+                _external=True,
+            ),
+        }
+    )
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+@blueprint.route("/calls/<cid>/events")
+def call_events(cid):
+    """Stream server-sent events for the proposals, reviews and decisions
+    in the call that change, for those that the current user may view.
+    A deleted document gives a 'deleted' event with its id and doctype.
+    The stream is closed after a while; the browser then reconnects,
+    giving the id of the last event, so that no events are lost.
+    If too many streams are open in this server process, 503 is returned,
+    which makes the browser stop trying.
+    """
+    _, error = get_call_access(cid, anubis.call.allow_view)
+    if error:
+        return error
+    if not _streams.acquire(blocking=False):
+        response = get_error_response("Too many live update streams.", 503)
+        response.headers["Retry-After"] = str(constants.EVENTS_STREAM_DURATION)
+        return response
+    selector = {
+        "call": cid,
+        "doctype": {
+            "$in": [constants.PROPOSAL, constants.REVIEW, constants.DECISION]
+        },
+    }
+    since = flask.request.headers.get("Last-Event-ID") or "now"
+
+    def generate(since):
+        stop = time.monotonic() + constants.EVENTS_STREAM_DURATION
+        yield f"retry: {constants.EVENTS_RETRY * 1000}\n\n"
+        while time.monotonic() < stop:
+            result = anubis.database.get_changes(
+                selector, since=since, timeout=constants.EVENTS_POLL_TIMEOUT
+            )
+            since = result["last_seq"]
+            events = []
+            for change in result["results"]:
+                doc = change["doc"]
+                # Deleted documents keep only their doctype and call.
+                if change.get("deleted"):
+                    data = {"id": change["id"], "doctype": doc["doctype"]}
+                    events.append((change["seq"], "deleted", data))
+                    continue
+                allow_func, event_func = EVENTS_DOCTYPES[doc["doctype"]]
+                if allow_func(doc):
+                    events.append((change["seq"], doc["doctype"], event_func(doc)))
+            if not events:  # Keep the connection alive through proxies.
+                yield ": keepalive\n\n"
+            for seq, name, data in events:
+                yield f"id: {seq}\nevent: {name}\ndata: {json.dumps(data)}\n\n"
+
+    response = flask.Response(
+        flask.stream_with_context(generate(since)), mimetype="text/event-stream"
+    )
+    # Released when the server has finished with the response.
+    response.call_on_close(_streams.release)
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Disable buffering in nginx.
+    return response
+
+
+def get_call_access(cid, allow_func):
+    """Return the call and None if the current user may access the list.
+    Otherwise return None and a JSON error response.
+    """
+    if not flask.g.current_user:
+        return None, get_error_response("Authentication required.", 401)
+    call = anubis.call.get_call(cid)
+    if call is None:
+        return None, get_error_response("No such call.", 404)
+    if not allow_func(call):
+        return None, get_error_response("Access not allowed.", 403)
+    return call, None
+
+
+def get_error_response(message, status):
+    "Return a JSON response for the error."
+    response = flask.jsonify({"error": message, "status": status})
+    response.status_code = status
+    return response
+
+
+def get_page_response(call, designname, viewname, allow_func, item_func, title):
+    """Return the JSON response for a page of the items in the view
+    for the call. The keys of the view start with the call identifier
+    and are unique; the value of each row is the revision of the document.
+    The ETag is computed from the keys and revisions of the rows, and the
+    link to the next page, if any, so an unchanged page is answered with 304 without fetching any documents.
+    The 'allow_func', if any, is used to filter the documents.
+    """
+    cid = call["identifier"]
+    try:
+        limit = int(flask.request.args.get("limit") or constants.API_PAGE_LIMIT)
+        if limit <= 0:
+            raise ValueError
+        limit = min(limit, constants.API_PAGE_MAX_LIMIT)
+        startkey = decode_cursor(cid, flask.request.args.get("cursor"))
+    except ValueError:
+        return get_error_response("Invalid 'limit' or 'cursor' value.", 400)
+
+    rows = list(
+        flask.g.db.view(
+            designname,
+            viewname,
+            startkey=startkey,
+            endkey=[cid, constants.CEILING],
+            limit=limit + 1,
+            reduce=False,
+        )
+    )
+    if len(rows) > limit:
+        next_url = flask.url_for(
+            flask.request.endpoint,
+            cid=cid,
+            cursor=encode_cursor(rows[limit].key),
+            limit=limit,
+            _external=True,
+        )
+        rows = rows[:limit]
+    else:
+        next_url = None
+
+    digest = hashlib.sha256()
+    digest.update(flask.g.current_user["username"].encode("utf-8"))
+    digest.update(call["_rev"].encode("utf-8"))
+    for row in rows:
+        digest.update(row.id.encode("utf-8"))
+        digest.update(row.value.encode("utf-8"))
+    digest.update((next_url or "").encode("utf-8"))
+    etag = digest.hexdigest()
+    if flask.request.if_none_match.contains(etag):
+        response = flask.make_response("", 304)
+    else:
+        docs = flask.g.db.get_bulk([row.id for row in rows])
+        docs = [d for d in docs if d is not None]
+        if allow_func:
+            docs = [d for d in docs if allow_func(d)]
+        data = {
+            "$id": flask.request.url,
+            "timestamp": utils.get_now(),
+            "title": title,
+            "call": {
+                "identifier": cid,
+                "href": flask.url_for("call.display", cid=cid, _external=True),
+            },
+            "items": [item_func(call, d) for d in docs],
+            "next": next_url,
+        }
+        response = flask.jsonify(data)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def encode_cursor(key):
+    "Return the cursor string for the view key."
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cid, cursor):
+    """Return the view key for the cursor string, or the first key
+    for the call if no cursor. Raise ValueError if invalid.
+    """
+    if not cursor:
+        return [cid, ""]
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(key, list) or len(key) < 2 or key[0] != cid:
+        raise ValueError("Invalid cursor.")
+    if not all(isinstance(k, str) for k in key):
+        raise ValueError("Invalid cursor.")
+    return key
+
+
+def get_values_json(doc, fields, endpoint, **kwargs):
+    """Return a dictionary for JSON output of the field values in the document.
+    The value of a document field is the URL to fetch it.
+    """
+    types = {f["identifier"]: f["type"] for f in fields}
+    result = {}
+    for fid, value in doc.get("values", {}).items():
+        # Repeated fields have identifiers with a suffix '-N'.
+        field_type = types.get(fid) or types.get(fid.rsplit("-", 1)[0])
+        if value is not None and field_type == constants.DOCUMENT:
+            value = flask.url_for(endpoint, fid=fid, _external=True, **kwargs)
+        result[fid] = value
+    return result
+
+
+def get_proposal_json(call, proposal):
+    "Return a dictionary for JSON output of a proposal."
+    pid = proposal["identifier"]
+    return {
+        "identifier": pid,
+        "title": proposal.get("title"),
+        "href": flask.url_for("proposal.display", pid=pid, _external=True),
+        "user": proposal["user"],
+        "submitted": proposal.get("submitted"),
+        "modified": proposal["modified"],
+        "values": get_values_json(
+            proposal, call["proposal"], "proposal.document", pid=pid
+        ),
+    }
+
+
+def get_review_json(call, review):
+    "Return a dictionary for JSON output of a review."
+    iuid = review["_id"]
+    return {
+        "iuid": iuid,
+        "href": flask.url_for("review.display", iuid=iuid, _external=True),
+        "proposal": review["proposal"],
+        "reviewer": review["reviewer"],
+        "finalized": review.get("finalized"),
+        "modified": review["modified"],
+        "values": get_values_json(
+            review, call["review"], "review.document", iuid=iuid
+        ),
+    }
+
+
+def get_decision_json(call, decision):
+    "Return a dictionary for JSON output of a decision."
+    iuid = decision["_id"]
+    return {
+        "iuid": iuid,
+        "href": flask.url_for("decision.display", iuid=iuid, _external=True),
+        "proposal": decision["proposal"],
+        "verdict": decision.get("verdict"),
+        "finalized": decision.get("finalized"),
+        "modified": decision["modified"],
+        "values": get_values_json(
+            decision, call["decision"], "decision.document", iuid=iuid
+        ),
+    }
+
+
+def get_grant_json(call, grant):
+    "Return a dictionary for JSON output of a grant."
+    gid = grant["identifier"]
+    return {
+        "identifier": gid,
+        "href": flask.url_for("grant.display", gid=gid, _external=True),
+        "proposal": grant["proposal"],
+        "user": grant["user"],
+        "complete": not grant.get("errors"),
+        "modified": grant["modified"],
+        "values": get_values_json(grant, call["grant"], "grant.document", gid=gid),
+    }
+
+
+# Key: doctype; value: (allow view function, JSON output function).
+CHANGES_DOCTYPES = {
+    constants.PROPOSAL: (anubis.proposal.allow_view, get_proposal_json),
+    constants.REVIEW: (anubis.review.allow_view, get_review_json),
+    constants.DECISION: (anubis.decision.allow_view, get_decision_json),
+    constants.GRANT: (anubis.grant.allow_view, get_grant_json),
+}
+
+
+def get_proposal_event(proposal):
+    "Return the data of the server-sent event for a proposal."
+    return {
+        "identifier": proposal["identifier"],
+        "submitted": bool(proposal.get("submitted")),
+    }
+
+
+def get_review_event(review):
+    "Return the data of the server-sent event for a review."
+    return {
+        "iuid": review["_id"],
+        "proposal": review["proposal"],
+        "reviewer": review["reviewer"],
+        "finalized": bool(review.get("finalized")),
+        "status": str(anubis.display.review_status(review)),
+    }
+
+
+def get_decision_event(decision):
+    "Return the data of the server-sent event for a decision."
+    return {
+        "iuid": decision["_id"],
+        "proposal": decision["proposal"],
+        "finalized": bool(decision.get("finalized")),
+        "link": str(anubis.display.decision_link(decision, small=True)),
+    }
+
+
+# Key: doctype; value: (allow view function, event data function).
+EVENTS_DOCTYPES = {
+    constants.PROPOSAL: (anubis.proposal.allow_view, get_proposal_event),
+    constants.REVIEW: (anubis.review.allow_view, get_review_event),
+    constants.DECISION: (anubis.decision.allow_view, get_decision_event),
+}
@@ -0,0 +1,195 @@
+"""Content-addressed store for attachment files, in a local directory.
+
+If the directory is configured, a file added to a document is stored in it
+under the SHA-256 digest of its content, instead of as a CouchDB attachment.
+The same file uploaded to many documents is stored only once. A document
+refers to its files in the item 'blobs', keyed by filename, with the same
+information as the CouchDB attachment stubs.
+
+The references to a file are counted by a view. When a reference is removed,
+the file is deleted if no document refers to it, unless it was stored very
+recently, since another document being saved may be about to refer to it.
+Files left without references are removed by the CLI command 'blobs --collect'.
+
+The CouchDB attachments of documents created before the store was configured
+are still used, and may be moved into the store by the CLI command
+'blobs --migrate'.
+"""
+
+import hashlib
+import os
+import os.path
+import shutil
+import tempfile
+import time
+
+import flask
+
+from anubis import constants
+
+
+def is_enabled(app=None):
+    "Is the content-addressed store configured?"
+    if app is None:
+        app = flask.current_app
+    return bool(app.config.get("BLOB_STORE_DIRPATH"))
+
+
+def get_path(digest, app=None):
+    "Return the path of the file with the given digest in the store."
+    if app is None:
+        app = flask.current_app
+    hexdigest = digest.split("-", 1)[1]
+    return os.path.join(
+        app.config["BLOB_STORE_DIRPATH"], hexdigest[:2], hexdigest[2:4], hexdigest
+    )
+
+
+def get_stub(content, mimetype):
+    """Return the stub for the content, which is bytes or a seekable file.
+    The digest is computed by reading the content in chunks.
+    """
+    digest = hashlib.sha256()
+    if isinstance(content, bytes):
+        digest.update(content)
+        length = len(content)
+    else:
+        content.seek(0)
+        length = 0
+        for chunk in iter(lambda: content.read(constants.BLOB_CHUNK_SIZE), b""):
+            digest.update(chunk)
+            length += len(chunk)
+        content.seek(0)
+    return {
+        "content_type": mimetype or constants.BINARY_MIMETYPE,
+        "length": length,
+        "digest": f"sha256-{digest.hexdigest()}",
+    }
+
+
+def get_stubs(doc):
+    "Return the stubs for all files of the document, in the database or the store."
+    result = dict(doc.get("_attachments") or {})
+    result.update(doc.get("blobs") or {})
+    return result
+
+
+def store(content, digest):
+    """Store the content, which is bytes or a seekable file, unless already there.
+    The file is written to a temporary file which is then renamed, so that
+    a partially written file is never visible under its digest.
+    """
+    path = get_path(digest)
+    if os.path.exists(path):
+        # Mark as recently used, to protect it from deletion just now.
+        os.utime(path)
+        return
+    dirpath = os.path.dirname(path)
+    os.makedirs(dirpath, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=dirpath, delete=False) as outfile:
+        if isinstance(content, bytes):
+            outfile.write(content)
+        else:
+            content.seek(0)
+            shutil.copyfileobj(content, outfile, constants.BLOB_CHUNK_SIZE)
+    os.replace(outfile.name, path)
+
+
+def get_attachment(doc, filename, db=None, app=None):
+    """Return a file-like object containing the content of the file.
+    Raise KeyError if no such file for the document.
+    """
+    blob = (doc.get("blobs") or {}).get(filename)
+    if blob:
+        return open(get_path(blob["digest"], app=app), "rb")
+    if filename not in (doc.get("_attachments") or {}):
+        raise KeyError(filename)
+    return (db or flask.g.db).get_attachment(doc, filename)
+
+
+def send_attachment(doc, filename, download_name):
+    """Return a response with the content of the file as attachment.
+    Raise KeyError if no such file for the document.
+    """
+    stub = get_stubs(doc)[filename]
+    blob = (doc.get("blobs") or {}).get(filename)
+    if blob:
+        return flask.send_file(
+            get_path(blob["digest"]),
+            mimetype=stub["content_type"],
+            as_attachment=True,
+            download_name=download_name,
+            etag=blob["digest"],
+        )
+    outfile = flask.g.db.get_attachment(doc, filename)
+    response = flask.make_response(outfile.read())
+    response.headers.set("Content-Type", stub["content_type"])
+    response.headers.set("Content-Disposition", "attachment", filename=download_name)
+    return response
+
+
+def get_reference_count(digest):
+    "Return the number of references to the file in documents."
+    rows = list(flask.g.db.view("blobs", "digest", key=digest, reduce=True))
+    if rows:
+        return rows[0].value
+    return 0
+
+
+def release(digests):
+    "Delete those files that are no longer referred to, and not recently stored."
+    if not is_enabled():
+        return
+    for digest in set(digests):
+        if get_reference_count(digest):
+            continue
+        remove(get_path(digest))
+
+
+def remove(path):
+    "Remove the file, unless it was stored or used very recently."
+    try:
+        if os.path.getmtime(path) > time.time() - constants.BLOB_GRACE_PERIOD:
+            return False
+        os.remove(path)
+    except OSError:
+        return False
+    return True
+
+
+def collect():
+    """Remove the files in the store which no document refers to.
+    Return the number of files removed.
+    """
+    referenced = {row.key for row in flask.g.db.view("blobs", "digest", group=True)}
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(
+        flask.current_app.config["BLOB_STORE_DIRPATH"]
+    ):
+        for filename in filenames:
+            if f"sha256-{filename}" in referenced:
+                continue
+            if remove(os.path.join(dirpath, filename)):
+                count += 1
+    return count
+
+
+def get_docs_with_attachments(limit=None):
+    "Return the identifiers of documents that have CouchDB attachments."
+    return [row.id for row in flask.g.db.view("blobs", "attachments", limit=limit)]
+
+
+def migrate(doc):
+    """Move the CouchDB attachments of the document into the store.
+    Removing the attachments from the document deletes them in the database.
+    Raise couchdb2.RevisionError if the document was modified meanwhile;
+    any files already stored are then removed by 'collect'.
+    """
+    blobs = doc.setdefault("blobs", {})
+    for filename, stub in (doc.get("_attachments") or {}).items():
+        content = flask.g.db.get_attachment(doc, filename)
+        blob = get_stub(content, stub["content_type"])
+        store(content, blob["digest"])
+        blobs[filename] = blob
+    doc.pop("_attachments", None)
+    flask.g.db.put(doc)
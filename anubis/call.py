@@ -13,11 +13,16 @@ system itself).  Change an open call with care.
 
 import copy
 import io
+import random
+import time
 import zipfile
 
+import couchdb2
 import flask
 
+import anubis.blobs
 import anubis.database
+import anubis.page_cache
 import anubis.proposal
 import anubis.proposals
 import anubis.user
@@ -60,12 +65,14 @@ KEY_IDENTIFIER = "identifier"
 
 def _get_email_lists(call):
     "Build email lists for call display."
-    reviewers = [anubis.user.get_user(r) for r in call[FIELD_REVIEWERS]]
+    access = [call["owner"]] + call.get(FIELD_ACCESS_VIEW, [])
+    users = anubis.user.get_users_lookup(call[FIELD_REVIEWERS] + access)
+    reviewers = [users[r] for r in call[FIELD_REVIEWERS] if r in users]
     reviewer_emails = [r["email"] for r in reviewers if r.get("email")]
 
     access_emails = []
-    for username in [call["owner"]] + call.get(FIELD_ACCESS_VIEW, []):
-        user = anubis.user.get_user(username=username)
+    for username in access:
+        user = users.get(username)
         if user and user.get("email"):
             access_emails.append(user["email"])
 
@@ -142,6 +149,13 @@ def display(cid):
     if not allow_view(call):
         return utils.error("You are not allowed to view the call.")
 
+    etag, _ = get_call_etag(
+        call, ["proposals", "reviews", "decisions", "grants"]
+    )
+    response = utils.get_not_modified(etag)
+    if response:
+        return response
+
     kwargs = dict(
         am_owner=am_owner(call),
         am_reviewer=am_reviewer(call),
@@ -153,6 +167,7 @@ def display(cid):
         allow_view_proposals=allow_view_proposals(call),
         allow_view_reviews=allow_view_reviews(call),
         allow_view_grants=allow_view_grants(call),
+        allow_send_email=allow_send_email(call),
         is_undefined=is_undefined(call),
         is_open=is_open(call),
         is_closed=is_closed(call),
@@ -169,7 +184,9 @@ def display(cid):
     )
     kwargs["archived_reviews_count"] = _get_archived_reviews_count(call)
 
-    return flask.render_template("call/display.html", call=call, **kwargs)
+    return utils.set_validators(
+        flask.render_template("call/display.html", call=call, **kwargs), etag
+    )
 
 
 @blueprint.route("/<cid>/edit", methods=["GET", "POST", "DELETE"])
@@ -220,6 +237,8 @@ def edit(cid):
         if not allow_delete(call):
             return utils.error("You are not allowed to delete the call.")
         anubis.database.delete(call)
+        delete_counter(call)
+        anubis.page_cache.clear()
         utils.flash_message(f"Deleted call {call['identifier']}:{call['title']}.")
         return flask.redirect(
             flask.url_for("calls.owner", username=flask.g.current_user["username"])
@@ -298,6 +317,28 @@ def documents(cid):
         return flask.redirect(flask.url_for("call.documents", cid=call["identifier"]))
 
 
+@blueprint.route("/<cid>/documents/<documentname>/<digest>")
+def document_digest(cid, documentname, digest):
+    """Download the given version of the document (attachment file).
+    It may be cached indefinitely, since the URL contains its digest.
+    If the digest is not that of the current version, redirect.
+    """
+    call = get_call(cid)
+    if not call:
+        return utils.error("No such call.")
+    if not allow_view(call):
+        return utils.error("You may not view the call.")
+    try:
+        stub = anubis.blobs.get_stubs(call)[documentname]
+    except KeyError:
+        return utils.error("No such document in call.")
+    if digest != utils.get_url_digest(stub["digest"]):
+        return flask.redirect(get_document_url(call, documentname))
+    response = anubis.blobs.send_attachment(call, documentname, documentname)
+    # A call which is not published must not be stored by shared caches.
+    return utils.set_immutable(response, private=not call.get("opens"))
+
+
 @blueprint.route("/<cid>/documents/<documentname>", methods=["GET", "POST", "DELETE"])
 def document(cid, documentname):
     "Download the given document (attachment file), or delete it."
@@ -309,14 +350,9 @@ def document(cid, documentname):
 
     if utils.http_GET():
         try:
-            stub = call["_attachments"][documentname]
+            return anubis.blobs.send_attachment(call, documentname, documentname)
         except KeyError:
             return utils.error("No such document in call.")
-        outfile = flask.g.db.get_attachment(call, documentname)
-        response = flask.make_response(outfile.read())
-        response.headers.set("Content-Type", stub["content_type"])
-        response.headers.set("Content-Disposition", "attachment", filename=documentname)
-        return response
 
     elif utils.http_DELETE():
         if not allow_edit(call):
@@ -643,6 +679,7 @@ def reset_counter(cid):
 
     with CallSaver(call) as saver:
         saver["counter"] = None
+    delete_counter(call)
     utils.flash_message("Counter for proposals in call reset.")
     return flask.redirect(flask.url_for("call.display", cid=call["identifier"]))
 
@@ -708,7 +745,7 @@ def logs(cid):
         "logs.html",
         title=f"Call {call['identifier']}",
         back_url=flask.url_for("call.display", cid=call["identifier"]),
-        logs=anubis.database.get_logs(call["_id"]),
+        **anubis.database.get_logs_page(call["_id"]),
     )
 
 
@@ -732,10 +769,15 @@ def create_proposal(cid):
                 flask.url_for("proposal.display", pid=proposal["identifier"])
             )
         else:
-            with anubis.proposal.ProposalSaver(
-                call=call, user=flask.g.current_user
-            ) as saver:
-                pass
+            try:
+                with anubis.proposal.ProposalSaver(
+                    call=call, user=flask.g.current_user
+                ) as saver:
+                    pass
+            except ValueError as error:
+                return utils.error(
+                    error, flask.url_for("call.display", cid=call["identifier"])
+                )
             return flask.redirect(
                 flask.url_for("proposal.edit", pid=saver.doc["identifier"])
             )
@@ -752,10 +794,18 @@ def call_zip(cid):
     if not (allow_view_details(call) or allow_view_grants(call)):
         return utils.error("You are not allowed to view the call proposals.")
 
+    etag, last_modified = get_call_etag(
+        call, ["proposals", "reviews", "decisions", "grants"]
+    )
+    response = utils.get_not_modified(etag)
+    if response:
+        return response
+
     proposals = anubis.proposals.get_call_proposals(call, submitted=True)
     output = io.BytesIO()
     with zipfile.ZipFile(output, "w") as zip:
-        zip.writestr(
+        utils.write_zip_file(
+            zip,
             f"{call['identifier']}_proposals.xlsx",
             anubis.proposals.get_call_xlsx(call, submitted=True),
         )
@@ -778,7 +828,7 @@ def call_zip(cid):
     response.headers.set(
         "Content-Disposition", "attachment", filename=f"{call['identifier']}.zip"
     )
-    return response
+    return utils.set_validators(response, etag, last_modified)
 
 
 class CallSaver(AccessSaverMixin, Saver):
@@ -786,6 +836,11 @@ class CallSaver(AccessSaverMixin, Saver):
 
     DOCTYPE = constants.CALL
 
+    def wrapup(self):
+        "Remove the cached pages for anonymous visitors, which may show the call."
+        super().wrapup()
+        anubis.page_cache.clear()
+
     def initialize(self):
         self.doc["owner"] = flask.g.current_user["username"]
         self.doc["opens"] = None
@@ -947,6 +1002,13 @@ class CallSaver(AccessSaverMixin, Saver):
             for e in form.get("extensions", "").split(",")
         ]
         field["extensions"] = [e for e in extensions if e]
+        try:
+            maxsize = int(form.get("maxsize"))
+            if maxsize <= 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            maxsize = None
+        field["maxsize"] = maxsize
 
     def _set_repeat_field_properties(self, field, form):
         """Set properties for REPEAT fields."""
@@ -1083,7 +1145,7 @@ class CallSaver(AccessSaverMixin, Saver):
 
     def add_document(self, infile, description):
         "Add a document to the call."
-        filename = self.add_attachment(infile.filename, infile.read(), infile.mimetype)
+        filename = self.add_attachment(infile.filename, infile.stream, infile.mimetype)
         for document in self.doc[FIELD_DOCUMENTS]:
             if document["name"] == filename:
                 document["description"] = description
@@ -1122,6 +1184,62 @@ def get_call(cid):
             return None
 
 
+def get_next_proposal_number(call):
+    """Return the next number for a proposal in the call.
+    The counter is kept in a separate document, so that the call document
+    is not modified when a proposal is created. Concurrent increments are
+    retried after a random delay when there is an update conflict.
+    A number is never given out twice, but there may be gaps in the sequence.
+    Raise ValueError if no number could be obtained.
+    """
+    docid = get_counter_docid(call)
+    for attempt in range(constants.COUNTER_MAX_ATTEMPTS):
+        try:
+            doc = flask.g.db[docid]
+        except couchdb2.NotFoundError:
+            # Continue from the counter in the call document, if it was set
+            # before the separate counter documents were introduced.
+            doc = {
+                "_id": docid,
+                "doctype": constants.COUNTER,
+                "call": call["identifier"],
+                "value": call.get("counter") or 0,
+            }
+        doc["value"] += 1
+        try:
+            flask.g.db.put(doc)
+        except couchdb2.RevisionError:
+            time.sleep(random.uniform(0, constants.COUNTER_BACKOFF * 2**attempt))
+        else:
+            return doc["value"]
+    raise ValueError("Could not obtain a number for the proposal; try again.")
+
+
+def get_counter_docid(call):
+    "Return the identifier of the proposal counter document for the call."
+    return f"counter_{call['identifier']}"
+
+
+def delete_counter(call):
+    "Delete the proposal counter document for the call, if any."
+    try:
+        flask.g.db.delete(flask.g.db[get_counter_docid(call)])
+    except couchdb2.NotFoundError:
+        pass
+
+
+def get_call_etag(call, designnames):
+    """Return the ETag for the current user and the last modified datetime
+    for a page or export of the call and its documents of the given designs.
+    The states of the call that change with time are included.
+    """
+    parts, last_modified = anubis.database.get_call_validators(call, designnames)
+    etag = utils.get_etag(
+        parts, is_open(call), is_closed(call), allow_view_decisions(call)
+    )
+    return etag, last_modified
+
+
 def get_banner_fields(fields):
     "Return fields flagged as banner fields. Avoid repeated fields."
     return [f for f in fields if f.get("banner") and not f.get("repeat")]
@@ -1144,6 +1262,24 @@ def allow_create(user=None):
     return bool(user.get("call_creator"))
 
 
+def get_document_url(call, documentname):
+    """Return the immutable URL for the document, which contains its digest.
+    If no such document, return the plain URL for it.
+    """
+    try:
+        stub = anubis.blobs.get_stubs(call)[documentname]
+    except KeyError:
+        return flask.url_for(
+            "call.document", cid=call["identifier"], documentname=documentname
+        )
+    return flask.url_for(
+        "call.document_digest",
+        cid=call["identifier"],
+        documentname=documentname,
+        digest=utils.get_url_digest(stub["digest"]),
+    )
+
+
 def allow_view(call):
     """The admin, staff and call owner may view any call.
     Others may view a call if it has an opens date, i.e. is published.
@@ -1213,6 +1349,17 @@ def allow_change_access(call):
     )
 
 
+def allow_send_email(call):
+    """The admin, staff and call owner may send bulk email to the reviewers,
+    submitters and grant receivers of the call, if email is configured.
+    """
+    if not flask.g.current_user:
+        return False
+    if not flask.current_app.config["MAIL_SERVER"]:
+        return False
+    return flask.g.am_admin or flask.g.am_staff or am_owner(call)
+
+
 def allow_view_details(call):
     """The admin, staff, call owner, reviewers and accounts with view access
     may view certain details of the call, such as call field definitions,
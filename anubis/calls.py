@@ -1,13 +1,10 @@
 "Lists of calls."
 
-import io
-
 import flask
-import xlsxwriter
 
 import anubis.call
 import anubis.database
-from anubis import constants
+import anubis.schedule
 from anubis import utils
 
 
@@ -17,8 +14,29 @@ blueprint = flask.Blueprint("calls", __name__)
 @blueprint.route("")
 @utils.staff_required
 def all():
-    "Display all calls."
-    return flask.render_template("calls/all.html", calls=get_all_calls())
+    """Display all calls.
+    The rows of the table are fetched page by page from 'all_json'.
+    """
+    return flask.render_template("calls/all.html")
+
+
+@blueprint.route("/all.json")
+@utils.staff_required
+def all_json():
+    """Return a page of the table of all calls; DataTables server-side.
+    The calls in memory in the call schedule are used for search and sort.
+    """
+    schedule = anubis.schedule.get_schedule()
+    calls = list(schedule.calls.values())
+    columns = ["identifier", "title", "opens", "closes", None, None, None]
+    return utils.get_datatables_response(
+        calls,
+        columns,
+        lambda page: utils.get_table_rows(
+            "calls/all_rows.html",
+            calls=schedule.get_calls([c["identifier"] for c in page]),
+        ),
+    )
 
 
 @blueprint.route("/all_xlsx")
@@ -108,18 +126,8 @@ def closed_xlsx():
 
 
 def get_closed_calls():
-    "Get all closed calls."
-    return [
-        r.doc
-        for r in flask.g.db.view(
-            "calls",
-            "closes",
-            startkey=utils.get_now(),
-            endkey="",
-            descending=True,
-            include_docs=True,
-        )
-    ]
+    "Get all closed calls, from the call schedule."
+    return anubis.schedule.get_schedule().get_closed_calls()
 
 
 @blueprint.route("/open")
@@ -143,20 +151,10 @@ def open_xlsx():
 
 
 def get_open_calls():
-    "Return a list of open calls, sorted according to configuration."
-    # It is more computationally efficient to use closes date for first selection.
-    result = [
-        r.doc
-        for r in flask.g.db.view(
-            "calls",
-            "closes",
-            startkey=utils.get_now(),
-            endkey=constants.CEILING,
-            include_docs=True,
-        )
-    ]
-    # Exclude not yet open calls.
-    result = [call for call in result if anubis.call.is_open(call)]
+    """Return a list of open calls, from the call schedule,
+    sorted according to configuration.
+    """
+    result = anubis.schedule.get_schedule().get_open_calls()
     order_key = flask.current_app.config["CALL_OPEN_ORDER_KEY"]
     # The possible values are listed in 'constants.CALL_ORDER_KEYS'
     if order_key == "closes":
@@ -189,20 +187,10 @@ def unpublished_xlsx():
 
 
 def get_unpublished_calls():
-    "Get all unpublished calls; undefined opens and/or closes date, or not yet open."
-    result = [r.doc for r in flask.g.db.view("calls", "undefined", include_docs=True)]
-    result.extend(
-        [
-            r.doc
-            for r in flask.g.db.view(
-                "calls",
-                "opens",
-                startkey=utils.get_now(),
-                endkey=constants.CEILING,
-                include_docs=True,
-            )
-        ]
-    )
+    """Get all unpublished calls; undefined opens and/or closes date, or not yet open.
+    From the call schedule.
+    """
+    result = anubis.schedule.get_schedule().get_unpublished_calls()
     result.sort(key=lambda c: c.get("closes") or "", reverse=True)
     return result
 
@@ -230,8 +218,10 @@ def reviews_xlsx():
 
 def get_reviews_calls():
     "Get all calls with reviews."
-    result = set([r.key for r in flask.g.db.view("reviews", "call", reduce=False)])
-    result = [anubis.call.get_call(c) for c in result]
+    counts = anubis.database.get_calls_counts()
+    result = anubis.database.get_docs_keys(
+        "calls", "identifier", [cid for cid, c in counts.items() if c["reviews"]]
+    )
     result.sort(key=lambda c: c.get("closes") or "", reverse=True)
     return result
 
@@ -259,24 +249,22 @@ def grants_xlsx():
 
 def get_grants_calls():
     "Get all calls with grants."
-    result = set([r.key for r in flask.g.db.view("grants", "call", reduce=False)])
-    result = [anubis.call.get_call(c) for c in result]
+    counts = anubis.database.get_calls_counts()
+    result = anubis.database.get_docs_keys(
+        "calls", "identifier", [cid for cid, c in counts.items() if c["grants"]]
+    )
     result.sort(key=lambda c: c.get("closes") or "", reverse=True)
     return result
 
 
 def get_calls_xlsx_response(filename, calls, counts=True):
     "Return the XLSX contents as a file attachment response."
-    response = flask.make_response(get_calls_xlsx(calls, counts=counts))
-    response.headers.set("Content-Type", constants.XLSX_MIMETYPE)
-    response.headers.set("Content-Disposition", "attachment", filename=filename)
-    return response
+    return utils.send_xlsx_file(get_calls_xlsx(calls, counts=counts), filename)
 
 
 def get_calls_xlsx(calls, counts):
-    "Return the content of an XLSX file for all closed calls."
-    output = io.BytesIO()
-    wb = xlsxwriter.Workbook(output, {"in_memory": True})
+    "Return a temporary file containing the XLSX file for the calls."
+    wb, outfile = utils.create_xlsx_workbook()
     formats = utils.create_xlsx_formats(wb)
     ws = wb.add_worksheet("Closed calls")
     ws.freeze_panes(1, 1)
@@ -284,7 +272,7 @@ def get_calls_xlsx(calls, counts):
     ws.set_column(0, 0, 16, formats["normal"])
     ws.set_column(1, 1, 60, formats["normal"])
     ws.set_column(2, 3, 20, formats["normal"])
-    ws.set_column(4, 6, 10, formats["normal"])
+    ws.set_column(4, 7, 10, formats["normal"])
 
     nrow = 0
     row = [
@@ -294,7 +282,7 @@ def get_calls_xlsx(calls, counts):
         f"Closes\n({flask.current_app.config['TIMEZONE']})",
     ]
     if counts:
-        row.extend(["# proposals", "# reviews", "# grants"])
+        row.extend(["# proposals", "# reviews", "# decisions", "# grants"])
     ws.write_row(nrow, 0, row)
     nrow += 1
 
@@ -318,25 +306,10 @@ def get_calls_xlsx(calls, counts):
         )
         ncol += 1
         if counts:
-            ws.write(
-                nrow,
-                ncol,
-                anubis.database.get_count("proposals", "call", call["identifier"]),
-            )
-            ncol += 1
-            ws.write(
-                nrow,
-                ncol,
-                anubis.database.get_count("reviews", "call", call["identifier"]),
-            )
-            ncol += 1
-            ws.write(
-                nrow,
-                ncol,
-                anubis.database.get_count("grants", "call", call["identifier"]),
-            )
-            ncol += 1
+            call_counts = anubis.database.get_call_counts(call["identifier"])
+            for key in ["proposals", "reviews", "decisions", "grants"]:
+                ws.write(nrow, ncol, call_counts[key])
+                ncol += 1
         nrow += 1
 
-    wb.close()
-    return output.getvalue()
+    return utils.close_xlsx_workbook(wb, outfile)
@@ -8,14 +8,18 @@ import click
 import couchdb2
 import flask
 
+import anubis.blobs
 import anubis.config
 import anubis.database
 import anubis.call
 import anubis.proposal
 import anubis.grant
+import anubis.outbox
+import anubis.reminders
 import anubis.user
 
 from anubis import constants
+from anubis import utils
 
 
 def set_db(app):
@@ -350,7 +354,7 @@ def attachments(identifier):
             doc = flask.g.db[identifier]
         except couchdb2.CouchDB2Exception as error:
             raise click.ClickException(error)
-        for filename, info in sorted(doc.get("_attachments", {}).items()):
+        for filename, info in sorted(anubis.blobs.get_stubs(doc).items()):
             click.echo(
                 f"{filename}\n  {info['content_type']}\n  {info['length']} bytes\n  {info['digest']}"
             )
@@ -373,10 +377,13 @@ def attachments_download(identifier, dumpdir):
             doc = flask.g.db[identifier]
         except couchdb2.CouchDB2Exception as error:
             raise click.ClickException(error)
-        for filename in sorted(doc.get("_attachments", {})):
+        for filename in sorted(anubis.blobs.get_stubs(doc)):
             filepath = join_dirpath(dumpdir, filename)
-            with open(filepath, "wb") as outfile:
-                outfile.write(flask.g.db.get_attachment(doc, filename).read())
+            with (
+                open(filepath, "wb") as outfile,
+                anubis.blobs.get_attachment(doc, filename) as infile,
+            ):
+                outfile.write(infile.read())
             click.echo(f"Downloaded {filepath}")
 
 
@@ -410,13 +417,149 @@ def attachment_delete(identifier, filename):
         except couchdb2.CouchDB2Exception as error:
             raise click.ClickException(error)
             raise click.ClickException(error)
-        if filename not in doc.get("_attachments", {}):
+        if filename in doc.get("blobs", {}):
+            blob = doc["blobs"].pop(filename)
+            flask.g.db.put(doc)
+            anubis.blobs.release([blob["digest"]])
+        elif filename in doc.get("_attachments", {}):
+            flask.g.db.delete_attachment(doc, filename)
+        else:
             raise click.ClickException(
                 "No such file {filename} in document {identifier}."
             )
-        flask.g.db.delete_attachment(doc, filename)
         click.echo(f"Deleted {filename} from document {identifier}.")
 
 
+@cli.command
+@click.option(
+    "--retry",
+    is_flag=True,
+    default=False,
+    help="Put the failed messages back in the outbox to be sent again.",
+)
+@click.option(
+    "--send",
+    is_flag=True,
+    default=False,
+    help="Send the messages that are due now, instead of waiting for the server.",
+)
+@click.option(
+    "--purge",
+    is_flag=True,
+    default=False,
+    help="Delete the failed messages.",
+)
+def outbox(retry, send, purge):
+    "Show the failed messages in the email outbox. Optionally retry, send or purge."
+    app = anubis.config.create_app()
+    with app.app_context():
+        set_db(app)
+        failed = [
+            r.doc
+            for r in flask.g.db.view(
+                "messages", "failed", include_docs=True, reduce=False
+            )
+        ]
+        for message in failed:
+            click.echo(
+                f"{message['created']} {', '.join(message['recipients'])}:"
+                f" {message['title']} ({message.get('error')})"
+            )
+            if retry:
+                message["status"] = anubis.outbox.PENDING
+                message["attempts"] = 0
+                message["due"] = utils.get_now()
+                flask.g.db.put(message)
+        click.echo(f"{len(failed)} failed messages{retry and '; retrying' or ''}.")
+        if purge and not retry:
+            click.echo(f"Deleted {anubis.outbox.purge_failed()} failed messages.")
+        if send:
+            anubis.outbox.drain()
+
+
+@cli.command
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    default=False,
+    help="Only report the due reminders and their recipients; send nothing.",
+)
+@click.option(
+    "--days",
+    type=str,
+    default=None,
+    help="Comma-separated days before deadlines, instead of REMINDER_DAYS.",
+)
+def reminders(dry_run, days):
+    "Send the due reminders for unsubmitted proposals and unfinalized reviews."
+    app = anubis.config.create_app()
+    with app.app_context():
+        set_db(app)
+        if days is None:
+            days = anubis.reminders.get_days()
+        else:
+            days = sorted({int(d) for d in days.split(",") if d.strip()})
+        if not days:
+            raise click.ClickException("No days before deadlines given.")
+        campaigns = anubis.reminders.get_due_campaigns(days=days)
+        for campaign in campaigns:
+            if dry_run:
+                recipients = anubis.reminders.get_recipients(campaign)
+                click.echo(
+                    f"{campaign['identifier']}: deadline {campaign['deadline']},"
+                    f" {len(recipients)} recipients"
+                )
+                for recipient in recipients:
+                    click.echo(
+                        f"  {recipient['username']} <{recipient['email']}>:"
+                        f" {recipient['count']}"
+                    )
+            else:
+                try:
+                    count = anubis.reminders.send(campaign)
+                except ValueError as error:
+                    raise click.ClickException(error)
+                click.echo(f"{campaign['identifier']}: {count} messages in outbox.")
+        if not campaigns:
+            click.echo("No reminders due.")
+
+
+@cli.command
+@click.option(
+    "--migrate",
+    is_flag=True,
+    default=False,
+    help="Move the attachments in CouchDB into the content-addressed store.",
+)
+@click.option(
+    "--collect",
+    is_flag=True,
+    default=False,
+    help="Remove the files in the store that no document refers to.",
+)
+def blobs(migrate, collect):
+    "Show the number of documents with attachments still in CouchDB."
+    app = anubis.config.create_app()
+    with app.app_context():
+        set_db(app)
+        if (migrate or collect) and not anubis.blobs.is_enabled():
+            raise click.ClickException("BLOB_STORE_DIRPATH is not configured.")
+        docids = anubis.blobs.get_docs_with_attachments()
+        if migrate:
+            count = 0
+            for docid in docids:
+                try:
+                    anubis.blobs.migrate(flask.g.db[docid])
+                except couchdb2.CouchDB2Exception as error:
+                    click.echo(f"Could not migrate {docid}: {error}", err=True)
+                else:
+                    count += 1
+            click.echo(f"{count} documents with attachments migrated.")
+        else:
+            click.echo(f"{len(docids)} documents with attachments in CouchDB.")
+        if collect:
+            click.echo(f"{anubis.blobs.collect()} unreferenced files removed.")
+
+
 if __name__ == "__main__":
     cli()
@@ -16,6 +16,7 @@ import werkzeug.routing
 
 from anubis import constants
 from anubis import utils
+import anubis.blobs
 import anubis.database
 
 
@@ -38,6 +39,12 @@ DEFAULT_CONFIG = dict(
     MAIL_PASSWORD=None,  # Email server account password.
     MAIL_DEFAULT_SENDER=None,  # Email address from which Anubis emails are sent.
     MAIL_REPLY_TO=None,  # If different from default sender.
+    PAGE_CACHE_TTL=60,  # Seconds to cache pages for anonymous visitors; 0 disables.
+    EXTERNAL_URL=None,  # Base URL of the site, for links in emails sent by the server.
+    REMINDER_DAYS="",  # Days before deadlines to send reminders, e.g. "7,1".
+    DOCUMENT_MAX_SIZE=20,  # Megabytes; default max size of an uploaded document.
+    REQUEST_MAX_SIZE=100,  # Megabytes; larger requests are refused unread.
+    BLOB_STORE_DIRPATH=None,  # Directory for attachment files; None: in CouchDB.
 )
 
 
@@ -201,13 +208,17 @@ def init_from_db(app):
     for filename in constants.SITE_FILES:
         key = f"SITE_{filename.upper()}"
         try:
-            filestub = configuration["_attachments"][filename]
-            infile = db.get_attachment(configuration, filename)
-        except (KeyError, couchdb2.NotFoundError):
+            filestub = anubis.blobs.get_stubs(configuration)[filename]
+            infile = anubis.blobs.get_attachment(
+                configuration, filename, db=db, app=app
+            )
+        except (KeyError, OSError, couchdb2.NotFoundError):
             app.config.pop(key, None)
         else:
+            with infile:
+                content = infile.read()
             app.config[key] = {
-                "content": infile.read(),
+                "content": content,
                 "mimetype": filestub["content_type"],
                 "etag": filestub["digest"],
                 "modified": modified,
@@ -1,11 +1,15 @@
 "CouchDB operations."
 
+import datetime
 import mimetypes
 import os.path
 
 import couchdb2
+import dateutil.parser
 import flask
 
+import anubis.blobs
+import anubis.page_cache
 from anubis import constants
 from anubis import utils
 from anubis.saver import Saver
@@ -20,6 +24,11 @@ class MetaSaver(Saver):
         "No log entries for meta documents."
         pass
 
+    def wrapup(self):
+        "Remove the cached pages for anonymous visitors, which may show the value."
+        super().wrapup()
+        anubis.page_cache.clear()
+
 
 def get_server(app=None):
     "Get a connection to the CouchDB server."
@@ -58,6 +67,10 @@ def update_design_documents(app):
         app.logger.info("Updated 'logs' CouchDB design document.")
     if db.put_design("meta", META_DESIGN_DOC):
         app.logger.info("Updated 'meta' CouchDB design document.")
+    if db.put_design("messages", MESSAGES_DESIGN_DOC):
+        app.logger.info("Updated 'messages' CouchDB design document.")
+    if db.put_design("blobs", BLOBS_DESIGN_DOC):
+        app.logger.info("Updated 'blobs' CouchDB design document.")
 
 
 def get_doc(identifier):
@@ -95,7 +108,111 @@ def get_docs(designname, viewname, key):
     result = [
         r.doc for r in flask.g.db.view(designname, viewname, key=key, include_docs=True)
     ]
-    for doc in result:
+    cache_docs(result)
+    return result
+
+
+def get_docs_keys(designname, viewname, keys):
+    """Get the documents for all the given keys from the view in one request.
+    Add them to the cache.
+    """
+    keys = sorted({k for k in keys if k})
+    if not keys:
+        return []
+    result = [
+        r.doc
+        for r in get_view_rows(
+            designname, viewname, keys, reduce=False, include_docs=True
+        )
+    ]
+    cache_docs(result)
+    return result
+
+
+def get_view_rows(designname, viewname, keys, reduce=None, include_docs=False):
+    """Return the rows of the view for all the given keys in one request.
+    The keys are sent in the body of a POST request, since couchdb2 puts
+    them in the URL, which may then be too long for the server or a proxy.
+    """
+    params = {}
+    if reduce is not None:
+        params["reduce"] = "true" if reduce else "false"
+    if include_docs:
+        params["include_docs"] = "true"
+    response = flask.g.db.server._POST(
+        flask.g.db.name,
+        "_design",
+        designname,
+        "_view",
+        viewname,
+        params=params,
+        json={"keys": keys},
+    )
+    return [
+        couchdb2.Row(r.get("id"), r.get("key"), r.get("value"), r.get("doc"))
+        for r in response.json()["rows"]
+    ]
+
+
+def get_docs_chunks(designname, viewname, key, size=constants.EXPORT_CHUNK_SIZE):
+    """Yield the documents from the view in lists of at most the given size,
+    each fetched by a separate request, in the order of the view key.
+    The view must have unique array keys starting with the given key,
+    such as the paging views. Each request starts at the key of the last row
+    of the previous one, instead of skipping rows, so that every request
+    is equally fast. The documents are not added to the cache.
+    """
+    startkey = [key, ""]
+    skip = 0
+    while True:
+        rows = list(
+            flask.g.db.view(
+                designname,
+                viewname,
+                startkey=startkey,
+                endkey=[key, constants.CEILING],
+                skip=skip,
+                limit=size,
+                reduce=False,
+                include_docs=True,
+            )
+        )
+        if rows:
+            yield [r.doc for r in rows]
+        if len(rows) < size:
+            break
+        # Skip only the row already returned, which has a unique key.
+        startkey = rows[-1].key
+        skip = 1
+
+
+def get_changes(selector, since=None, limit=None, include_docs=True, timeout=None):
+    """Return the result of the changes feed for the documents matching
+    the Mango selector, optionally only those after the 'since' sequence.
+    If a timeout (seconds) is given, wait until there is a change or
+    the timeout has passed ('longpoll' feed).
+    The request is made directly, since couchdb2 JSON-encodes the 'since'
+    parameter, while CouchDB expects the opaque sequence string as is.
+    """
+    params = {"filter": "_selector"}
+    if timeout:
+        params["feed"] = "longpoll"
+        params["timeout"] = str(int(timeout * 1000))
+    if include_docs:
+        params["include_docs"] = "true"
+    if since:
+        params["since"] = since
+    if limit:
+        params["limit"] = str(limit)
+    response = flask.g.db.server._POST(
+        flask.g.db.name, "_changes", params=params, json={"selector": selector}
+    )
+    return response.json()
+
+
+def cache_docs(docs):
+    "Add the documents to the cache according to their doctype."
+    for doc in docs:
         if doc.get("doctype") == constants.CALL:
             utils.cache_put(f"call {doc['identifier']}", doc)
         elif doc.get("doctype") == constants.PROPOSAL:
@@ -112,7 +229,6 @@ def get_docs(designname, viewname, key):
                 utils.cache_put(f"email {doc['email']}", doc)
             if doc.get("orcid"):
                 utils.cache_put(f"orcid {doc['orcid']}", doc)
-    return result
 
 
 def get_count(designname, viewname, key=None):
@@ -127,6 +243,60 @@ def get_count(designname, viewname, key=None):
         return 0
 
 
+def get_calls_counts():
+    """Get the number of proposals, reviews, decisions and grants for all calls.
+    This uses one grouped query per entity, instead of one query per call.
+    Return a dictionary keyed by call identifier. The result is cached.
+    """
+    try:
+        return utils.cache_get("calls counts")
+    except KeyError:
+        pass
+    result = {}
+    for designname in ["proposals", "reviews", "decisions", "grants"]:
+        for row in flask.g.db.view(designname, "call", group_level=1, reduce=True):
+            counts = result.setdefault(
+                row.key, {"proposals": 0, "reviews": 0, "decisions": 0, "grants": 0}
+            )
+            counts[designname] = row.value
+    return utils.cache_put("calls counts", result)
+
+
+def get_call_counts(cid):
+    "Get the number of proposals, reviews, decisions and grants for the call."
+    return get_calls_counts().get(cid) or {
+        "proposals": 0,
+        "reviews": 0,
+        "decisions": 0,
+        "grants": 0,
+    }
+
+
+def get_call_validators(call, designnames):
+    """Return the parts for an ETag and the last modified datetime for the
+    documents of the given designs in the call, as obtained by the reduce
+    views 'call_modified'. The number of documents is included to
+    detect deletions. This is much cheaper than fetching the documents.
+    """
+    parts = [call["_rev"]]
+    last_modified = [dateutil.parser.isoparse(call["modified"])]
+    for designname in designnames:
+        result = flask.g.db.view(
+            designname, "call_modified", key=call["identifier"], reduce=True
+        )
+        if result:
+            stats = result[0].value
+            parts.append([stats["count"], stats["max"]])
+            last_modified.append(
+                datetime.datetime.fromtimestamp(
+                    stats["max"] / 1000.0, tz=datetime.UTC
+                )
+            )
+        else:
+            parts.append([0, None])
+    return parts, max(last_modified)
+
+
 def get_counts():
     "Get the total number of some entities."
     return dict(
@@ -161,14 +331,70 @@ def get_logs(docid, cleanup=True):
     return result
 
 
+def get_logs_page(docid):
+    """Return a dictionary containing a page of the log entries for the given
+    document identifier, sorted by reverse timestamp, and the cursor for the
+    next page, for use in the template 'logs.html'.
+    The cursor is given by the request arguments: 'before' is the timestamp
+    of the first entry in the page, and 'skip' is the number of entries
+    with that timestamp already displayed. The page size is given by 'limit'.
+    Only the entries in the page are fetched, regardless of the total number.
+    """
+    before = flask.request.args.get("before") or None
+    try:
+        skip = max(0, int(flask.request.args.get("skip") or 0))
+        limit = int(flask.request.args.get("limit") or constants.LOGS_PAGE_SIZE)
+    except ValueError:
+        skip = 0
+        limit = constants.LOGS_PAGE_SIZE
+    limit = max(1, min(limit, constants.LOGS_MAX_PAGE_SIZE))
+    # Get one more than the page size to find the cursor for the next page.
+    rows = list(
+        flask.g.db.view(
+            "logs",
+            "doc",
+            startkey=[docid, before or constants.CEILING],
+            endkey=[docid],
+            descending=True,
+            skip=skip or None,
+            limit=limit + 1,
+            include_docs=True,
+        )
+    )
+    logs = [r.doc for r in rows[:limit]]
+    for log in logs:
+        for key in ["_id", "_rev", "doctype", "docid"]:
+            log.pop(key)
+    result = {"logs": logs, "next_before": None, "next_skip": None, "limit": limit}
+    if len(rows) > limit:
+        result["next_before"] = rows[limit].key[1]
+        result["next_skip"] = len(
+            [log for log in logs if log["timestamp"] == result["next_before"]]
+        )
+        if result["next_before"] == before:
+            result["next_skip"] += skip
+    return result
+
+
 def delete(doc):
     """Delete the given document and all its log entries.
+    The deleted document keeps its doctype and call, if any, so that
+    the changes feed for a call can select the deletions in that call.
     NOTE: This implementation should be fast, but leaves the deleted documents
     in CouchDB. These are removed whenever a database compaction is done.
     """
     for log in get_logs(doc["_id"], cleanup=False):
         flask.g.db.delete(log)
-    flask.g.db.delete(doc)
+    tombstone = {
+        "_id": doc["_id"],
+        "_rev": doc["_rev"],
+        "_deleted": True,
+        "doctype": doc.get("doctype"),
+    }
+    if doc.get("call"):
+        tombstone["call"] = doc["call"]
+    flask.g.db.put(tombstone)
+    anubis.blobs.release([b["digest"] for b in (doc.get("blobs") or {}).values()])
 
 
 def update(app):
@@ -332,6 +558,10 @@ CALLS_DESIGN_DOC = {
         "opens": {
             "map": "function (doc) {if (doc.doctype !== 'call' || !doc.closes || !doc.opens) return; emit(doc.opens, doc.identifier);}"
         },
+        "modified": {  # Detect changes of any call; for the call schedule.
+            "reduce": "_stats",
+            "map": "function (doc) {if (doc.doctype !== 'call') return; emit(doc.identifier, Date.parse(doc.modified));}",
+        },
         "undefined": {
             "map": "function (doc) {if (doc.doctype !== 'call' || (doc.closes && doc.opens)) return; emit(doc.identifier, null);}"
         },
@@ -359,6 +589,10 @@ PROPOSALS_DESIGN_DOC = {
             "reduce": "_count",
             "map": "function (doc) {if (doc.doctype !== 'proposal') return; emit(doc.call, doc.user);}",
         },
+        "call_modified": {  # Validators for the pages and exports of a call.
+            "reduce": "_stats",
+            "map": "function (doc) {if (doc.doctype !== 'proposal') return; emit(doc.call, Date.parse(doc.modified));}",
+        },
         "user": {
             "reduce": "_count",
             "map": "function (doc) {if (doc.doctype !== 'proposal') return; emit(doc.user, doc.identifier);}",
@@ -366,10 +600,20 @@ PROPOSALS_DESIGN_DOC = {
         "call_user": {
             "map": "function (doc) {if (doc.doctype !== 'proposal') return; emit([doc.call, doc.user], doc.identifier);}"
         },
+        "call_identifier": {  # For paging; the value is used for ETags.
+            "map": "function (doc) {if (doc.doctype !== 'proposal') return; emit([doc.call, doc.identifier], doc._rev);}"
+        },
+        "call_summary": {  # For list tables; no documents need to be loaded.
+            "map": "function (doc) {if (doc.doctype !== 'proposal') return; emit(doc.call, {identifier: doc.identifier, title: doc.title || null, user: doc.user, submitted: doc.submitted || null, access_view: doc.access_view || []});}"
+        },
         "unsubmitted": {
             "reduce": "_count",
             "map": "function (doc) {if (doc.doctype !== 'proposal' || doc.submitted) return; emit(doc.user, doc.identifier);}",
         },
+        "call_unsubmitted": {  # For reminders; grouped by call and user.
+            "reduce": "_count",
+            "map": "function (doc) {if (doc.doctype !== 'proposal' || doc.submitted) return; emit([doc.call, doc.user], doc.identifier);}",
+        },
         "access": {
             "reduce": "_count",
             "map": "function (doc) {if (doc.doctype !== 'proposal') return; if (!doc.access_view) return; for (var i=0; i < doc.access_view.length; i++) {emit(doc.access_view[i], doc.identifier); }}",
@@ -405,6 +649,10 @@ REVIEWS_DESIGN_DOC = {
             "reduce": "_count",
             "map": "function(doc) {if (doc.doctype !== 'review' || doc.archived) return; emit(doc.call, null);}",
         },
+        "call_modified": {  # Validators for the pages and exports of a call.
+            "reduce": "_stats",
+            "map": "function (doc) {if (doc.doctype !== 'review') return; emit(doc.call, Date.parse(doc.modified));}",
+        },
         "proposal": {  # Reviews for a proposal.
             "reduce": "_count",
             "map": "function(doc) {if (doc.doctype !== 'review' || doc.archived) return; emit(doc.proposal, null);}",
@@ -415,15 +663,37 @@ REVIEWS_DESIGN_DOC = {
         },
         "call_reviewer": {  # Reviews per call and reviewer.
             "reduce": "_count",
-            "map": "function(doc) {if (doc.doctype !== 'review' || doc.archived) return; emit([doc.call, doc.reviewer], null);}",
+            "map": "function(doc) {if (doc.doctype !== 'review' || doc.archived) return; emit([doc.call, doc.reviewer], doc.proposal);}",
         },
         "proposal_reviewer": {
             "map": "function(doc) {if (doc.doctype !== 'review' || doc.archived) return; emit([doc.proposal, doc.reviewer], null);}"
         },
+        "call_summary": {  # For list tables; no documents need to be loaded.
+            "map": "function(doc) {if (doc.doctype !== 'review' || doc.archived) return; emit(doc.call, {proposal: doc.proposal, reviewer: doc.reviewer, finalized: doc.finalized || null, conflict_of_interest: !!doc.values.conflict_of_interest});}"
+        },
+        "call_proposal_reviewer": {  # For paging; the value is used for ETags.
+            "map": "function(doc) {if (doc.doctype !== 'review' || doc.archived) return; emit([doc.call, doc.proposal, doc.reviewer], doc._rev);}"
+        },
+        "call_proposal": {  # Reviews per call and proposal; value 1 if finalized.
+            "reduce": "_stats",
+            "map": "function(doc) {if (doc.doctype !== 'review' || doc.archived) return; emit([doc.call, doc.proposal], doc.finalized ? 1 : 0);}",
+        },
+        "call_proposal_score": {  # Values (scores, ranks) of finalized non-COI reviews.
+            "reduce": "_stats",
+            "map": "function(doc) {if (doc.doctype !== 'review' || doc.archived || !doc.finalized || doc.values.conflict_of_interest) return; for (var key in doc.values) {if (typeof doc.values[key] === 'number') emit([doc.call, doc.proposal, key, doc.reviewer], doc.values[key]);}}",
+        },
+        "call_reviewer_rank": {  # Numeric values per reviewer; 1 if finalized non-COI.
+            "reduce": "_sum",
+            "map": "function(doc) {if (doc.doctype !== 'review' || doc.archived) return; var counted = (doc.finalized && !doc.values.conflict_of_interest) ? 1 : 0; for (var key in doc.values) {if (typeof doc.values[key] === 'number') emit([doc.call, doc.reviewer, key, doc.values[key]], counted);}}",
+        },
         "unfinalized": {  # Unfinalized reviews by reviewer, in any call.
             "reduce": "_count",
             "map": "function(doc) {if (doc.doctype !== 'review' || doc.finalized || doc.archived) return; emit(doc.reviewer, null);}",
         },
+        "call_unfinalized": {  # For reminders; grouped by call and reviewer.
+            "reduce": "_count",
+            "map": "function(doc) {if (doc.doctype !== 'review' || doc.finalized || doc.archived) return; emit([doc.call, doc.reviewer], null);}",
+        },
         "proposal_archived": {  # Archived reviews for a proposal.
             "reduce": "_count",
             "map": "function(doc) {if (doc.doctype !== 'review' || !doc.archived) return; emit(doc.proposal, null);}",
@@ -442,10 +712,18 @@ DECISIONS_DESIGN_DOC = {
             "reduce": "_count",
             "map": "function(doc) {if (doc.doctype !== 'decision') return; emit(doc.call, doc.proposal);}",
         },
+        "call_modified": {  # Validators for the pages and exports of a call.
+            "reduce": "_stats",
+            "map": "function (doc) {if (doc.doctype !== 'decision') return; emit(doc.call, Date.parse(doc.modified));}",
+        },
         # Decision for a proposal.
         "proposal": {
             "map": "function(doc) {if (doc.doctype !== 'decision') return; emit(doc.proposal, null);}"
         },
+        # For paging; the value is used for ETags.
+        "call_proposal": {
+            "map": "function(doc) {if (doc.doctype !== 'decision') return; emit([doc.call, doc.proposal], doc._rev);}"
+        },
     }
 }
 
@@ -458,10 +736,17 @@ GRANTS_DESIGN_DOC = {
             "reduce": "_count",
             "map": "function (doc) {if (doc.doctype !== 'grant') return; emit(doc.call, doc.identifier);}",
         },
+        "call_modified": {  # Validators for the pages and exports of a call.
+            "reduce": "_stats",
+            "map": "function (doc) {if (doc.doctype !== 'grant') return; emit(doc.call, Date.parse(doc.modified));}",
+        },
         "proposal": {
             "reduce": "_count",
             "map": "function (doc) {if (doc.doctype !== 'grant') return; emit(doc.proposal, doc.identifier);}",
         },
+        "call_identifier": {  # For paging; the value is used for ETags.
+            "map": "function (doc) {if (doc.doctype !== 'grant') return; emit([doc.call, doc.identifier], doc._rev);}"
+        },
         "user": {
             "reduce": "_count",
             "map": "function (doc) {if (doc.doctype !== 'grant') return; emit(doc.user, doc.identifier);}",
@@ -498,6 +783,13 @@ USERS_DESIGN_DOC = {
         "last_login": {
             "map": "function(doc) {if (doc.doctype !== 'user') return; if (!doc.last_login) return; emit(doc.last_login, doc.username);}"
         },
+        "api_key": {
+            # Only the hash of the key is stored.
+            "map": "function(doc) {if (doc.doctype !== 'user' || !doc.api_key_hash) return; emit(doc.api_key_hash, doc.username);}"
+        },
+        "summary": {  # For list tables; no documents need to be loaded.
+            "map": "function(doc) {if (doc.doctype !== 'user') return; emit(doc.username, {email: doc.email, orcid: doc.orcid || null, givenname: doc.givenname || null, familyname: doc.familyname || null, affiliation: doc.affiliation || null, role: doc.role, status: doc.status, modified: doc.modified, last_login: doc.last_login || null});}"
+        },
     }
 }
 
@@ -516,3 +808,31 @@ META_DESIGN_DOC = {
         }
     }
 }
+
+MESSAGES_DESIGN_DOC = {
+    "views": {
+        "due": {  # Messages in the outbox, by time of next attempt.
+            "map": "function (doc) {if (doc.doctype !== 'message' || !doc.due) return; emit(doc.due, null);}"
+        },
+        "failed": {
+            "reduce": "_count",
+            "map": "function (doc) {if (doc.doctype !== 'message' || doc.status !== 'failed') return; emit(doc.created, null);}",
+        },
+        "batch": {  # Progress of bulk mail batches.
+            "reduce": "_count",
+            "map": "function (doc) {if (doc.doctype !== 'message' || !doc.batch) return; emit([doc.batch, doc.status], null);}",
+        },
+    }
+}
+
+BLOBS_DESIGN_DOC = {
+    "views": {
+        "digest": {  # References to files in the content-addressed store.
+            "reduce": "_count",
+            "map": "function (doc) {if (!doc.blobs) return; for (var name in doc.blobs) emit(doc.blobs[name].digest, name);}",
+        },
+        "attachments": {  # Documents with attachments in CouchDB.
+            "map": "function (doc) {if (!doc._attachments) return; emit(doc.doctype, null);}"
+        },
+    }
+}
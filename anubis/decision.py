@@ -13,6 +13,7 @@ import os.path
 
 import flask
 
+import anubis.blobs
 import anubis.call
 import anubis.database
 import anubis.proposal
@@ -177,7 +178,7 @@ def logs(iuid):
         "logs.html",
         title=f"Decision for {decision['proposal']}",
         back_url=flask.url_for("decision.display", iuid=decision["_id"]),
-        logs=anubis.database.get_logs(decision["_id"]),
+        **anubis.database.get_logs_page(decision["_id"]),
     )
 
 
@@ -194,7 +195,7 @@ def document(iuid, fid):
 
     try:
         documentname = decision["values"][fid]
-        stub = decision["_attachments"][documentname]
+        anubis.blobs.get_stubs(decision)[documentname]
     except KeyError:
         return utils.error(
             "No such document in decision.",
@@ -207,11 +208,7 @@ def document(iuid, fid):
     ext = os.path.splitext(documentname)[1]
     # Include 'decision' in filename to indicate decision document.
     filename = f"{pid}-decision-{fid}{ext}"
-    outfile = flask.g.db.get_attachment(decision, documentname)
-    response = flask.make_response(outfile.read())
-    response.headers.set("Content-Type", stub["content_type"])
-    response.headers.set("Content-Disposition", "attachment", filename=filename)
-    return response
+    return anubis.blobs.send_attachment(decision, documentname, filename)
 
 
 class DecisionSaver(FieldSaverMixin, Saver):
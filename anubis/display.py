@@ -6,6 +6,7 @@ import markupsafe
 from anubis import constants
 from anubis import utils
 
+import anubis.blobs
 import anubis.database
 import anubis.call
 import anubis.decision
@@ -56,6 +57,9 @@ def setup_template_context():
         get_user=anubis.user.get_user,
         get_call=anubis.call.get_call,
         get_banner_fields=anubis.call.get_banner_fields,
+        get_attachment_stubs=anubis.blobs.get_stubs,
+        get_call_document_url=anubis.call.get_document_url,
+        get_site_file_url=utils.get_site_file_url,
         get_proposal=anubis.proposal.get_proposal,
         get_review=anubis.review.get_review,
         get_decision=anubis.decision.get_decision,
@@ -239,9 +243,10 @@ def user_link(user, fullname=True, affiliation=False, button=False):
 
 def users_links_list(usernames):
     "List of links to users."
+    lookup = anubis.user.get_users_lookup(usernames)
     users = []
     for username in sorted(usernames):
-        user = anubis.user.get_user(username)
+        user = lookup.get(username)
         if not user:
             continue
         name = anubis.user.get_fullname(user)
@@ -270,7 +275,7 @@ def call_proposals_link(call, full=False):
     "Button with link to the page of all proposals in the call."
     if not anubis.call.allow_view_proposals(call):
         return ""
-    count = anubis.database.get_count("proposals", "call", call["identifier"])
+    count = anubis.database.get_call_counts(call["identifier"])["proposals"]
     url = flask.url_for("proposals.call", cid=call["identifier"])
     html = f' <a href="{url}" role="button" class="btn btn-sm btn-primary">{count} {full and "proposals" or "" }</a>'
     return markupsafe.Markup(html)
@@ -280,7 +285,7 @@ def call_reviews_link(call, full=False):
     "Button with link to the page of all reviews in the call."
     if not anubis.call.allow_view_reviews(call):
         return ""
-    count = anubis.database.get_count("reviews", "call", call["identifier"])
+    count = anubis.database.get_call_counts(call["identifier"])["reviews"]
     url = flask.url_for("reviews.call", cid=call["identifier"])
     html = f' <a href="{url}" role="button" class="btn btn-sm btn-info">{count} {full and "reviews" or ""}</a>'
     return markupsafe.Markup(html)
@@ -290,7 +295,7 @@ def call_grants_link(call, full=False):
     "Button with link to the page of all grants in the call."
     if not anubis.call.allow_view_grants(call):
         return ""
-    count = anubis.database.get_count("grants", "call", call["identifier"])
+    count = anubis.database.get_call_counts(call["identifier"])["grants"]
     url = flask.url_for("grants.call", cid=call["identifier"])
     html = f' <a href="{url}" role="button" class="btn btn-sm btn-success">{count} {full and "grants" or ""}</a>'
     return markupsafe.Markup(html)
@@ -11,6 +11,7 @@ import zipfile
 
 import flask
 
+import anubis.blobs
 import anubis.call
 import anubis.database
 import anubis.decision
@@ -225,7 +226,7 @@ def document(gid, fid):
 
     try:
         documentname = grant["values"][fid]
-        stub = grant["_attachments"][documentname]
+        anubis.blobs.get_stubs(grant)[documentname]
     except KeyError:
         return utils.error(
             "No such document in grant dossier.",
@@ -237,11 +238,7 @@ def document(gid, fid):
     ext = os.path.splitext(documentname)[1]
     # Add the appropriate file extension to the filename.
     filename = f"{gid}-{fid}{ext}"
-    outfile = flask.g.db.get_attachment(grant, documentname)
-    response = flask.make_response(outfile.read())
-    response.headers.set("Content-Type", stub["content_type"])
-    response.headers.set("Content-Disposition", "attachment", filename=filename)
-    return response
+    return anubis.blobs.send_attachment(grant, documentname, filename)
 
 
 @blueprint.route("/<gid>.zip")
@@ -285,8 +282,8 @@ def get_grant_documents(grant):
             continue
         ext = os.path.splitext(documentname)[1]
         filename = f"{gid}-{field['identifier']}{ext}"
-        outfile = flask.g.db.get_attachment(grant, documentname)
-        result.append(dict(filename=filename, content=outfile.read()))
+        with anubis.blobs.get_attachment(grant, documentname) as outfile:
+            result.append({"filename": filename, "content": outfile.read()})
     # Then repeated document fields.
     for field in call["grant"]:
         if field["type"] != constants.REPEAT:
@@ -301,13 +298,13 @@ def get_grant_documents(grant):
                 field2name = f"{field2['identifier']}-{n}"
                 try:
                     documentname = grant["values"][field2name]
-                    grant["_attachments"][documentname]
+                    outfile = anubis.blobs.get_attachment(grant, documentname)
                 except KeyError:
                     continue
-                outfile = flask.g.db.get_attachment(grant, documentname)
                 ext = os.path.splitext(documentname)[1]
                 filename = f"{gid}-{field2['identifier']}-{n}{ext}"
-                result.append(dict(filename=filename, content=outfile.read()))
+                with outfile:
+                    result.append({"filename": filename, "content": outfile.read()})
     return result
 
 
@@ -325,7 +322,7 @@ def logs(gid):
         "logs.html",
         title=f"Grant {grant['identifier']}",
         back_url=flask.url_for("grant.display", gid=grant["identifier"]),
-        logs=anubis.database.get_logs(grant["_id"]),
+        **anubis.database.get_logs_page(grant["_id"]),
     )
 
 
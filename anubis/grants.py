@@ -4,7 +4,6 @@ import io
 import zipfile
 
 import flask
-import xlsxwriter
 
 import anubis.call
 import anubis.database
@@ -30,10 +29,19 @@ def call(cid):
     if not anubis.call.allow_view_grants(call):
         return utils.error("You may not view the grants of the call.")
 
+    etag, _ = anubis.call.get_call_etag(call, ["proposals", "grants"])
+    response = utils.get_not_modified(etag)
+    if response:
+        return response
+
     grants = anubis.database.get_docs("grants", "call", call["identifier"])
+    usernames = [g["user"] for g in grants]
+    for grant in grants:
+        usernames.extend(grant.get("access_view", []))
+    users = anubis.user.get_users_lookup(usernames)
     # Convert username for grant to full user dict.
     for grant in grants:
-        grant["user"] = anubis.user.get_user(grant["user"])
+        grant["user"] = users.get(grant["user"])
     # There may be accounts that have no emails.
     receiver_emails = [g["user"]["email"] for g in grants]
     receiver_emails = [e for e in receiver_emails if e]
@@ -41,7 +49,7 @@ def call(cid):
     field_emails = []
     for grant in grants:
         access_emails.extend(
-            [anubis.user.get_user(a)["email"] for a in grant.get("access_view", [])]
+            [users[a].get("email") for a in grant.get("access_view", []) if a in users]
         )
         for field in call["grant"]:
             if field["type"] == constants.EMAIL:
@@ -61,9 +69,10 @@ def call(cid):
         "Emails provided in grant fields": ", ".join(field_emails),
         "All emails": ", ".join(all_emails),
     }
-    return flask.render_template(
+    response = flask.render_template(
         "grants/call.html", call=call, grants=grants, email_lists=email_lists
     )
+    return utils.set_validators(response, etag)
 
 
 @blueprint.route("/call/<cid>.xlsx")
@@ -78,21 +87,138 @@ def call_xlsx(cid):
     if not anubis.call.allow_view_grants(call):
         return utils.error("You may not view the grants of the call.")
 
+    etag, last_modified = anubis.call.get_call_etag(call, ["proposals", "grants"])
+    response = utils.get_not_modified(etag)
+    if response:
+        return response
+
     grants = anubis.database.get_docs("grants", "call", call["identifier"])
     grants.sort(key=lambda g: g["identifier"])
-    content = get_call_grants_xlsx(call, grants)
-    response = flask.make_response(content)
-    response.headers.set("Content-Type", constants.XLSX_MIMETYPE)
-    response.headers.set(
-        "Content-Disposition", "attachment", filename=f"{cid}_grants.xlsx"
+    response = utils.send_xlsx_file(
+        get_call_grants_xlsx(call, grants), f"{cid}_grants.xlsx"
+    )
+    return utils.set_validators(response, etag, last_modified)
+
+
+@blueprint.route("/call/<cid>.csv")
+@utils.login_required
+def call_csv(cid):
+    "Produce a CSV file of all grants for a call, optionally selected columns."
+    return get_call_rows_response(cid, "csv")
+
+
+@blueprint.route("/call/<cid>.jsonl")
+@utils.login_required
+def call_jsonl(cid):
+    "Produce a JSON Lines file of all grants for a call, optionally selected columns."
+    return get_call_rows_response(cid, "jsonl")
+
+
+def get_call_rows_response(cid, format):
+    """Return a response streaming the rows for the grants in a call.
+    The access checks are the same as for the XLSX file.
+    """
+    call = anubis.call.get_call(cid)
+    if call is None:
+        return utils.error("No such call.")
+    if not anubis.call.allow_view(call):
+        return utils.error("You may not view the call.")
+    if not anubis.call.allow_view_grants(call):
+        return utils.error("You may not view the grants of the call.")
+
+    try:
+        columns = utils.get_selected_columns(get_call_columns(call))
+    except ValueError as error:
+        return utils.error(error, flask.url_for("grants.call", cid=cid))
+    return utils.get_rows_response(
+        format, columns, get_call_rows(call), f"{call['identifier']}_grants"
     )
-    return response
+
+
+def get_call_columns(call):
+    """Return the names of the columns for the tabular exports of the grants
+    in a call. These correspond to the columns of the XLSX file.
+    The value of a repeated field is a list with one item per repeat.
+    """
+    result = [
+        "grant",
+        "status",
+        "proposal",
+        "title",
+        "submitter",
+        "email",
+        "affiliation",
+    ]
+    result.extend([f"grant.{f['identifier']}" for f in call["grant"]])
+    return result
+
+
+def get_call_rows(call):
+    """Yield the rows for the tabular exports of the grants in a call,
+    as dictionaries keyed by column name.
+    The grants are read from the database in chunks.
+    """
+    for grants in anubis.database.get_docs_chunks(
+        "grants", "call_identifier", call["identifier"]
+    ):
+        proposals = {
+            p["identifier"]: p
+            for p in anubis.database.get_docs_keys(
+                "proposals", "identifier", [g["proposal"] for g in grants]
+            )
+        }
+        users = anubis.user.get_users_lookup([g["user"] for g in grants])
+        for grant in grants:
+            proposal = proposals.get(grant["proposal"]) or {}
+            user = users.get(grant["user"]) or {"username": grant["user"]}
+            row = {
+                "grant": grant["identifier"],
+                "status": grant["errors"] and "Incomplete" or "Complete",
+                "proposal": grant["proposal"],
+                "title": proposal.get("title") or "",
+                "submitter": anubis.user.get_fullname(user),
+                "email": user.get("email") or "",
+                "affiliation": user.get("affiliation") or "",
+            }
+            for field in call["grant"]:
+                if field.get("repeat"):
+                    n_repeat = grant["values"].get(field["repeat"]) or 0
+                    fids = [f"{field['identifier']}-{n + 1}" for n in range(n_repeat)]
+                    value = [
+                        get_field_value(grant, fid, field["type"]) for fid in fids
+                    ]
+                else:
+                    value = get_field_value(grant, field["identifier"], field["type"])
+                row[f"grant.{field['identifier']}"] = value
+            yield row
+
+
+def get_field_value(grant, fid, field_type):
+    "Return the value of the field in the grant, or the URL if a document."
+    value = grant["values"].get(fid)
+    # Ugly, but necessary...
+    if value is not None and field_type == constants.DOCUMENT:
+        value = flask.url_for(
+            "grant.document",
+            gid=grant["identifier"],
+            fid=fid,
+            _external=True,
+        )
+    return value
 
 
 def get_call_grants_xlsx(call, grants):
-    "Return the content for the XLSX file for the list of grants."
-    output = io.BytesIO()
-    wb = xlsxwriter.Workbook(output, {"in_memory": True})
+    """Return a temporary file containing the XLSX file for the list of grants.
+    Repeated fields are written in merged cells spanning several rows,
+    so constant memory mode can be used only if there are no such fields.
+    """
+    proposals = anubis.database.get_docs_keys(
+        "proposals", "identifier", [g["proposal"] for g in grants]
+    )
+    users = anubis.user.get_users_lookup([p["user"] for p in proposals])
+    wb, outfile = utils.create_xlsx_workbook(
+        constant_memory=not any(f["type"] == constants.REPEAT for f in call["grant"])
+    )
     formats = utils.create_xlsx_formats(wb)
     # Hard str(len) limit for worksheet title.
     ws = wb.add_worksheet(f"Grants in call {call['identifier']}"[:31])
@@ -197,7 +323,7 @@ def get_call_grants_xlsx(call, grants):
         ncol += 1
         if n_merge > 1:
             ws.merge_range(nrow, ncol, nrow + n_merge - 1, ncol, "")
-        user = anubis.user.get_user(username=proposal["user"])
+        user = users.get(proposal["user"]) or {"username": proposal["user"]}
         ws.write_string(nrow, ncol, anubis.user.get_fullname(user))
         ncol += 1
         if n_merge > 1:
@@ -227,10 +353,9 @@ def get_call_grants_xlsx(call, grants):
                             ws,
                             nrow + row_offset,
                             ncol + col_offset,
-                            grant["values"].get(fid),
-                            repeated["type"],
-                            grant["identifier"],
+                            grant,
                             fid,
+                            repeated["type"],
                             formats,
                         )
                         max_ncol = max(max_ncol, ncol + col_offset)
@@ -242,10 +367,9 @@ def get_call_grants_xlsx(call, grants):
                     ws,
                     nrow,
                     ncol,
-                    grant["values"].get(field["identifier"]),
-                    field["type"],
-                    grant["identifier"],
+                    grant,
                     field["identifier"],
+                    field["type"],
                     formats,
                 )
                 max_ncol = max(max_ncol, ncol)
@@ -257,20 +381,12 @@ def get_call_grants_xlsx(call, grants):
     if max_ncol > 6:
         ws.set_column(6 + 1, max_ncol, 20, formats["normal"])
 
-    wb.close()
-    return output.getvalue()
+    return utils.close_xlsx_workbook(wb, outfile)
 
 
-def _write_xlsx_field(ws, nrow, ncol, value, field_type, gid, fid, formats):
+def _write_xlsx_field(ws, nrow, ncol, grant, fid, field_type, formats):
     "Small wrapper function for computing the relevant URL."
-    # Ugly, but necessary...
-    if value is not None and field_type == constants.DOCUMENT:
-        value = flask.url_for(
-            "grant.document",
-            gid=gid,
-            fid=fid,
-            _external=True,
-        )
+    value = get_field_value(grant, fid, field_type)
     utils.write_xlsx_field(ws, nrow, ncol, value, field_type, formats)
 
 
@@ -288,12 +404,19 @@ def call_zip(cid):
     if not anubis.call.allow_view_grants(call):
         return utils.error("You may not view the grants of the call.")
 
+    etag, last_modified = anubis.call.get_call_etag(call, ["proposals", "grants"])
+    response = utils.get_not_modified(etag)
+    if response:
+        return response
+
     # Colon ':' is a problematic character in filenames; replace by dash '_'
     cid = cid.replace(":", "-")
     grants = anubis.database.get_docs("grants", "call", call["identifier"])
     output = io.BytesIO()
     with zipfile.ZipFile(output, "w") as outfile:
-        outfile.writestr(f"{cid}_grants.xlsx", get_call_grants_xlsx(call, grants))
+        utils.write_zip_file(
+            outfile, f"{cid}_grants.xlsx", get_call_grants_xlsx(call, grants)
+        )
         for grant in grants:
             for document in anubis.grant.get_grant_documents(grant):
                 outfile.writestr(document["filename"], document["content"])
@@ -302,7 +425,7 @@ def call_zip(cid):
     response.headers.set(
         "Content-Disposition", "attachment", filename=f"{cid}_grants.zip"
     )
-    return response
+    return utils.set_validators(response, etag, last_modified)
 
 
 @blueprint.route("/user/<username>")
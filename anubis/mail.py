@@ -0,0 +1,137 @@
+"Bulk email to the reviewers, submitters or grant receivers of a call."
+
+import flask
+
+import anubis.call
+import anubis.database
+import anubis.outbox
+import anubis.proposals
+import anubis.user
+from anubis import utils
+
+blueprint = flask.Blueprint("mail", __name__)
+
+# Recipient groups; key: form value, value: description.
+GROUPS = {
+    "reviewers": "Reviewers in the call",
+    "submitters": "Submitters of submitted proposals",
+    "grants": "Receivers of grants",
+}
+
+# Placeholders in the subject and text replaced for each recipient.
+PLACEHOLDERS = {
+    "{name}": "The full name of the recipient.",
+    "{username}": "The user name of the recipient.",
+    "{call}": "The identifier of the call.",
+    "{proposal}": "The identifier and title of the proposal; submitters and grants.",
+}
+
+
+@blueprint.route("/call/<cid>", methods=["GET", "POST"])
+@utils.login_required
+def call(cid):
+    "Send an email to each recipient in the chosen group of a call."
+    call = anubis.call.get_call(cid)
+    if not call:
+        return utils.error("No such call.")
+    if not anubis.call.allow_send_email(call):
+        return utils.error("You are not allowed to send email for the call.")
+
+    if utils.http_GET():
+        return flask.render_template(
+            "mail/call.html",
+            call=call,
+            groups=GROUPS,
+            placeholders=PLACEHOLDERS,
+            counts={g: len(get_recipients(call, g)) for g in GROUPS},
+        )
+
+    elif utils.http_POST():
+        try:
+            group = flask.request.form.get("group")
+            if group not in GROUPS:
+                raise ValueError("Invalid recipient group.")
+            title = flask.request.form.get("title") or ""
+            text = flask.request.form.get("text") or ""
+            if not title.strip():
+                raise ValueError("No subject given.")
+            if not text.strip():
+                raise ValueError("No text given.")
+            messages = [
+                (r["email"], render(title, r), render(text, r))
+                for r in get_recipients(call, group)
+            ]
+            if not messages:
+                raise ValueError("No recipients with email addresses in the group.")
+            batch = utils.get_iuid()
+            anubis.outbox.send_emails(messages, batch=batch)
+        except ValueError as error:
+            return utils.error(error, flask.url_for(".call", cid=cid))
+        utils.flash_message(f"{len(messages)} email messages put in the outbox.")
+        return flask.redirect(flask.url_for(".batch", cid=cid, batch=batch))
+
+
+@blueprint.route("/call/<cid>/<batch>")
+@utils.login_required
+def batch(cid, batch):
+    "Display the progress of sending a bulk email batch for a call."
+    call = anubis.call.get_call(cid)
+    if not call:
+        return utils.error("No such call.")
+    if not anubis.call.allow_send_email(call):
+        return utils.error("You are not allowed to send email for the call.")
+    progress = anubis.outbox.get_batch_progress(batch)
+    if not any(progress.values()):
+        return utils.error("No such email batch.")
+    return flask.render_template(
+        "mail/batch.html", call=call, batch=batch, progress=progress
+    )
+
+
+def get_recipients(call, group):
+    """Return the list of recipients in the group, each a dictionary with
+    the values for the placeholders. Those with no email address are skipped.
+    Submitters and grant receivers get one message per proposal.
+    """
+    if group == "reviewers":
+        items = [(username, None) for username in call["reviewers"]]
+    elif group == "submitters":
+        items = [
+            (p["user"], p)
+            for p in anubis.proposals.get_call_proposals_summary(call)
+            if p.get("submitted")
+        ]
+    elif group == "grants":
+        grants = anubis.database.get_docs("grants", "call", call["identifier"])
+        proposals = {
+            p["identifier"]: p
+            for p in anubis.proposals.get_call_proposals_summary(call)
+        }
+        items = [(g["user"], proposals.get(g["proposal"])) for g in grants]
+    else:
+        raise ValueError("Invalid recipient group.")
+    users = anubis.user.get_users_summary([username for username, p in items])
+    result = []
+    for username, proposal in items:
+        user = users.get(username)
+        if not (user and user.get("email")):
+            continue
+        if proposal:
+            proposal = f"{proposal['identifier']} {proposal.get('title') or ''}"
+        result.append(
+            {
+                "email": user["email"],
+                "{name}": anubis.user.get_fullname(user),
+                "{username}": username,
+                "{call}": call["identifier"],
+                "{proposal}": proposal or "",
+            }
+        )
+    return result
+
+
+def render(template, recipient):
+    "Replace the placeholders in the template by the values for the recipient."
+    for placeholder in PLACEHOLDERS:
+        template = template.replace(placeholder, recipient[placeholder])
+    return template
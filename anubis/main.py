@@ -20,6 +20,10 @@ import anubis.proposals
 import anubis.decision
 import anubis.grant
 import anubis.grants
+import anubis.mail
+import anubis.outbox
+import anubis.page_cache
+import anubis.uploads
 import anubis.about
 import anubis.admin
 import anubis.user
@@ -33,6 +37,10 @@ app = anubis.config.create_app()
 
 # Further configuration for the web app.
 anubis.display.init(app)
+# Must be done before any other before-request function is registered.
+anubis.page_cache.init(app)
+anubis.outbox.init(app)
+anubis.uploads.init(app)
 
 
 @app.before_request
@@ -46,7 +54,8 @@ def prepare():
         flask.g.alert_text = flask.g.db["alert"]["text"]
     except couchdb2.NotFoundError:
         flask.g.alert_text = None
-    if flask.g.current_user:
+    # The counts are needed only for the navbar of the HTML pages.
+    if flask.g.current_user and flask.request.blueprint != "api":
         username = flask.g.current_user["username"]
         flask.g.allow_create_call = anubis.call.allow_create()
         flask.g.my_proposals_count = anubis.database.get_count(
@@ -178,19 +187,29 @@ def status():
 
 
 @app.route("/site/<filename>")
-def site(filename):
+@app.route("/site/<filename>/<digest>")
+def site(filename, digest=None):
+    """Return the site file. If the URL contains its digest, it may be cached
+    indefinitely. If the digest is not that of the current file, redirect.
+    """
     if filename in constants.SITE_FILES:
         try:
             filedata = flask.current_app.config[f"SITE_{filename.upper()}"]
-            return flask.send_file(
+        except KeyError:
+            pass
+        else:
+            if digest and digest != utils.get_url_digest(filedata["etag"]):
+                return flask.redirect(utils.get_site_file_url(filename))
+            response = flask.send_file(
                 io.BytesIO(filedata["content"]),
                 mimetype=filedata["mimetype"],
                 etag=filedata["etag"],
                 last_modified=filedata["modified"],
                 max_age=constants.SITE_FILE_MAX_AGE,
             )
-        except KeyError:
-            pass
+            if digest:
+                utils.set_immutable(response)
+            return response
     flask.abort(http.client.NOT_FOUND)
 
 
@@ -229,6 +248,7 @@ app.register_blueprint(anubis.reviews.blueprint, url_prefix="/reviews")
 app.register_blueprint(anubis.decision.blueprint, url_prefix="/decision")
 app.register_blueprint(anubis.grant.blueprint, url_prefix="/grant")
 app.register_blueprint(anubis.grants.blueprint, url_prefix="/grants")
+app.register_blueprint(anubis.mail.blueprint, url_prefix="/mail")
 app.register_blueprint(anubis.about.blueprint, url_prefix="/about")
 app.register_blueprint(anubis.admin.blueprint, url_prefix="/admin")
 app.register_blueprint(anubis.api.blueprint, url_prefix="/api")
@@ -0,0 +1,252 @@
+"""Outbox for email messages, drained by a background sender.
+
+A request only stores the message as a document in the database, and then
+returns. The sender thread in each server process sends the messages that
+are due, and retries with exponential backoff those that fail. A message is
+claimed by a sender by updating its document, so that when there are several
+server processes, a CouchDB update conflict means that another sender has
+claimed it. A claim that is not completed, e.g. because the server process
+was stopped, expires after a while, and the message is then sent again.
+
+The claimed messages are sent in batches, each over a single connection
+to the email server, with a pause between messages to avoid overloading it.
+
+A message that has been sent is deleted, unless it is part of a bulk mail
+batch, in which case it is kept with the status 'sent' to allow reporting
+of the progress. A message that could not be sent after the maximum number
+of attempts is kept with the status 'failed', to allow retrying it, for
+a limited time only since its text may contain e.g. a password reset link.
+"""
+
+import datetime
+import smtplib
+import threading
+import time
+
+import couchdb2
+import flask
+
+import anubis.database
+import anubis.reminders
+from anubis import constants, utils
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+STATUSES = (PENDING, SENDING, SENT, FAILED)
+
+# Set to make the sender thread in this process check the outbox immediately.
+_wakeup = threading.Event()
+_thread = None
+
+
+def init(app):
+    "Start the sender thread for the app, if email has been configured."
+    global _thread
+    if not app.config["MAIL_SERVER"] or _thread is not None:
+        return
+    _thread = threading.Thread(
+        target=run, args=(app,), name="anubis-outbox", daemon=True
+    )
+    _thread.start()
+
+
+def send_email(recipients, title, text):
+    """Put an email message in the outbox, to be sent by the background sender.
+    Raise ValueError if the email server is not configured.
+    """
+    send_emails([(recipients, title, text)])
+
+
+def send_emails(messages, batch=None):
+    """Put the email messages, given as tuples (recipients, title, text),
+    in the outbox using a single database request. If a batch identifier
+    is given, the sent messages are kept to allow reporting the progress.
+    Raise ValueError if the email server is not configured.
+    """
+    if not flask.current_app.config["MAIL_SERVER"]:
+        raise ValueError("No mail server configured.")
+    now = utils.get_now()
+    docs = []
+    for recipients, title, text in messages:
+        if isinstance(recipients, str):
+            recipients = [recipients]
+        doc = {
+            "_id": utils.get_iuid(),
+            "doctype": constants.MESSAGE,
+            "status": PENDING,
+            "recipients": recipients,
+            "title": title,
+            "text": text,
+            "attempts": 0,
+            "due": now,
+            "created": now,
+        }
+        if batch:
+            doc["batch"] = batch
+        docs.append(doc)
+    for chunk in range(0, len(docs), constants.OUTBOX_BATCH_SIZE):
+        flask.g.db.update(docs[chunk : chunk + constants.OUTBOX_BATCH_SIZE])
+    _wakeup.set()
+
+
+def get_batch_progress(batch):
+    "Return a dictionary with the number of messages in the batch per status."
+    result = dict.fromkeys(STATUSES, 0)
+    for row in flask.g.db.view(
+        "messages",
+        "batch",
+        startkey=[batch, ""],
+        endkey=[batch, constants.CEILING],
+        group_level=2,
+        reduce=True,
+    ):
+        result[row.key[1]] = row.value
+    return result
+
+
+def run(app):
+    """Send the messages that are due, then wait until woken up or the interval.
+    Errors are logged, so that the thread keeps running.
+    """
+    while True:
+        with app.app_context():
+            try:
+                flask.g.db = anubis.database.get_db()
+            except Exception:
+                app.logger.exception("Outbox: no database")
+            else:
+                try:
+                    drain()
+                    purge_failed(get_time(-constants.OUTBOX_FAILED_RETENTION))
+                except Exception:
+                    app.logger.exception("Outbox")
+                try:
+                    anubis.reminders.run()
+                except Exception:
+                    app.logger.exception("Reminders")
+        _wakeup.wait(timeout=constants.OUTBOX_POLL_INTERVAL)
+        _wakeup.clear()
+
+
+def drain():
+    "Send all messages that are due. The database must have been set."
+    while True:
+        rows = list(
+            flask.g.db.view(
+                "messages",
+                "due",
+                endkey=utils.get_now(),
+                limit=constants.OUTBOX_BATCH_SIZE,
+                include_docs=True,
+            )
+        )
+        if not rows:
+            break
+        messages = [claim(row.doc) for row in rows]
+        deliver([m for m in messages if m is not None])
+        if len(rows) < constants.OUTBOX_BATCH_SIZE:
+            break
+
+
+def claim(message):
+    """Mark the message as being sent by this sender.
+    Return the updated message, or None if another sender claimed it first.
+    """
+    message["status"] = SENDING
+    message["attempts"] = message.get("attempts", 0) + 1
+    message["due"] = get_time(constants.OUTBOX_CLAIM_TIMEOUT)
+    try:
+        flask.g.db.put(message)
+    except couchdb2.RevisionError:
+        return None
+    return message
+
+
+def deliver(messages):
+    """Send the claimed messages over one connection to the email server.
+    If a message is refused, the others are still sent. If the connection
+    fails, all remaining messages are rescheduled.
+    """
+    if not messages:
+        return
+    remaining = list(messages)
+    try:
+        with utils.MAIL.connect() as connection:
+            while remaining:
+                message = remaining[0]
+                try:
+                    connection.send(
+                        utils.get_email_message(
+                            message["recipients"], message["title"], message["text"]
+                        )
+                    )
+                except (
+                    smtplib.SMTPRecipientsRefused,
+                    smtplib.SMTPSenderRefused,
+                    smtplib.SMTPDataError,
+                    KeyError,  # Malformed message document.
+                ) as error:
+                    set_failed(message, error)
+                else:
+                    set_sent(message)
+                remaining.pop(0)
+                time.sleep(constants.OUTBOX_SEND_INTERVAL)
+    except (OSError, smtplib.SMTPException) as error:
+        flask.current_app.logger.error(f"Outbox: email server: {error}")
+        for message in remaining:
+            set_failed(message, error)
+
+
+def set_sent(message):
+    "The message has been sent; delete it, or keep it if part of a batch."
+    if message.get("batch"):
+        message["status"] = SENT
+        message["sent"] = utils.get_now()
+        message.pop("due")
+        message.pop("error", None)
+        flask.g.db.put(message)
+    else:
+        flask.g.db.delete(message)
+
+
+def set_failed(message, error):
+    """The message could not be sent. Set the time of the next attempt,
+    or mark it as failed if too many attempts.
+    """
+    message["error"] = str(error) or "Email server misconfigured."
+    if message["attempts"] >= constants.OUTBOX_MAX_ATTEMPTS:
+        message["status"] = FAILED
+        message.pop("due")
+        flask.current_app.logger.error(
+            f"Outbox: message {message['_id']} failed: {message['error']}"
+        )
+    else:
+        message["status"] = PENDING
+        message["due"] = get_time(
+            constants.OUTBOX_BACKOFF * 2 ** (message["attempts"] - 1)
+        )
+    flask.g.db.put(message)
+
+
+def purge_failed(before=None):
+    """Delete the failed messages, optionally only those created before
+    the given time. Return the number of deleted messages.
+    """
+    kwargs = {"include_docs": True, "reduce": False}
+    if before:
+        kwargs["endkey"] = before
+    docs = [row.doc for row in flask.g.db.view("messages", "failed", **kwargs)]
+    for doc in docs:
+        doc["_deleted"] = True
+    for chunk in range(0, len(docs), constants.OUTBOX_BATCH_SIZE):
+        flask.g.db.update(docs[chunk : chunk + constants.OUTBOX_BATCH_SIZE])
+    return len(docs)
+
+
+def get_time(seconds):
+    "Return the UTC time the given number of seconds from now, as in 'get_now'."
+    now = datetime.datetime.now(tz=datetime.UTC)
+    when = now + datetime.timedelta(seconds=seconds)
+    return when.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
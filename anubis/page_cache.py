@@ -0,0 +1,130 @@
+"""Cache of rendered pages for anonymous visitors.
+
+The pages most visited when a call is announced are the same for all
+anonymous visitors, so they are rendered once and then served without
+any database access. An entry is removed when a call or a site-wide
+setting is saved, and expires at the next state change of any call
+according to the call schedule, or after the configured time-to-live,
+whichever comes first. The latter limits the staleness in other
+server processes, which are not notified.
+
+If the database cannot be reached, an expired entry is served instead,
+unless it expired too long ago. Only requests without query arguments are
+cached, and the number of entries is limited by removing the least recently
+used ones, so that the memory used cannot be increased by arbitrary requests.
+"""
+
+import collections
+import threading
+import time
+
+import dateutil.parser
+import flask
+
+import anubis.schedule
+from anubis import constants
+
+# The endpoints for which the page for an anonymous visitor is cached.
+ENDPOINTS = {"home", "calls.open", "calls.closed", "call.display", "sitemap"}
+
+# Key: request path; value: dict(data, mimetype, expires).
+# In order of use, the most recently used last.
+_entries = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def init(app):
+    """Set up the cache for the app. This must be done before any other
+    before-request function is registered, to avoid database access on a hit.
+    """
+    app.before_request(get_cached_response)
+    app.after_request(put_response)
+    # Connection errors from the 'requests' module are subclasses of OSError.
+    app.register_error_handler(OSError, get_stale_response)
+
+
+def clear():
+    "Remove all entries; called when a call or a site-wide setting is saved."
+    with _lock:
+        _entries.clear()
+
+
+def is_cacheable():
+    "Is the page for the current request to be cached?"
+    if not flask.current_app.config.get("PAGE_CACHE_TTL"):
+        return False
+    if flask.request.method != "GET":
+        return False
+    if flask.request.endpoint not in ENDPOINTS:
+        return False
+    if flask.request.args:
+        return False
+    if flask.request.headers.get(constants.API_KEY_HEADER):
+        return False
+    return not (flask.session.get("username") or flask.session.get("_flashes"))
+
+
+def get_cached_response():
+    "Return the cached page for the request, if any and not expired."
+    if not is_cacheable():
+        return None
+    with _lock:
+        entry = _entries.get(flask.request.path)
+        if entry is None or entry["expires"] < time.time():
+            return None
+        _entries.move_to_end(flask.request.path)
+    flask.g.page_cache_hit = True
+    return get_response(entry)
+
+
+def put_response(response):
+    """Add the page to the cache, if it is cacheable. Not if the session
+    was modified by the rendering, since then the page is not generic.
+    """
+    if flask.g.get("page_cache_hit") or not is_cacheable():
+        return response
+    if response.status_code != 200 or response.direct_passthrough:
+        return response
+    if flask.session.modified:
+        return response
+    expires = time.time() + flask.current_app.config["PAGE_CACHE_TTL"]
+    boundary = anubis.schedule.get_schedule().get_next_change()
+    if boundary is not None:
+        expires = min(expires, dateutil.parser.isoparse(boundary).timestamp())
+    with _lock:
+        _entries[flask.request.path] = {
+            "data": response.get_data(),
+            "mimetype": response.mimetype,
+            "expires": expires,
+        }
+        _entries.move_to_end(flask.request.path)
+        prune()
+    return response
+
+
+def prune():
+    """Remove the entries that expired too long ago to be served as stale,
+    and the least recently used ones in excess of the maximum number.
+    The lock must be held.
+    """
+    limit = time.time() - constants.PAGE_CACHE_STALE_TIME
+    for path in [p for p, e in _entries.items() if e["expires"] < limit]:
+        del _entries[path]
+    while len(_entries) > constants.PAGE_CACHE_MAX_ENTRIES:
+        _entries.popitem(last=False)
+
+
+def get_stale_response(error):
+    "Return the cached page, even if expired, when the database cannot be reached."
+    if is_cacheable():
+        entry = _entries.get(flask.request.path)
+        limit = time.time() - constants.PAGE_CACHE_STALE_TIME
+        if entry is not None and entry["expires"] >= limit:
+            flask.current_app.logger.warning(f"Serving stale page: {error}")
+            return get_response(entry)
+    raise error
+
+
+def get_response(entry):
+    "Return a response for the cache entry."
+    return flask.Response(entry["data"], mimetype=entry["mimetype"])
@@ -13,12 +13,13 @@ import os.path
 import docx
 import flask
 import htmldocx
-import xlsxwriter
 
+import anubis.blobs
 import anubis.call
 import anubis.database
 import anubis.decision
 import anubis.grant
+import anubis.outbox
 import anubis.review
 import anubis.user
 from anubis import constants
@@ -127,13 +128,9 @@ def display_xlsx(pid):
     if not allow_view(proposal):
         return utils.error("You are not allowed to view this proposal.")
 
-    content = get_proposal_xlsx(proposal).getvalue()
-    response = flask.make_response(content)
-    response.headers.set("Content-Type", constants.XLSX_MIMETYPE)
-    response.headers.set(
-        "Content-Disposition", "attachment", filename=f"{pid.replace(':','-')}.xlsx"
+    return utils.send_xlsx_file(
+        get_proposal_xlsx(proposal), f"{pid.replace(':','-')}.xlsx"
     )
-    return response
 
 
 @blueprint.route("/<pid>/edit", methods=["GET", "POST", "DELETE"])
@@ -178,10 +175,6 @@ def edit(pid):
                     send_email_submission(proposal)
                 except ValueError:
                     utils.flash_warning("No separate confirmation email sent.")
-                except KeyError:
-                    utils.flash_error(
-                        "Could not send confirmation email; misconfiguration in the Anubis setup."
-                    )
 
         elif allow_submit(proposal) and not proposal.get("submitted"):
             utils.flash_warning(
@@ -264,17 +257,13 @@ def submit(pid):
                 send_email_submission(proposal)
             except ValueError:
                 utils.flash_warning("No separate confirmation email sent.")
-            except KeyError:
-                utils.flash_error(
-                    "Could not send confirmation email; misconfiguration in the Anubis setup."
-                )
         return flask.redirect(flask.url_for("proposal.display", pid=pid))
 
 
 def send_email_submission(proposal):
     """Send an email to the owner of the proposal confirming the submission.
+    The email is put in the outbox, and sent in the background.
     Raise ValueError if email server not configured.
-    Raise KeyError if email could not be sent; server misconfigured.
     """
     user = anubis.user.get_user(username=proposal["user"])
     if not (user and user["email"]):
@@ -289,7 +278,7 @@ def send_email_submission(proposal):
         f"View it at {url}\n\n"
         "/The Anubis system"
     )
-    utils.send_email(user["email"], title, text)
+    anubis.outbox.send_email(user["email"], title, text)
 
 
 @blueprint.route("/<pid>/unsubmit", methods=["POST"])
@@ -381,17 +370,17 @@ def get_document(proposal, fid):
     "Return a dictionary containing the document in the field of the proposal."
     documentname = proposal["values"][fid]
     # This may generate a KeyError, which is correct.
-    stub = proposal["_attachments"][documentname]
+    stub = anubis.blobs.get_stubs(proposal)[documentname]
     # Colon ':' is a problematic character in filenames.
     # Replace it by dash '-' which used as general glue character here.
     pid = proposal["identifier"].replace(":", "-")
     ext = os.path.splitext(documentname)[1]
-    outfile = flask.g.db.get_attachment(proposal, documentname)
-    return dict(
-        filename=f"{pid}-{fid}{ext}",
-        content=outfile.read(),
-        content_type=stub["content_type"],
-    )
+    with anubis.blobs.get_attachment(proposal, documentname) as outfile:
+        return {
+            "filename": f"{pid}-{fid}{ext}",
+            "content": outfile.read(),
+            "content_type": stub["content_type"],
+        }
 
 
 @blueprint.route("/<pid>/logs")
@@ -408,7 +397,7 @@ def logs(pid):
         "logs.html",
         title=f"Proposal {proposal['identifier']}",
         back_url=flask.url_for("proposal.display", pid=proposal["identifier"]),
-        logs=anubis.database.get_logs(proposal["_id"]),
+        **anubis.database.get_logs_page(proposal["_id"]),
     )
 
 
@@ -444,13 +433,7 @@ class ProposalSaver(AccessSaverMixin, FieldSaverMixin, Saver):
         if self.doc.get("call"):
             raise ValueError("call has already been set")
         self.doc["call"] = call["identifier"]
-        counter = call.get("counter")
-        if counter is None:
-            counter = 1
-        else:
-            counter += 1
-        with anubis.call.CallSaver(call):
-            call["counter"] = counter
+        counter = anubis.call.get_next_proposal_number(call)
         self.doc["identifier"] = f"{call['identifier']}:{counter:03d}"
         self.set_fields_values(call["proposal"])
 
@@ -577,11 +560,10 @@ def get_proposal_docx(proposal):
 
 
 def get_proposal_xlsx(proposal):
-    "Return the proposal as a io.BytesIO instance containing the XLSX file."
+    "Return the proposal as a temporary file containing the XLSX file."
     call = anubis.call.get_call(proposal["call"])
     submitter = anubis.user.get_user(username=proposal["user"])
-    result = io.BytesIO()
-    wb = xlsxwriter.Workbook(result, {"in_memory": True})
+    wb, outfile = utils.create_xlsx_workbook()
     formats = utils.create_xlsx_formats(wb)
     # Hard str(len) limit for worksheet title.
     ws = wb.add_worksheet(f"Proposal {proposal['identifier'].replace(':','-')}"[:31])
@@ -630,8 +612,7 @@ def get_proposal_xlsx(proposal):
             )
         utils.write_xlsx_field(ws, nrow, 1, value, field["type"], formats)
         nrow += 1
-    wb.close()
-    return result
+    return utils.close_xlsx_workbook(wb, outfile)
 
 
 def allow_create(call):
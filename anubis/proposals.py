@@ -1,11 +1,11 @@
 "Lists of proposals."
 
-import io
+import math
 import statistics
 
 import flask
-import xlsxwriter
 
+import anubis.analytics
 import anubis.call
 import anubis.database
 import anubis.decision
@@ -28,19 +28,25 @@ def call(cid):
     if not anubis.call.allow_view_proposals(call):
         return utils.error("You may not view the proposals of the call.")
 
-    proposals = get_call_proposals(call)
+    etag, _ = anubis.call.get_call_etag(
+        call, ["proposals", "reviews", "decisions", "grants"]
+    )
+    response = utils.get_not_modified(etag)
+    if response:
+        return response
+
+    # The rows of the table are fetched page by page from 'call_json'.
+    proposals = get_call_proposals_summary(call)
+    users = anubis.user.get_users_summary([p["user"] for p in proposals])
     all_emails = []
     submitted_emails = []
     for proposal in proposals:
-        user = anubis.user.get_user(username=proposal["user"])
+        user = users.get(proposal["user"])
         if not user:
             continue
         all_emails.append(user["email"])
         if proposal.get("submitted"):
             submitted_emails.append(user["email"])
-        proposal["n_reviews"] = anubis.database.get_count(
-            "reviews", "proposal", proposal["identifier"]
-        )
     # There may be accounts that have no email!
     all_emails = sorted(set([e for e in all_emails if e]))
     submitted_emails = sorted(set([e for e in submitted_emails if e]))
@@ -48,21 +54,126 @@ def call(cid):
         "Emails to for submitted proposals": ", ".join(submitted_emails),
         "Emails for all proposals": ", ".join(all_emails),
     }
-    rank_fields, rank_errors = get_rank_fields_errors(call, proposals)
-    return flask.render_template(
+    # Only the fields are needed for the table header; not the statistics.
+    review_score_fields = anubis.analytics.get_score_fields(call)
+    rank_fields = anubis.analytics.get_rank_fields(call)
+    rank_errors = get_rank_errors(call)
+    response = flask.render_template(
         "proposals/call.html",
         call=call,
-        proposals=proposals,
         email_lists=email_lists,
-        review_score_fields=get_review_score_fields(call, proposals),
+        review_score_fields=review_score_fields,
         review_rank_fields=rank_fields,
         review_rank_errors=rank_errors,
         am_reviewer=anubis.call.am_reviewer(call),
         allow_view_reviews=anubis.call.allow_view_reviews(call),
         allow_view_decisions=anubis.call.allow_view_decisions(call),
         allow_view_grants=anubis.call.allow_view_grants(call),
-        get_reviewer_review=anubis.review.get_reviewer_review,
     )
+    return utils.set_validators(response, etag)
+
+
+@blueprint.route("/call/<cid>.json")
+@utils.login_required
+def call_json(cid):
+    """Return a page of the table of all proposals in a call; DataTables server-side.
+    The values to search and sort by are obtained from views; only the
+    documents for the proposals in the requested page are loaded.
+    The banner, decision and grant columns can be neither searched nor sorted.
+    """
+    call = anubis.call.get_call(cid)
+    if not call:
+        return utils.error("No such call.")
+    if not anubis.call.allow_view_proposals(call):
+        return utils.error("You may not view the proposals of the call.")
+
+    proposals = get_call_proposals_summary(call)
+    users = anubis.user.get_users_summary([p["user"] for p in proposals])
+    review_score_fields = get_review_score_fields(call, proposals)
+    rank_fields, _ = get_rank_fields_errors(call, proposals)
+    am_reviewer = anubis.call.am_reviewer(call)
+    allow_view_reviews = anubis.call.allow_view_reviews(call)
+    allow_view_decisions = anubis.call.allow_view_decisions(call)
+    allow_view_grants = anubis.call.allow_view_grants(call)
+
+    # The columns must be the same as in the template.
+    columns = ["proposal"]
+    columns.extend([None] * len(anubis.call.get_banner_fields(call["proposal"])))
+    if flask.g.am_admin:
+        columns.append("submitted")
+    columns.append("submitter")
+    if am_reviewer:
+        columns.extend([None, None])
+    if allow_view_reviews:
+        columns.append("number_reviews")
+        for id in rank_fields:
+            columns.extend([f"ranking.{id}.factor", f"ranking.{id}.stdev"])
+        if len(review_score_fields) >= 2:
+            columns.extend(["scores.__mean__", "scores.__stdev__"])
+        for id in review_score_fields:
+            columns.append(f"scores.{id}.mean")
+            if len(review_score_fields) == 1:
+                columns.append(f"scores.{id}.stdev")
+            columns.append(f"scores.{id}.normalized")
+    if allow_view_decisions:
+        columns.append(None)
+        columns.extend([None] * len(anubis.call.get_banner_fields(call["decision"])))
+    if allow_view_grants:
+        columns.append(None)
+
+    # Flattened values for search and sort.
+    for proposal in proposals:
+        proposal["proposal"] = f"{proposal['identifier']} {proposal['title'] or ''}"
+        user = users.get(proposal["user"])
+        if user:
+            proposal["submitter"] = anubis.user.get_fullname(user)
+        else:
+            proposal["submitter"] = proposal["user"]
+        for id, ranking in proposal["ranking"].items():
+            for key, value in ranking.items():
+                proposal[f"ranking.{id}.{key}"] = value
+        for id, scores in proposal["scores"].items():
+            if isinstance(scores, dict):
+                for key, value in scores.items():
+                    proposal[f"scores.{id}.{key}"] = value
+            else:
+                proposal[f"scores.{id}"] = scores
+
+    def get_rows(page):
+        docs = anubis.database.get_docs_keys(
+            "proposals", "identifier", [p["identifier"] for p in page]
+        )
+        lookup = {d["identifier"]: d for d in docs}
+        page_proposals = []
+        for item in page:
+            # A proposal may have been deleted after the list was obtained.
+            try:
+                proposal = lookup[item["identifier"]]
+            except KeyError:
+                continue
+            for key in ["number_reviews", "number_finalized_reviews"]:
+                proposal[key] = item[key]
+            proposal["scores"] = item["scores"]
+            proposal["ranking"] = item["ranking"]
+            page_proposals.append(proposal)
+        decisions_lookup, grants_lookup = get_decisions_grants_lookups(page_proposals)
+        return utils.get_table_rows(
+            "proposals/call_rows.html",
+            call=call,
+            proposals=page_proposals,
+            users=users,
+            review_score_fields=review_score_fields,
+            review_rank_fields=rank_fields,
+            am_reviewer=am_reviewer,
+            allow_view_reviews=allow_view_reviews,
+            allow_view_decisions=allow_view_decisions,
+            allow_view_grants=allow_view_grants,
+            get_reviewer_review=anubis.review.get_reviewer_review,
+            decisions_lookup=decisions_lookup,
+            grants_lookup=grants_lookup,
+        )
+
+    return utils.get_datatables_response(proposals, columns, get_rows)
 
 
 @blueprint.route("/call/<cid>.xlsx")
@@ -75,19 +186,23 @@ def call_xlsx(cid):
     if not anubis.call.allow_view(call):
         return utils.error("You may not view the call.")
 
+    etag, last_modified = anubis.call.get_call_etag(
+        call, ["proposals", "reviews", "decisions", "grants"]
+    )
+    response = utils.get_not_modified(etag)
+    if response:
+        return response
+
     submitted = utils.to_bool(flask.request.args.get("submitted", ""))
-    response = flask.make_response(get_call_xlsx(call, submitted=submitted))
-    response.headers.set("Content-Type", constants.XLSX_MIMETYPE)
-    response.headers.set(
-        "Content-Disposition",
-        "attachment",
-        filename=f"{call['identifier']}_proposals.xlsx",
+    response = utils.send_xlsx_file(
+        get_call_xlsx(call, submitted=submitted),
+        f"{call['identifier']}_proposals.xlsx",
     )
-    return response
+    return utils.set_validators(response, etag, last_modified)
 
 
 def get_call_xlsx(call, submitted=False, proposals=None):
-    """Return the content of an XLSX file for all proposals in a call.
+    """Return a temporary file containing the XLSX file for all proposals in a call.
     Optionally only the submitted ones.
     Optionally for the given list proposals.
     """
@@ -99,9 +214,12 @@ def get_call_xlsx(call, submitted=False, proposals=None):
     allow_view_reviews = anubis.call.allow_view_reviews(call)
     if allow_view_reviews:
         score_fields = get_review_score_fields(call, proposals)
-        rank_fields, rank_errors = get_rank_fields_errors(call, proposals)
-    output = io.BytesIO()
-    wb = xlsxwriter.Workbook(output, {"in_memory": True})
+        rank_fields, _ = get_rank_fields_errors(call, proposals)
+    users = anubis.user.get_users_lookup([p["user"] for p in proposals])
+    allow_view_decisions = anubis.call.allow_view_decisions(call)
+    if allow_view_decisions:
+        decisions_lookup = get_decisions_grants_lookups(proposals, call)[0]
+    wb, outfile = utils.create_xlsx_workbook()
     formats = utils.create_xlsx_formats(wb)
     # Hard str(len) limit for worksheet title.
     ws = wb.add_worksheet(title[:31])
@@ -136,7 +254,7 @@ def get_call_xlsx(call, submitted=False, proposals=None):
             row.append(f"Reviews {rf['title']}: N")
             row.append(f"Reviews {rf['title']}: mean")
             row.append(f"Reviews {rf['title']}: stdev")
-    allow_view_decisions = anubis.call.allow_view_decisions(call)
+            row.append(f"Reviews {rf['title']}: normalized mean")
     if allow_view_decisions:
         row.append("Decision")
         row.append("Decision status")
@@ -148,121 +266,326 @@ def get_call_xlsx(call, submitted=False, proposals=None):
     ws.write_row(nrow, 0, row)
     nrow += 1
 
+    columns = get_call_columns(call)
+    field_types = dict(
+        [(f"proposal.{f['identifier']}", f["type"]) for f in call["proposal"]]
+        + [(f"decision.{f['identifier']}", f["type"]) for f in call["decision"]]
+    )
     for proposal in proposals:
-        ncol = 0
-        ws.write_url(
-            nrow,
-            ncol,
-            flask.url_for(
-                "proposal.display", pid=proposal["identifier"], _external=True
-            ),
-            string=proposal["identifier"],
+        user = users.get(proposal["user"]) or {"username": proposal["user"]}
+        if allow_view_reviews:
+            row = get_call_row(call, proposal, user, score_fields, rank_fields)
+        else:
+            row = get_call_row(call, proposal, user)
+        if allow_view_decisions:
+            row.update(
+                get_call_decision_row(
+                    call, decisions_lookup.get(proposal["identifier"]) or {}
+                )
+            )
+        for ncol, column in enumerate(columns):
+            value = row.get(column)
+            if column == "proposal":
+                ws.write_url(
+                    nrow,
+                    ncol,
+                    flask.url_for("proposal.display", pid=value, _external=True),
+                    string=value,
+                )
+            elif column in field_types:
+                utils.write_xlsx_field(
+                    ws, nrow, ncol, value, field_types[column], formats
+                )
+            elif column in ("decision", "decision_status"):
+                ws.write_string(nrow, ncol, value or "-")
+            elif isinstance(value, bool):
+                ws.write_string(nrow, ncol, value and "Yes" or "No")
+            elif isinstance(value, (int, float)):
+                ws.write_number(nrow, ncol, value)
+            else:
+                ws.write_string(nrow, ncol, value or "")
+        nrow += 1
+
+    return utils.close_xlsx_workbook(wb, outfile)
+
+
+@blueprint.route("/call/<cid>.csv")
+@utils.login_required
+def call_csv(cid):
+    "Produce a CSV file of all proposals in a call, optionally selected columns."
+    return get_call_rows_response(cid, "csv")
+
+
+@blueprint.route("/call/<cid>.jsonl")
+@utils.login_required
+def call_jsonl(cid):
+    "Produce a JSON Lines file of all proposals in a call, optionally selected columns."
+    return get_call_rows_response(cid, "jsonl")
+
+
+def get_call_rows_response(cid, format):
+    """Return a response streaming the rows for the proposals in a call.
+    The access checks are the same as for the XLSX file.
+    """
+    call = anubis.call.get_call(cid)
+    if not call:
+        return utils.error("No such call.")
+    if not anubis.call.allow_view(call):
+        return utils.error("You may not view the call.")
+
+    try:
+        columns = utils.get_selected_columns(get_call_columns(call))
+    except ValueError as error:
+        return utils.error(error, flask.url_for("proposals.call", cid=cid))
+    submitted = utils.to_bool(flask.request.args.get("submitted", ""))
+    return utils.get_rows_response(
+        format,
+        columns,
+        get_call_rows(call, submitted=submitted),
+        f"{call['identifier']}_proposals",
+    )
+
+
+def get_call_columns(call):
+    """Return the names of the columns for the tabular exports of the proposals
+    in a call. These correspond to the columns of the XLSX file.
+    """
+    result = ["proposal", "title", "submitted", "submitter", "email", "affiliation"]
+    result.extend([f"proposal.{f['identifier']}" for f in call["proposal"]])
+    if anubis.call.allow_view_reviews(call):
+        result.extend(["reviews", "finalized_reviews"])
+        for f in call["review"]:
+            if f.get("banner") and f["type"] == constants.RANK:
+                result.append(f"rank.{f['identifier']}.factor")
+                result.append(f"rank.{f['identifier']}.stdev")
+        score_fields = [
+            f["identifier"]
+            for f in call["review"]
+            if f.get("banner") and f["type"] == constants.SCORE
+        ]
+        if len(score_fields) >= 2:
+            result.extend(["scores.mean", "scores.stdev"])
+        for id in score_fields:
+            for key in ["n", "mean", "stdev", "normalized"]:
+                result.append(f"score.{id}.{key}")
+    if anubis.call.allow_view_decisions(call):
+        result.extend(["decision", "decision_status"])
+        result.extend(
+            [f"decision.{f['identifier']}" for f in call["decision"] if f.get("banner")]
         )
-        ncol += 1
-        ws.write_string(nrow, ncol, proposal.get("title") or "")
-        ncol += 1
-        ws.write_string(nrow, ncol, proposal.get("submitted") and "Yes" or "No")
-        ncol += 1
-        user = anubis.user.get_user(username=proposal["user"])
-        ws.write_string(nrow, ncol, anubis.user.get_fullname(user))
-        ncol += 1
-        ws.write_string(nrow, ncol, user.get("email") or "")
-        ncol += 1
-        ws.write_string(nrow, ncol, user.get("affiliation") or "")
-        ncol += 1
+    return result
 
-        for field in call["proposal"]:
-            value = proposal["values"].get(field["identifier"])
-            # Ugly, but necessary...
-            if value is not None and field["type"] == constants.DOCUMENT:
-                value = flask.url_for(
-                    "proposal.document",
-                    pid=proposal["identifier"],
-                    fid=field["identifier"],
-                    _external=True,
-                )
-            utils.write_xlsx_field(ws, nrow, ncol, value, field["type"], formats)
-            ncol += 1
 
+def get_call_rows(call, submitted=False):
+    """Yield the rows for the tabular exports of the proposals in a call,
+    as dictionaries keyed by column name. Optionally only the submitted ones.
+    The proposals are read from the database in chunks.
+    """
+    allow_view_reviews = anubis.call.allow_view_reviews(call)
+    allow_view_decisions = anubis.call.allow_view_decisions(call)
+    if allow_view_reviews:
+        # The call-wide statistics are obtained for the first chunk, and
+        # are then reused from the cache.
+        score_fields = anubis.analytics.get_score_fields(call)
+        rank_fields = anubis.analytics.get_rank_fields(call)
+    for proposals in anubis.database.get_docs_chunks(
+        "proposals", "call_identifier", call["identifier"]
+    ):
+        if submitted:
+            proposals = [p for p in proposals if p.get("submitted")]
+        if not proposals:
+            continue
+        users = anubis.user.get_users_lookup([p["user"] for p in proposals])
         if allow_view_reviews:
-            ws.write_number(nrow, ncol, proposal["number_reviews"])
-            ncol += 1
-            ws.write_number(nrow, ncol, proposal["number_finalized_reviews"])
-            ncol += 1
-            for id in rank_fields.keys():
-                value = proposal["ranking"][id]["factor"]
-                if value is None:
-                    ws.write_string(nrow, ncol, "")
-                else:
-                    ws.write_number(nrow, ncol, value)
-                ncol += 1
-                value = proposal["ranking"][id]["stdev"]
-                if value is None:
-                    ws.write_string(nrow, ncol, "")
-                else:
-                    ws.write_number(nrow, ncol, value)
-                ncol += 1
-            if len(score_fields) >= 2:
-                value = proposal["scores"]["__mean__"]
-                if value is None:
-                    ws.write_string(nrow, ncol, "")
-                else:
-                    ws.write_number(nrow, ncol, value)
-                ncol += 1
-                value = proposal["scores"]["__stdev__"]
-                if value is None:
-                    ws.write_string(nrow, ncol, "")
-                else:
-                    ws.write_number(nrow, ncol, value)
-                ncol += 1
-            for id in score_fields:
-                ws.write_number(nrow, ncol, proposal["scores"][id]["n"])
-                ncol += 1
-                value = proposal["scores"][id]["mean"]
-                if value is None:
-                    ws.write_string(nrow, ncol, "")
-                else:
-                    ws.write_number(nrow, ncol, value)
-                ncol += 1
-                value = proposal["scores"][id]["stdev"]
-                if value is None:
-                    ws.write_string(nrow, ncol, "")
-                else:
-                    ws.write_number(nrow, ncol, value)
-                ncol += 1
-
+            get_review_score_fields(call, proposals)
+            get_rank_fields_errors(call, proposals)
         if allow_view_decisions:
-            decision = anubis.decision.get_decision(proposal.get("decision")) or {}
-            if decision:
-                verdict = decision.get("verdict")
-                if verdict:
-                    ws.write(nrow, ncol, "Accepted")
-                elif verdict is None:
-                    ws.write(nrow, ncol, "Undecided")
-                else:
-                    ws.write(nrow, ncol, "Declined")
-            else:
-                ws.write(nrow, ncol, "-")
-            ncol += 1
-            if decision.get("finalized"):
-                ws.write(nrow, ncol, "Finalized")
+            decisions_lookup = {
+                d["proposal"]: d
+                for d in anubis.database.get_docs_keys(
+                    "decisions", "proposal", [p["identifier"] for p in proposals]
+                )
+            }
+        for proposal in proposals:
+            user = users.get(proposal["user"]) or {"username": proposal["user"]}
+            if allow_view_reviews:
+                row = get_call_row(call, proposal, user, score_fields, rank_fields)
             else:
-                ws.write(nrow, ncol, "-")
-            ncol += 1
-            for field in call["decision"]:
-                if not field.get("banner"):
-                    continue
-                if decision.get("finalized"):
-                    value = decision["values"].get(field["identifier"])
-                    ws.write(nrow, ncol, value)
-                else:
-                    ws.write_string(nrow, ncol, "")
-                ncol += 1
+                row = get_call_row(call, proposal, user)
+            if allow_view_decisions:
+                row.update(
+                    get_call_decision_row(
+                        call, decisions_lookup.get(proposal["identifier"]) or {}
+                    )
+                )
+            yield row
 
-        nrow += 1
 
-    wb.close()
-    return output.getvalue()
+def get_call_row(call, proposal, user, score_fields=None, rank_fields=None):
+    """Return the row for the proposal in the tabular exports (XLSX, CSV
+    and JSON Lines) of the proposals in a call, as a dictionary keyed by
+    the column names given by 'get_call_columns', except the decision ones.
+    The review columns are set if the score and rank fields are given,
+    in which case the proposal must have been processed by the functions
+    'get_review_score_fields' and 'get_rank_fields_errors'.
+    """
+    result = {
+        "proposal": proposal["identifier"],
+        "title": proposal.get("title") or "",
+        "submitted": bool(proposal.get("submitted")),
+        "submitter": anubis.user.get_fullname(user),
+        "email": user.get("email") or "",
+        "affiliation": user.get("affiliation") or "",
+    }
+    for field in call["proposal"]:
+        value = proposal["values"].get(field["identifier"])
+        # Ugly, but necessary...
+        if value is not None and field["type"] == constants.DOCUMENT:
+            value = flask.url_for(
+                "proposal.document",
+                pid=proposal["identifier"],
+                fid=field["identifier"],
+                _external=True,
+            )
+        result[f"proposal.{field['identifier']}"] = value
+    if score_fields is not None and rank_fields is not None:
+        result["reviews"] = proposal["number_reviews"]
+        result["finalized_reviews"] = proposal["number_finalized_reviews"]
+        for id in rank_fields:
+            result[f"rank.{id}.factor"] = proposal["ranking"][id]["factor"]
+            result[f"rank.{id}.stdev"] = proposal["ranking"][id]["stdev"]
+        if len(score_fields) >= 2:
+            result["scores.mean"] = proposal["scores"]["__mean__"]
+            result["scores.stdev"] = proposal["scores"]["__stdev__"]
+        for id in score_fields:
+            for key in ["n", "mean", "stdev", "normalized"]:
+                result[f"score.{id}.{key}"] = proposal["scores"][id][key]
+    return result
+
+
+def get_call_decision_row(call, decision):
+    """Return the decision columns of the row for a proposal in the tabular
+    exports of the proposals in a call. The decision may be an empty dictionary.
+    The values of the decision fields are given only if it is finalized.
+    """
+    result = {}
+    if decision:
+        result["decision"] = get_verdict_label(decision)
+    if decision.get("finalized"):
+        result["decision_status"] = "Finalized"
+        for field in call["decision"]:
+            if field.get("banner"):
+                result[f"decision.{field['identifier']}"] = get_decision_value(
+                    decision, field
+                )
+    return result
+
+
+def get_verdict_label(decision):
+    "Return the label for the verdict of the decision in the exports."
+    verdict = decision.get("verdict")
+    if verdict:
+        return "Accepted"
+    elif verdict is None:
+        return "Undecided"
+    else:
+        return "Declined"
+
+
+def get_decision_value(decision, field):
+    "Return the value of the field in the decision, or the URL if a document."
+    value = decision["values"].get(field["identifier"])
+    # Ugly, but necessary...
+    if value is not None and field["type"] == constants.DOCUMENT:
+        value = flask.url_for(
+            "decision.document",
+            iuid=decision["_id"],
+            fid=field["identifier"],
+            _external=True,
+        )
+    return value
+
+
+@blueprint.route("/call/<cid>/decisions.csv")
+@utils.login_required
+def call_decisions_csv(cid):
+    "Produce a CSV file of all decisions in a call, optionally selected columns."
+    return get_call_decisions_rows_response(cid, "csv")
+
+
+@blueprint.route("/call/<cid>/decisions.jsonl")
+@utils.login_required
+def call_decisions_jsonl(cid):
+    "Produce a JSON Lines file of all decisions in a call, optionally selected columns."
+    return get_call_decisions_rows_response(cid, "jsonl")
+
+
+def get_call_decisions_rows_response(cid, format):
+    """Return a response streaming the rows for the decisions in a call.
+    There are no decision lists; the access checks are the same as for
+    the decisions columns in the proposals XLSX file.
+    """
+    call = anubis.call.get_call(cid)
+    if not call:
+        return utils.error("No such call.")
+    if not anubis.call.allow_view(call):
+        return utils.error("You may not view the call.")
+    if not anubis.call.allow_view_decisions(call):
+        return utils.error("You may not view the decisions of the call.")
+
+    try:
+        columns = utils.get_selected_columns(get_call_decisions_columns(call))
+    except ValueError as error:
+        return utils.error(error, flask.url_for("proposals.call", cid=cid))
+    return utils.get_rows_response(
+        format,
+        columns,
+        get_call_decisions_rows(call),
+        f"{call['identifier']}_decisions",
+    )
+
+
+def get_call_decisions_columns(call):
+    "Return the names of the columns for the tabular exports of decisions in a call."
+    result = ["proposal", "title", "submitter", "decision", "verdict", "finalized"]
+    result.extend([f"decision.{f['identifier']}" for f in call["decision"]])
+    return result
+
+
+def get_call_decisions_rows(call):
+    """Yield the rows for the tabular exports of the decisions in a call,
+    as dictionaries keyed by column name.
+    The decisions are read from the database in chunks.
+    """
+    for decisions in anubis.database.get_docs_chunks(
+        "decisions", "call_proposal", call["identifier"]
+    ):
+        proposals = {
+            p["identifier"]: p
+            for p in anubis.database.get_docs_keys(
+                "proposals", "identifier", [d["proposal"] for d in decisions]
+            )
+        }
+        users = anubis.user.get_users_lookup([p["user"] for p in proposals.values()])
+        for decision in decisions:
+            proposal = proposals.get(decision["proposal"]) or {}
+            username = proposal.get("user")
+            user = users.get(username) or {"username": username or "?"}
+            row = {
+                "proposal": decision["proposal"],
+                "title": proposal.get("title") or "",
+                "submitter": anubis.user.get_fullname(user),
+                "decision": flask.url_for(
+                    "decision.display", iuid=decision["_id"], _external=True
+                ),
+                "verdict": get_verdict_label(decision),
+                "finalized": bool(decision.get("finalized")),
+            }
+            for field in call["decision"]:
+                row[f"decision.{field['identifier']}"] = get_decision_value(
+                    decision, field
+                )
+            yield row
 
 
 @blueprint.route("/user/<username>")
@@ -277,11 +600,14 @@ def user(username):
 
     proposals = get_user_proposals(user["username"])
     proposals.extend(anubis.database.get_docs("proposals", "access", user["username"]))
+    decisions_lookup, grants_lookup = get_decisions_grants_lookups(proposals)
     return flask.render_template(
         "proposals/user.html",
         user=user,
         proposals=proposals,
         allow_view_decision=anubis.decision.allow_view,
+        decisions_lookup=decisions_lookup,
+        grants_lookup=grants_lookup,
     )
 
 
@@ -306,6 +632,41 @@ def get_call_proposals(call, submitted=False):
     return result
 
 
+def get_call_proposals_summary(call):
+    """Get the summaries of the proposals in the call; identifier, title,
+    user and submitted. Only include those allowed to view, unless allowed
+    to view call. Obtained from a view, so no proposal documents are loaded.
+    """
+    result = []
+    for row in flask.g.db.view("proposals", "call_summary", key=call["identifier"]):
+        result.append(dict(call=call["identifier"], **row.value))
+    if not anubis.call.allow_view(call):
+        result = [p for p in result if anubis.proposal.allow_view(p)]
+    result.sort(key=lambda p: p["identifier"])
+    return result
+
+
+def get_decisions_grants_lookups(proposals, call=None):
+    """Return two dictionaries containing the decisions and the grants
+    for the proposals, keyed by proposal identifier.
+    If the call is given, get all decisions and grants in it with one query each,
+    else with one keyed query each for the given proposals.
+    """
+    if call:
+        decisions = anubis.database.get_docs("decisions", "call", call["identifier"])
+        grants = anubis.database.get_docs("grants", "call", call["identifier"])
+    else:
+        pids = [p["identifier"] for p in proposals]
+        decisions = anubis.database.get_docs_keys("decisions", "proposal", pids)
+        grants = anubis.database.get_docs_keys("grants", "proposal", pids)
+    for grant in grants:
+        utils.cache_put(f"grant {grant['proposal']}", grant)
+    return (
+        {d["proposal"]: d for d in decisions},
+        {g["proposal"]: g for g in grants},
+    )
+
+
 def get_user_proposals(username):
     "Get all proposals created by the user."
     result = [
@@ -325,42 +686,31 @@ def get_review_score_fields(call, proposals):
     Compute the score means and stdevs. If there are more than two score
     fields, then also compute the mean of the means and the stdev of the means.
     This is done over all finalized non-conflict-of-interest reviews for each proposal.
-    Store the values in the proposal document.
+    Store the values in the proposal document, including the mean
+    reviewer-normalized score (z-score) of each field.
     Also store the total number of reviews and finalized in the proposal document.
+    The statistics are obtained from grouped queries of reduce views,
+    so that no review documents need to be loaded.
     """
-    fields = dict(
-        [
-            (f["identifier"], f)
-            for f in call["review"]
-            if f.get("banner") and f["type"] == constants.SCORE
-        ]
-    )
+    fields = anubis.analytics.get_score_fields(call)
+    counts, stats = get_review_statistics(call, fields)
+    if fields:
+        analytics = anubis.analytics.get_call_analytics(call)
     for proposal in proposals:
-        reviews = anubis.database.get_docs(
-            "reviews", "proposal", proposal["identifier"]
-        )
-        proposal["number_reviews"] = len(reviews)
-        reviews = [r for r in reviews if r.get("finalized")]
-        proposal["number_finalized_reviews"] = len(reviews)
-        reviews = [r for r in reviews if not r["values"].get("conflict_of_interest")]
-        scores = dict([(id, list()) for id in fields])
-        for review in reviews:
-            for id in fields:
-                value = review["values"].get(id)
-                if value is not None:
-                    scores[id].append(float(value))
+        count = counts.get(proposal["identifier"]) or {"count": 0, "sum": 0}
+        proposal["number_reviews"] = count["count"]
+        proposal["number_finalized_reviews"] = int(count["sum"])
         proposal["scores"] = dict()
         for id in fields:
             proposal["scores"][id] = d = dict()
-            d["n"] = len(scores[id])
-            try:
-                d["mean"] = round(statistics.mean(scores[id]), 1)
-            except statistics.StatisticsError:
-                d["mean"] = None
-            try:
-                d["stdev"] = round(statistics.stdev(scores[id]), 1)
-            except statistics.StatisticsError:
-                d["stdev"] = None
+            value = stats.get((proposal["identifier"], id)) or {"count": 0}
+            d["n"] = value["count"]
+            d["normalized"] = analytics.get_normalized(id, proposal["identifier"])
+            d["mean"], d["stdev"] = get_mean_stdev(value)
+            if d["mean"] is not None:
+                d["mean"] = round(d["mean"], 1)
+            if d["stdev"] is not None:
+                d["stdev"] = round(d["stdev"], 1)
         if len(fields) >= 2:
             mean_scores = [
                 d["mean"] for d in proposal["scores"].values() if d["mean"] is not None
@@ -369,7 +719,6 @@ def get_review_score_fields(call, proposals):
                 mean_means = round(statistics.mean(mean_scores), 1)
             except statistics.StatisticsError:
                 mean_means = None
-            proposal["scores"]["__mean__"] = mean_means
             try:
                 stdev_means = round(statistics.stdev(mean_scores), 1)
             except statistics.StatisticsError:
@@ -379,6 +728,58 @@ def get_review_score_fields(call, proposals):
     return fields
 
 
+def get_review_statistics(call, fields):
+    """Return the number of all reviews and of finalized reviews per proposal,
+    and the statistics of the values per proposal and score field, from
+    grouped queries of reduce views. Computed at most once per request,
+    so that the exports which process the proposals in chunks do not
+    repeat the queries.
+    """
+    key = f"review statistics {call['identifier']}"
+    try:
+        return utils.cache_get(key)
+    except KeyError:
+        pass
+    # Count of all reviews, and sum of finalized reviews, per proposal.
+    result = flask.g.db.view(
+        "reviews",
+        "call_proposal",
+        startkey=[call["identifier"], ""],
+        endkey=[call["identifier"], constants.CEILING],
+        group_level=2,
+        reduce=True,
+    )
+    counts = {r.key[1]: r.value for r in result}
+    # Statistics of values per proposal and review field.
+    stats = {}
+    if fields:
+        result = flask.g.db.view(
+            "reviews",
+            "call_proposal_score",
+            startkey=[call["identifier"], ""],
+            endkey=[call["identifier"], constants.CEILING],
+            group_level=3,
+            reduce=True,
+        )
+        stats = {(r.key[1], r.key[2]): r.value for r in result}
+    return utils.cache_put(key, (counts, stats))
+
+
+def get_mean_stdev(stats):
+    """Return the mean and the sample stdev from the value of a '_stats' reduce.
+    Either is None if it cannot be computed for the number of values.
+    """
+    n = stats.get("count") or 0
+    if n == 0:
+        return None, None
+    mean = stats["sum"] / n
+    if n < 2:
+        return mean, None
+    # Guard against small negative values due to floating-point rounding.
+    variance = max(0.0, (stats["sumsqr"] - stats["sum"] * stats["sum"] / n) / (n - 1))
+    return mean, math.sqrt(variance)
+
+
 def get_rank_fields_errors(call, proposals):
     """Return a tuple containing a dictionary of the rank banner fields
     in the reviews and a list of reviewers with rank field errors.
@@ -386,59 +787,19 @@ def get_rank_fields_errors(call, proposals):
     Compute the ranking factors of each proposal from all finalized
     non-conflict-of-interest reviews.
     """
-    rank_fields = dict(
-        [
-            (f["identifier"], f)
-            for f in call["review"]
-            if f.get("banner") and f["type"] == constants.RANK
-        ]
-    )
-    rank_errors = []
-    for id in rank_fields.keys():
-        # Collect the ranks set by each reviewer for each proposal under their review.
-        ranks = dict()  # key: reviewerid, value: dict(pid: rank)
-        for proposal in proposals:
-            reviews = anubis.database.get_docs(
-                "reviews", "proposal", proposal["identifier"]
-            )
-            reviews = [r for r in reviews if r.get("finalized")]
-            reviews = [
-                r for r in reviews if not r["values"].get("conflict_of_interest")
-            ]
-            for review in reviews:
-                try:
-                    value = review["values"][id]
-                    if value is None:
-                        raise KeyError
-                except KeyError:
-                    pass
-                else:
-                    d = ranks.setdefault(review["reviewer"], dict())
-                    d[proposal["identifier"]] = value
-        # Check that ranking values start with 1 and are consecutive.
-        for reviewer, values in ranks.items():
-            series = list(values.values())
-            if series:
-                if set(series) != set(range(1, max(series) + 1)):
-                    rank_errors.append(anubis.user.get_user(username=reviewer))
-        # For each proposal, compute ranking factor.
-        for proposal in proposals:
-            factors = []
-            for reviewer, values in ranks.items():
-                try:
-                    value = values[proposal["identifier"]]
-                except KeyError:
-                    pass
-                else:
-                    factors.append(float(len(values) - value + 1) / len(values))
-            rf = proposal.setdefault("ranking", dict())
-            rf[id] = dict()
-            try:
-                rf[id]["factor"] = round(10.0 * statistics.mean(factors), 1)
-            except statistics.StatisticsError:
-                rf[id]["factor"] = None
-            try:
-                rf[id]["stdev"] = round(10.0 * statistics.stdev(factors), 1)
-            except statistics.StatisticsError:
-                rf[id]["stdev"] = None
-    return rank_fields, rank_errors
+    analytics = anubis.analytics.get_call_analytics(call)
+    for proposal in proposals:
+        proposal["ranking"] = {
+            id: analytics.get_ranking(id, proposal["identifier"])
+            for id in analytics.rank_fields
+        }
+    return analytics.rank_fields, get_rank_errors(call)
+
+
+def get_rank_errors(call):
+    """Return the list of reviewers with rank field errors in the call.
+    The analytics of the call are not needed for this.
+    """
+    errors = anubis.analytics.get_rank_errors(call)
+    users = anubis.user.get_users_lookup(errors)
+    return [users[r] for r in sorted(errors) if r in users]
@@ -0,0 +1,180 @@
+"""Reminder campaigns before the deadlines of calls.
+
+Before a call closes, the users with unsubmitted proposals in it are reminded.
+Before the reviews are due, the reviewers with unfinalized reviews are reminded.
+A campaign is due when the deadline is within one of the configured number of
+days. The recipients of a campaign are obtained from a single grouped query of
+a reduce view, and their messages are put in the outbox as one batch.
+
+A campaign is recorded by a document with an identifier given by the call,
+the kind of reminder and the number of days, so that it is sent only once,
+even if several server processes check for due campaigns.
+"""
+
+import datetime
+
+import couchdb2
+import dateutil.parser
+import flask
+
+import anubis.outbox
+import anubis.schedule
+import anubis.user
+from anubis import constants, utils
+
+PROPOSALS = "proposals"  # Unsubmitted proposals before the call closes.
+REVIEWS = "reviews"  # Unfinalized reviews before the reviews are due.
+
+
+def get_days():
+    "Return the configured numbers of days before a deadline, in increasing order."
+    days = flask.current_app.config.get("REMINDER_DAYS") or ""
+    return sorted({int(d) for d in days.split(",") if d.strip()})
+
+
+def get_due_campaigns(days=None):
+    """Return the campaigns that are due now and have not already been sent.
+    A campaign is a dictionary with the call, the kind, the deadline and the
+    number of days. For each deadline, only the campaign for the smallest
+    number of days is due, so that the reminders are not sent repeatedly.
+    """
+    if days is None:
+        days = get_days()
+    now = datetime.datetime.now(tz=datetime.UTC)
+    result = []
+    schedule = anubis.schedule.get_schedule()
+    for call in schedule.calls.values():
+        for kind, key in [(PROPOSALS, "closes"), (REVIEWS, "reviews_due")]:
+            if not call.get(key):
+                continue
+            if kind == PROPOSALS and not call.get("opens"):
+                continue
+            deadline = dateutil.parser.isoparse(call[key])
+            if deadline <= now:
+                continue
+            for number in days:
+                if deadline - now <= datetime.timedelta(days=number):
+                    break
+            else:
+                continue
+            identifier = f"reminder_{call['identifier']}_{kind}_{number}"
+            if identifier in flask.g.db:
+                continue
+            result.append(
+                {
+                    "identifier": identifier,
+                    "call": call,
+                    "kind": kind,
+                    "deadline": call[key],
+                    "days": number,
+                }
+            )
+    return result
+
+
+def get_recipients(campaign):
+    """Return the recipients of the campaign, as a list of dictionaries
+    with user summary and the number of unsubmitted proposals or unfinalized
+    reviews. Obtained with one grouped query and one query for the users.
+    """
+    cid = campaign["call"]["identifier"]
+    if campaign["kind"] == PROPOSALS:
+        designname, viewname = "proposals", "call_unsubmitted"
+    else:
+        designname, viewname = "reviews", "call_unfinalized"
+    counts = {
+        row.key[1]: row.value
+        for row in flask.g.db.view(
+            designname,
+            viewname,
+            startkey=[cid, ""],
+            endkey=[cid, constants.CEILING],
+            group_level=2,
+            reduce=True,
+        )
+    }
+    users = anubis.user.get_users_summary(list(counts.keys()))
+    result = []
+    for username, count in sorted(counts.items()):
+        user = users.get(username)
+        if not (user and user.get("email") and user["status"] == constants.ENABLED):
+            continue
+        result.append(dict(count=count, **user))
+    return result
+
+
+def get_message(campaign, recipient):
+    "Return the email message (recipients, title, text) for the recipient."
+    call = campaign["call"]
+    site = flask.current_app.config["SITE_NAME"]
+    deadline = utils.timezone_from_utc_isoformat(campaign["deadline"])
+    if campaign["kind"] == PROPOSALS:
+        url = utils.url_for_external("proposals.user", username=recipient["username"])
+        title = f"Reminder: call {call['identifier']} in {site} closes {deadline}"
+        text = (
+            f"You have {recipient['count']} unsubmitted proposal(s) in the call\n\n"
+            f"  {call['identifier']} {call['title']}\n\n"
+            f"which closes {deadline}. A proposal that has not been submitted"
+            " when the call closes will not be considered.\n\n"
+            f"View your proposals at {url}\n\n"
+            "/The Anubis system"
+        )
+    else:
+        url = utils.url_for_external(
+            "reviews.call_reviewer",
+            cid=call["identifier"],
+            username=recipient["username"],
+        )
+        title = (
+            f"Reminder: reviews in call {call['identifier']} in {site} due {deadline}"
+        )
+        text = (
+            f"You have {recipient['count']} unfinalized review(s) in the call\n\n"
+            f"  {call['identifier']} {call['title']}\n\n"
+            f"which are due {deadline}.\n\n"
+            f"View your reviews at {url}\n\n"
+            "/The Anubis system"
+        )
+    return (recipient["email"], title, text)
+
+
+def send(campaign):
+    """Record the campaign and put its messages in the outbox as one batch.
+    Return the number of messages, or None if the campaign was already
+    recorded by another server process.
+    Raise ValueError if the messages cannot be created or sent.
+    """
+    recipients = get_recipients(campaign)
+    messages = [get_message(campaign, r) for r in recipients]
+    try:
+        flask.g.db.put(
+            {
+                "_id": campaign["identifier"],
+                "doctype": constants.REMINDER,
+                "call": campaign["call"]["identifier"],
+                "kind": campaign["kind"],
+                "days": campaign["days"],
+                "deadline": campaign["deadline"],
+                "recipients": [r["username"] for r in recipients],
+                "created": utils.get_now(),
+            }
+        )
+    except couchdb2.RevisionError:
+        return None
+    anubis.outbox.send_emails(messages, batch=campaign["identifier"])
+    return len(messages)
+
+
+def run():
+    """Send the due campaigns, if reminders have been configured.
+    This requires the external URL of the site, for the links in the messages.
+    """
+    config = flask.current_app.config
+    if not (get_days() and config["MAIL_SERVER"] and config.get("EXTERNAL_URL")):
+        return
+    for campaign in get_due_campaigns():
+        count = send(campaign)
+        if count is not None:
+            flask.current_app.logger.info(
+                f"Reminder {campaign['identifier']}: {count} messages."
+            )
@@ -12,13 +12,14 @@ import os.path
 import couchdb2
 import flask
 
+import anubis.blobs
 import anubis.call
 import anubis.database
 import anubis.proposal
 import anubis.user
 from anubis import constants
 from anubis import utils
-from anubis.saver import Saver, FieldSaverMixin
+from anubis.saver import Saver, FieldSaverMixin, save_bulk
 
 
 blueprint = flask.Blueprint("review", __name__)
@@ -249,7 +250,7 @@ def logs(iuid):
         "logs.html",
         title=f"Review of {review['proposal']} by {review['reviewer']}",
         back_url=flask.url_for("review.display", iuid=review["_id"]),
-        logs=anubis.database.get_logs(review["_id"]),
+        **anubis.database.get_logs_page(review["_id"]),
     )
 
 
@@ -265,7 +266,7 @@ def document(iuid, fid):
         return utils.error("You are not allowed to read this review.")
     try:
         documentname = review["values"][fid]
-        stub = review["_attachments"][documentname]
+        anubis.blobs.get_stubs(review)[documentname]
     except KeyError:
         return utils.error(
             "No such document in review.", flask.url_for("review.display", iuid=iuid)
@@ -277,11 +278,7 @@ def document(iuid, fid):
     ext = os.path.splitext(documentname)[1]
     # Include reviewer id in filename to indicate review document.
     filename = f"{pid}-{review['reviewer']}-{fid}{ext}"
-    outfile = flask.g.db.get_attachment(review, documentname)
-    response = flask.make_response(outfile.read())
-    response.headers.set("Content-Type", stub["content_type"])
-    response.headers.set("Content-Disposition", "attachment", filename=filename)
-    return response
+    return anubis.blobs.send_attachment(review, documentname, filename)
 
 
 class ReviewSaver(FieldSaverMixin, Saver):
@@ -306,23 +303,29 @@ class ReviewSaver(FieldSaverMixin, Saver):
     def finish(self):
         "Check rank fields for conflicts with other reviews in same call."
         call = anubis.call.get_call(self["call"])
-        reviewer = anubis.user.get_user(self["reviewer"])
-        reviews = anubis.database.get_docs(
-            "reviews", "call_reviewer", [call["identifier"], reviewer["username"]]
-        )
-        rank_fields = [f for f in call["review"] if f["type"] == constants.RANK]
-        for field in rank_fields:
-            value = self["values"].get(field["identifier"])
-            if value is None:
-                continue
-            for review in reviews:
-                if self.doc["_id"] == review["_id"]:
-                    continue
-                if review["values"].get(field["identifier"]) == value:
-                    self["errors"][
-                        field["identifier"]
-                    ] = "Invalid: same value as in another review."
-                    break
+        rank_fields = [
+            f
+            for f in call["review"]
+            if f["type"] == constants.RANK
+            and self["values"].get(f["identifier"]) is not None
+        ]
+        if not rank_fields:  # E.g. a new review; no need to fetch the others.
+            return
+        # Keyed lookup of the same values for the same fields by the reviewer.
+        keys = [
+            [
+                call["identifier"],
+                self["reviewer"],
+                f["identifier"],
+                self["values"][f["identifier"]],
+            ]
+            for f in rank_fields
+        ]
+        for row in flask.g.db.view(
+            "reviews", "call_reviewer_rank", keys=keys, reduce=False
+        ):
+            if row.id != self.doc["_id"]:
+                self["errors"][row.key[2]] = "Invalid: same value as in another review."
 
     def set_proposal(self, proposal):
         "Set the proposal for the review; must be called when creating."
@@ -392,6 +395,39 @@ def get_reviewer_review(proposal, reviewer=None):
         return None
 
 
+def get_call_reviewer_proposals(call):
+    """Return a dictionary with reviewer as key and the set of identifiers
+    of the proposals having a review by the reviewer in the call as value.
+    Obtained from a single query; no review documents are loaded.
+    """
+    result = {}
+    for row in flask.g.db.view(
+        "reviews",
+        "call_reviewer",
+        startkey=[call["identifier"], ""],
+        endkey=[call["identifier"], constants.CEILING],
+        reduce=False,
+    ):
+        result.setdefault(row.key[1], set()).add(row.value)
+    return result
+
+
+def create_reviews(pairs):
+    """Create reviews for the given pairs of proposal and reviewer user.
+    The review documents and their log entries are stored in bulk.
+    Return the number of reviews created.
+    Raise ValueError if any of them could not be stored.
+    """
+    savers = [ReviewSaver(proposal=proposal, user=user) for proposal, user in pairs]
+    failed = save_bulk(savers)
+    if failed:
+        raise ValueError(
+            f"{failed} of {len(savers)} reviews could not be created;"
+            " please try again."
+        )
+    return len(savers)
+
+
 def allow_create(proposal):
     """The admin, staff, call owner and possibly chair may create a review
     for a submitted proposal.
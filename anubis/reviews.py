@@ -4,8 +4,8 @@ import io
 import zipfile
 
 import flask
-import xlsxwriter
 
+import anubis.analytics
 import anubis.call
 import anubis.database
 import anubis.proposal
@@ -37,16 +37,26 @@ def create(username):
     try:
         if user["username"] not in call["reviewers"]:
             raise ValueError(f"User is not a reviewer in the call '{cid}'.")
-        if utils.to_bool(flask.request.form.get("every", None)):
-            pidlist = [prop["identifier"] for prop in
-                       anubis.proposals.get_call_proposals(call, submitted=True)
-                       if anubis.review.get_reviewer_review(prop, user) is None]
+        existing = anubis.review.get_call_reviewer_proposals(call).get(
+            user["username"], set()
+        )
+        every = utils.to_bool(flask.request.form.get("every", None))
+        if every:
+            proposals = anubis.proposals.get_call_proposals(call, submitted=True)
         else:
-            pidlist = flask.request.form.getlist("pid")
-        for pid in pidlist:
-            proposal = anubis.proposal.get_proposal(pid)
+            proposals = [
+                anubis.proposal.get_proposal(pid)
+                for pid in flask.request.form.getlist("pid")
+            ]
+        pairs = []
+        for proposal in proposals:
             if proposal is None:
                 continue
+            pid = proposal["identifier"]
+            if pid in existing:
+                if not every:
+                    utils.flash_message(f"The review for '{pid}' already exists.")
+                continue
             if not anubis.review.allow_create(proposal):
                 raise ValueError(
                     f"You may not create a review for the proposal '{pid}'."
@@ -55,13 +65,8 @@ def create(username):
                 raise ValueError(
                     f"Reviewer not allowed to review their own proposal '{pid}'."
                 )
-
-            review = anubis.review.get_reviewer_review(proposal, user)
-            if review is None:
-                with anubis.review.ReviewSaver(proposal=proposal, user=user):
-                    pass
-            else:
-                utils.flash_message(f"The review for '{pid}' already exists.")
+            pairs.append((proposal, user))
+        anubis.review.create_reviews(pairs)
     except ValueError as error:
         utils.flash_error(error)
     return flask.redirect(
@@ -69,6 +74,41 @@ def create(username):
     )
 
 
+@blueprint.route("/create_all/<cid>", methods=["POST"])
+@utils.login_required
+def create_all(cid):
+    """Create the missing reviews of all submitted proposals in the call
+    for all reviewers in the call, except for their own proposals.
+    """
+    call = anubis.call.get_call(cid)
+    if not call:
+        return utils.error(f"No such call '{cid}'.")
+    if not anubis.call.allow_edit(call):
+        return utils.error("You may not create reviews in the call.")
+    reviewers = [anubis.user.get_user(username=r) for r in call["reviewers"]]
+    try:
+        existing = anubis.review.get_call_reviewer_proposals(call)
+        pairs = []
+        for proposal in anubis.proposals.get_call_proposals(call, submitted=True):
+            if not anubis.review.allow_create(proposal):
+                raise ValueError(
+                    f"You may not create a review for the proposal"
+                    f" '{proposal['identifier']}'."
+                )
+            for user in reviewers:
+                if user is None or user["username"] == proposal["user"]:
+                    continue
+                if proposal["identifier"] in existing.get(user["username"], set()):
+                    continue
+                pairs.append((proposal, user))
+        count = anubis.review.create_reviews(pairs)
+    except ValueError as error:
+        utils.flash_error(error)
+    else:
+        utils.flash_message(f"{count} reviews created.")
+    return flask.redirect(flask.url_for("call.reviewers", cid=cid))
+
+
 @blueprint.route("/call/<cid>")
 @utils.login_required
 def call(cid):
@@ -84,26 +124,106 @@ def call(cid):
             flask.url_for("call.display", cid=call["identifier"]),
         )
 
-    proposals = anubis.proposals.get_call_proposals(call, submitted=True)
-    for proposal in proposals:
-        proposal["allow_create_review"] = anubis.review.allow_create(proposal)
-    reviews = anubis.database.get_docs("reviews", "call", call["identifier"])
-    # For ordinary reviewer, list only finalized, non-conflict-of-interest reviews.
-    if flask.g.am_admin or flask.g.am_staff or anubis.call.am_chair(call):
-        only_finalized = False
-    else:
-        reviews = [r for r in reviews if r.get("finalized")]
-        reviews = [r for r in reviews if not r["values"].get("conflict_of_interest")]
-        only_finalized = True
-    reviews_lookup = {f"{r['proposal']} {r['reviewer']}": r for r in reviews}
-    return flask.render_template(
+    etag, _ = anubis.call.get_call_etag(call, ["proposals", "reviews"])
+    response = utils.get_not_modified(etag)
+    if response:
+        return response
+
+    # The rows of the table are fetched page by page from 'call_json'.
+    response = flask.render_template(
         "reviews/call.html",
         call=call,
-        proposals=proposals,
-        reviews_lookup=reviews_lookup,
-        only_finalized=only_finalized,
+        only_finalized=not allow_view_all_reviews(call),
+    )
+    return utils.set_validators(response, etag)
+
+
+@blueprint.route("/call/<cid>.json")
+@utils.login_required
+def call_json(cid):
+    """Return a page of the table of all reviews for a call; DataTables server-side.
+    The values to search and sort by are obtained from views; only the
+    documents for the reviews and proposals in the requested page are loaded.
+    The banner columns can be neither searched nor sorted.
+    """
+    call = anubis.call.get_call(cid)
+    if call is None:
+        return utils.error("No such call.")
+    if not anubis.call.allow_view(call):
+        return utils.error("You may not view the call.")
+    if not anubis.call.allow_view_reviews(call):
+        return utils.error("You may not view the reviews of the call.")
+
+    proposals = {
+        p["identifier"]: p
+        for p in anubis.proposals.get_call_proposals_summary(call)
+        if p.get("submitted")
+    }
+    reviewers = set(call["reviewers"])
+    only_finalized = not allow_view_all_reviews(call)
+    reviews = []
+    for row in flask.g.db.view("reviews", "call_summary", key=call["identifier"]):
+        review = dict(iuid=row.id, **row.value)
+        if review["proposal"] not in proposals or review["reviewer"] not in reviewers:
+            continue
+        # For ordinary reviewer, list only finalized, non-conflict-of-interest reviews.
+        if only_finalized:
+            if not review["finalized"] or review["conflict_of_interest"]:
+                continue
+        reviews.append(review)
+    users = anubis.user.get_users_summary(
+        [r["reviewer"] for r in reviews] + [p["user"] for p in proposals.values()]
     )
 
+    # Flattened values for search and sort.
+    for review in reviews:
+        proposal = proposals[review["proposal"]]
+        review["proposal"] = f"{proposal['identifier']} {proposal['title'] or ''}"
+        review["review"] = f"{review['reviewer']} {proposal['identifier']}"
+        if review["conflict_of_interest"]:
+            review["status"] = "Finalized; COI"
+        elif review["finalized"]:
+            review["status"] = "Finalized"
+        else:
+            review["status"] = "Not finalized"
+        for key, username in [
+            ("reviewer", review["reviewer"]),
+            ("submitter", proposal["user"]),
+        ]:
+            user = users.get(username)
+            review[key] = user and anubis.user.get_fullname(user) or username
+
+    # The columns must be the same as in the template.
+    columns = ["review", "status"]
+    columns.extend([None] * len(anubis.call.get_banner_fields(call["review"])))
+    columns.extend(["reviewer", "proposal"])
+    columns.extend([None] * len(anubis.call.get_banner_fields(call["proposal"])))
+    columns.append("submitter")
+
+    def get_rows(page):
+        # A review may have been deleted after the list was obtained.
+        page_reviews = [r for r in flask.g.db.get_bulk([r["iuid"] for r in page]) if r]
+        docs = anubis.database.get_docs_keys(
+            "proposals", "identifier", [r["proposal"] for r in page_reviews]
+        )
+        proposals_lookup = {d["identifier"]: d for d in docs}
+        return utils.get_table_rows(
+            "reviews/call_rows.html",
+            call=call,
+            reviews=page_reviews,
+            proposals_lookup=proposals_lookup,
+            users=users,
+        )
+
+    return utils.get_datatables_response(reviews, columns, get_rows)
+
+
+def allow_view_all_reviews(call):
+    """The admin, staff and chair may view all reviews in the call in the list.
+    Ordinary reviewers may view only finalized, non-conflict-of-interest reviews.
+    """
+    return flask.g.am_admin or flask.g.am_staff or anubis.call.am_chair(call)
+
 
 @blueprint.route("/call/<cid>.xlsx")
 @utils.login_required
@@ -120,6 +240,11 @@ def call_xlsx(cid):
             flask.url_for("call.display", cid=call["identifier"]),
         )
 
+    etag, last_modified = anubis.call.get_call_etag(call, ["proposals", "reviews"])
+    response = utils.get_not_modified(etag)
+    if response:
+        return response
+
     proposals = anubis.proposals.get_call_proposals(call, submitted=True)
     reviews = anubis.database.get_docs("reviews", "call", call["identifier"])
     # For ordinary reviewer, list only finalized reviews.
@@ -130,13 +255,133 @@ def call_xlsx(cid):
             if r["reviewer"] != flask.g.current_user["username"] and r.get("finalized")
         ]
     reviews_lookup = {f"{r['proposal']} {r['reviewer']}": r for r in reviews}
-    content = get_reviews_xlsx(call, proposals, reviews_lookup)
-    response = flask.make_response(content)
-    response.headers.set("Content-Type", constants.XLSX_MIMETYPE)
-    response.headers.set(
-        "Content-Disposition", "attachment", filename=f"{cid}_reviews.xlsx"
+    response = utils.send_xlsx_file(
+        get_reviews_xlsx(call, proposals, reviews_lookup), f"{cid}_reviews.xlsx"
     )
-    return response
+    return utils.set_validators(response, etag, last_modified)
+
+
+@blueprint.route("/call/<cid>.csv")
+@utils.login_required
+def call_csv(cid):
+    "Produce a CSV file of all reviews for a call, optionally selected columns."
+    return get_call_rows_response(cid, "csv")
+
+
+@blueprint.route("/call/<cid>.jsonl")
+@utils.login_required
+def call_jsonl(cid):
+    "Produce a JSON Lines file of all reviews for a call, optionally selected columns."
+    return get_call_rows_response(cid, "jsonl")
+
+
+def get_call_rows_response(cid, format):
+    """Return a response streaming the rows for the reviews in a call.
+    The access checks are the same as for the XLSX file.
+    """
+    call = anubis.call.get_call(cid)
+    if call is None:
+        return utils.error("No such call.")
+    if not anubis.call.allow_view(call):
+        return utils.error("You may not view the call.")
+    if not anubis.call.allow_view_reviews(call):
+        return utils.error(
+            "You may not view the reviews of the call.",
+            flask.url_for("call.display", cid=call["identifier"]),
+        )
+
+    try:
+        columns = utils.get_selected_columns(get_call_columns(call))
+    except ValueError as error:
+        return utils.error(error, flask.url_for("reviews.call", cid=cid))
+    return utils.get_rows_response(
+        format, columns, get_call_rows(call), f"{call['identifier']}_reviews"
+    )
+
+
+def get_call_columns(call):
+    """Return the names of the columns for the tabular exports of the reviews
+    in a call. These correspond to the columns of the XLSX file.
+    """
+    result = [
+        "proposal",
+        "title",
+        "submitter",
+        "email",
+        "affiliation",
+        "reviewer",
+        "review",
+        "finalized",
+    ]
+    result.extend([f"review.{f['identifier']}" for f in call["review"]])
+    return result
+
+
+def get_call_rows(call):
+    """Yield the rows for the tabular exports of the reviews of submitted
+    proposals in a call, as dictionaries keyed by column name.
+    The reviews are read from the database in chunks.
+    """
+    # For ordinary reviewer, list only finalized reviews.
+    all_reviews = flask.g.am_admin or anubis.call.am_chair(call)
+    for reviews in anubis.database.get_docs_chunks(
+        "reviews", "call_proposal_reviewer", call["identifier"]
+    ):
+        if not all_reviews:
+            reviews = [
+                r
+                for r in reviews
+                if r["reviewer"] != flask.g.current_user["username"]
+                and r.get("finalized")
+            ]
+        proposals = {
+            p["identifier"]: p
+            for p in anubis.database.get_docs_keys(
+                "proposals", "identifier", [r["proposal"] for r in reviews]
+            )
+            if p.get("submitted")
+        }
+        users = anubis.user.get_users_lookup(
+            [p["user"] for p in proposals.values()] + [r["reviewer"] for r in reviews]
+        )
+        for review in reviews:
+            try:
+                proposal = proposals[review["proposal"]]
+            except KeyError:
+                continue
+            user = users.get(proposal["user"]) or {"username": proposal["user"]}
+            reviewer = users.get(review["reviewer"]) or {"username": review["reviewer"]}
+            row = get_call_row(call, proposal, user, review, reviewer)
+            yield row
+
+
+def get_call_row(call, proposal, user, review, reviewer):
+    """Return the row for the review in the tabular exports (XLSX, CSV
+    and JSON Lines) of reviews, as a dictionary keyed by the column names
+    given by 'get_call_columns'.
+    """
+    result = {
+        "proposal": proposal["identifier"],
+        "title": proposal.get("title") or "",
+        "submitter": anubis.user.get_fullname(user),
+        "email": user.get("email") or "",
+        "affiliation": user.get("affiliation") or "",
+        "reviewer": anubis.user.get_fullname(reviewer),
+        "review": flask.url_for("review.display", iuid=review["_id"], _external=True),
+        "finalized": bool(review.get("finalized")),
+    }
+    for field in call["review"]:
+        value = review["values"].get(field["identifier"])
+        # Ugly, but necessary...
+        if value is not None and field["type"] == constants.DOCUMENT:
+            value = flask.url_for(
+                "review.document",
+                iuid=review["_id"],
+                fid=field["identifier"],
+                _external=True,
+            )
+        result[f"review.{field['identifier']}"] = value
+    return result
 
 
 @blueprint.route("/call/<cid>/reviewer/<username>")
@@ -203,13 +448,10 @@ def call_reviewer_xlsx(cid, username):
         "reviews", "call_reviewer", [call["identifier"], user["username"]]
     )
     reviews_lookup = {f"{r['proposal']} {username}": r for r in reviews}
-    content = get_reviews_xlsx(call, proposals, reviews_lookup)
-    response = flask.make_response(content)
-    response.headers.set("Content-Type", constants.XLSX_MIMETYPE)
-    response.headers.set(
-        "Content-Disposition", "attachment", filename=f"{cid}_{username}_reviews.xlsx"
+    return utils.send_xlsx_file(
+        get_reviews_xlsx(call, proposals, reviews_lookup),
+        f"{cid}_{username}_reviews.xlsx",
     )
-    return response
 
 
 @blueprint.route("/call/<cid>/reviewer/<username>.zip")
@@ -243,7 +485,8 @@ def call_reviewer_zip(cid, username):
     reviews_lookup = {f"{r['proposal']} {username}": r for r in reviews}
     output = io.BytesIO()
     with zipfile.ZipFile(output, "w") as zip:
-        zip.writestr(
+        utils.write_zip_file(
+            zip,
             f"{cid}_{username}_reviews.xlsx",
             get_reviews_xlsx(call, proposals, reviews_lookup),
         )
@@ -251,7 +494,8 @@ def call_reviewer_zip(cid, username):
         proposals = [
             p for p in proposals if f"{p['identifier']} {username}" in reviews_lookup
         ]
-        zip.writestr(
+        utils.write_zip_file(
+            zip,
             f"{call['identifier']}_proposals_to_review.xlsx",
             anubis.proposals.get_call_xlsx(call, proposals=proposals),
         )
@@ -424,13 +668,9 @@ def proposal_xlsx(pid):
             if r["reviewer"] != flask.g.current_user["username"] and r.get("finalized")
         ]
     reviews_lookup = {f"{pid} {r['reviewer']}": r for r in reviews}
-    content = get_reviews_xlsx(call, [proposal], reviews_lookup)
-    response = flask.make_response(content)
-    response.headers.set("Content-Type", constants.XLSX_MIMETYPE)
-    response.headers.set(
-        "Content-Disposition", "attachment", filename=f"{pid}_reviews.xlsx"
+    return utils.send_xlsx_file(
+        get_reviews_xlsx(call, [proposal], reviews_lookup), f"{pid}_reviews.xlsx"
     )
-    return response
 
 
 @blueprint.route("/reviewer/<username>")
@@ -476,9 +716,11 @@ def reviewer(username):
 
 
 def get_reviews_xlsx(call, proposals, reviews_lookup):
-    "Return the content for the XLSX file for the list of reviews."
-    output = io.BytesIO()
-    wb = xlsxwriter.Workbook(output, {"in_memory": True})
+    "Return a temporary file containing the XLSX file for the list of reviews."
+    users = anubis.user.get_users_lookup(
+        [p["user"] for p in proposals] + call["reviewers"]
+    )
+    wb, outfile = utils.create_xlsx_workbook()
     formats = utils.create_xlsx_formats(wb)
     # Hard str(len) limit for worksheet title.
     ws = wb.add_worksheet(f"Reviews in call {call['identifier']}"[:31])
@@ -511,6 +753,8 @@ def get_reviews_xlsx(call, proposals, reviews_lookup):
     ws.write_row(nrow, 0, row)
     nrow += 1
 
+    columns = get_call_columns(call)
+    field_types = {f"review.{f['identifier']}": f["type"] for f in call["review"]}
     for proposal in proposals:
         for reviewer in call["reviewers"]:
             review = reviews_lookup.get(
@@ -518,75 +762,40 @@ def get_reviews_xlsx(call, proposals, reviews_lookup):
             )
             if not review:
                 continue
-            user = anubis.user.get_user(username=proposal["user"])
-            ncol = 0
-            ws.write_url(
-                nrow,
-                ncol,
-                flask.url_for(
-                    "proposal.display", pid=proposal["identifier"], _external=True
-                ),
-                string=proposal["identifier"],
+            user = users.get(proposal["user"]) or {"username": proposal["user"]}
+            row = get_call_row(
+                call,
+                proposal,
+                user,
+                review,
+                users.get(reviewer) or {"username": reviewer},
             )
-            ncol += 1
-            ws.write_string(nrow, ncol, proposal.get("title") or "")
-            ncol += 1
-            ws.write_string(nrow, ncol, anubis.user.get_fullname(user))
-            ncol += 1
-            ws.write_string(nrow, ncol, user.get("email") or "")
-            ncol += 1
-            ws.write_string(nrow, ncol, user.get("affiliation") or "")
-            ncol += 1
-            ws.write_string(nrow, ncol, anubis.user.get_fullname(reviewer))
-            ncol += 1
-            ws.write_url(
-                nrow,
-                ncol,
-                flask.url_for("review.display", iuid=review["_id"], _external=True),
-                string="Link",
-            )
-            ncol += 1
-            ws.write_string(nrow, ncol, review.get("finalized") and "Yes" or "No")
-            ncol += 1
-
-            for field in call["review"]:
-                value = review["values"].get(field["identifier"])
-                # Ugly, but necessary...
-                if value is not None and field["type"] == constants.DOCUMENT:
-                    value = flask.url_for(
-                        "review.document",
-                        iuid=review["_id"],
-                        fid=field["identifier"],
-                        _external=True,
+            for ncol, column in enumerate(columns):
+                value = row.get(column)
+                if column == "proposal":
+                    ws.write_url(
+                        nrow,
+                        ncol,
+                        flask.url_for("proposal.display", pid=value, _external=True),
+                        string=value,
+                    )
+                elif column == "review":
+                    ws.write_url(nrow, ncol, value, string="Link")
+                elif column in field_types:
+                    utils.write_xlsx_field(
+                        ws, nrow, ncol, value, field_types[column], formats
                     )
-                utils.write_xlsx_field(ws, nrow, ncol, value, field["type"], formats)
-                ncol += 1
+                elif isinstance(value, bool):
+                    ws.write_string(nrow, ncol, value and "Yes" or "No")
+                else:
+                    ws.write_string(nrow, ncol, value or "")
             nrow += 1
 
-    wb.close()
-    return output.getvalue()
+    return utils.close_xlsx_workbook(wb, outfile)
 
 
 def get_rank_error(call, username):
     """Return True if the reviews by the reviewer in the call has
     rank fields with non-consecutive values.
     """
-    reviews = anubis.database.get_docs(
-        "reviews", "call_reviewer", [call["identifier"], username]
-    )
-    reviews = [r for r in reviews if r.get("finalized")]
-    reviews = [r for r in reviews if not r["values"].get("conflict_of_interest")]
-    if not reviews:
-        return False
-    identifiers = [
-        f["identifier"]
-        for f in call["review"]
-        if f.get("banner") and f["type"] == constants.RANK
-    ]
-    for identifier in identifiers:
-        ranks = set()
-        for review in reviews:
-            ranks.add(review["values"].get(identifier))
-        if ranks != set(range(1, max(ranks) + 1)):
-            return True
-    return False
+    return username in anubis.analytics.get_rank_errors(call)
@@ -2,13 +2,30 @@
 
 import copy
 import os.path
+import random
+import threading
+import time
 
+import couchdb2
 import flask
 
+import anubis.blobs
+import anubis.uploads
 from anubis import constants
 from anubis import utils
 
 
+# Items not merged when resolving an update conflict; those of the current
+# version of the document are kept.
+UNMERGED_KEYS = frozenset(["_id", "_rev", "_attachments", "modified"])
+
+# Marker for an item removed from the document.
+_REMOVED = object()
+
+_conflicts = {"conflicts": 0, "merged": 0, "failed": 0}
+_lock = threading.Lock()
+
+
 class Saver:
     "Document saver context."
 
@@ -39,7 +56,7 @@ class Saver:
         self.finish()
         self.doc["doctype"] = self.DOCTYPE
         self.doc["modified"] = utils.get_now()
-        self.db.put(self.doc)
+        self.put()
         self.wrapup()
         self.add_log()
 
@@ -53,29 +70,110 @@ class Saver:
         "Initialize the new document."
         pass
 
+    def put(self):
+        """Store the document. If someone else updated it meanwhile, merge
+        the changes made in this saver into the current version, and retry
+        after a random delay. Raise ValueError if the changes overlap with
+        those made by someone else, or if there are too many conflicts.
+        """
+        for attempt in range(constants.SAVER_MAX_ATTEMPTS):
+            try:
+                self.db.put(self.doc)
+                return
+            except couchdb2.RevisionError:
+                count_conflict("conflicts")
+                if not self.original:  # A new document; nothing to merge into.
+                    count_conflict("failed")
+                    raise ValueError("A document with that identifier already exists.")
+            current = self.db.get(self.doc["_id"])
+            if current is None:
+                count_conflict("failed")
+                raise ValueError("The document has been deleted by someone else.")
+            try:
+                self.merge(current)
+            except ValueError:
+                count_conflict("failed")
+                raise
+            count_conflict("merged")
+            time.sleep(random.uniform(0, constants.SAVER_BACKOFF * 2**attempt))
+        count_conflict("failed")
+        raise ValueError("The document is being changed by others; try again.")
+
+    def merge(self, current):
+        """Apply the changes made in this saver to the current version of
+        the document. The changes are compared item by item, and within
+        items that are dictionaries, such as the field values, key by key.
+        Raise ValueError if the same item was changed differently by both.
+        """
+        mine = get_changes(self.original, self.doc)
+        theirs = get_changes(self.original, current)
+        for path, value in mine.items():
+            for other, other_value in theirs.items():
+                overlap = path[: len(other)] == other or other[: len(path)] == path
+                if overlap and (path != other or value != other_value):
+                    raise ValueError(
+                        "The document was changed by someone else at the"
+                        f" same time ({'.'.join(path)}); reload and try again."
+                    )
+        merged = copy.deepcopy(current)
+        for path, value in mine.items():
+            container = merged
+            for key in path[:-1]:
+                container = container.setdefault(key, {})
+            if value is _REMOVED:
+                container.pop(path[-1], None)
+            else:
+                container[path[-1]] = value
+        self.original = copy.deepcopy(current)
+        # Update in place; the caller may hold a reference to the document.
+        self.doc.clear()
+        self.doc.update(merged)
+        self.finish()
+        self.doc["modified"] = utils.get_now()
+
     def prepare(self):
         "Preparations before making any changes."
         self._delete_attachments = set()
         self._add_attachments = []
+        self._release_blobs = set()
 
     def add_attachment(self, filename, content, mimetype):
-        """If the filename is already in use, add a numerical suffix.
+        """The content is bytes or a seekable file, which must remain open
+        until the document has been saved.
+        If the filename is already in use, add a numerical suffix.
+        If the content-addressed store is enabled, the file is stored there
+        right away, so that it exists before the document referring to it is
+        stored; an unreferenced file is protected by the store's grace period.
         Return the final filename.
         """
-        current = set(self.doc.get("_attachments", {}).keys())
+        current = set(anubis.blobs.get_stubs(self.doc).keys())
         current.update([a["filename"] for a in self._add_attachments])
         basename, ext = os.path.splitext(filename)
         count = 0
         while filename in current:
             count += 1
             filename = f"{basename}_{count}{ext}"
-        self._add_attachments.append(
-            {"filename": filename, "content": content, "mimetype": mimetype}
-        )
+        if anubis.blobs.is_enabled():
+            blob = anubis.blobs.get_stub(content, mimetype)
+            start = time.monotonic()
+            anubis.blobs.store(content, blob["digest"])
+            anubis.uploads.record(blob["length"], time.monotonic() - start)
+            self.doc.setdefault("blobs", {})[filename] = blob
+        else:
+            self._add_attachments.append(
+                {"filename": filename, "content": content, "mimetype": mimetype}
+            )
         return filename
 
     def delete_attachment(self, filename):
-        self._delete_attachments.add(filename)
+        """A file in the content-addressed store is released after the document
+        has been stored, which is when the reference to it has been removed.
+        """
+        blob = self.doc.get("blobs", {}).pop(filename, None)
+        if blob:
+            self._release_blobs.add(blob["digest"])
+        else:
+            self._delete_attachments.add(filename)
 
     def finish(self):
         "Final changes and checks on the document before storing it."
@@ -83,22 +181,35 @@ class Saver:
 
     def wrapup(self):
         """Delete any specified attachments.
-        Store the input files as attachments.
+        Store the input files as attachments, streaming those given as files.
+        Release the files removed from the content-addressed store, if enabled.
         Must be done after document is stored subsequent to changes of other items.
         """
         for filename in self._delete_attachments:
             self.db.delete_attachment(self.doc, filename)
         for attachment in self._add_attachments:
+            content = attachment["content"]
+            if not isinstance(content, bytes):
+                content.seek(0)
+            start = time.monotonic()
             self.db.put_attachment(
                 self.doc,
-                attachment["content"],
+                content,
                 filename=attachment["filename"],
                 content_type=attachment["mimetype"],
             )
+            anubis.uploads.record(
+                anubis.uploads.get_size(content), time.monotonic() - start
+            )
+        anubis.blobs.release(self._release_blobs)
 
     def add_log(self):
-        """Add a log entry recording the the difference betweens the current and
-        the original document, hiding values of specified keys.
+        "Add a log entry for the changes to the document."
+        self.db.put(self.get_log_entry())
+
+    def get_log_entry(self):
+        """Return a log entry recording the the difference betweens the current
+        and the original document, hiding values of specified keys.
         'added': list of keys for items added in the current.
         'updated': dictionary of items updated; original values.
         'removed': dictionary of items removed; original values.
@@ -148,7 +259,66 @@ class Saver:
         else:
             entry["remote_addr"] = None
             entry["user_agent"] = None
-        self.db.put(entry)
+        return entry
+
+
+def save_bulk(savers, db=None):
+    """Store the new documents of the savers, and their log entries, using
+    a few bulk database requests instead of one request per document.
+    The documents are stored first, and then the log entries of only those
+    documents that were stored.
+    The savers must not have any attachments to add or delete.
+    Return the number of documents that could not be stored.
+    """
+    now = utils.get_now()
+    for saver in savers:
+        saver.finish()
+        saver.doc["doctype"] = saver.DOCTYPE
+        saver.doc["modified"] = now
+    db = db or flask.g.db
+    stored = set()
+    for chunk in range(0, len(savers), constants.BULK_DOCS_CHUNK_SIZE):
+        docs = [s.doc for s in savers[chunk : chunk + constants.BULK_DOCS_CHUNK_SIZE]]
+        # A result is (True, id, rev) on success, (False, id, error, reason) else.
+        for result in db.update(docs):
+            if result[0]:
+                stored.add(result[1])
+    logs = [s.get_log_entry() for s in savers if s.doc["_id"] in stored]
+    for chunk in range(0, len(logs), constants.BULK_DOCS_CHUNK_SIZE):
+        db.update(logs[chunk : chunk + constants.BULK_DOCS_CHUNK_SIZE])
+    return len(savers) - len(stored)
+
+
+def get_changes(original, doc):
+    """Return the changes from the original to the document, as a dictionary
+    with key paths as keys. Items which are dictionaries in both are compared
+    key by key. The value for a removed item is a marker.
+    """
+    result = {}
+    for key in set(original).union(doc).difference(UNMERGED_KEYS):
+        old = original.get(key, _REMOVED)
+        new = doc.get(key, _REMOVED)
+        if old == new:
+            continue
+        if isinstance(old, dict) and isinstance(new, dict):
+            for subkey in set(old).union(new):
+                if old.get(subkey, _REMOVED) != new.get(subkey, _REMOVED):
+                    result[(key, subkey)] = new.get(subkey, _REMOVED)
+        else:
+            result[(key,)] = new
+    return result
+
+
+def count_conflict(key):
+    "Increment the count of update conflicts, merges or failures."
+    with _lock:
+        _conflicts[key] += 1
+
+
+def get_conflict_metrics():
+    "Return the counts of update conflicts in this server process."
+    with _lock:
+        return dict(_conflicts)
 
 
 class FieldSaverMixin:
@@ -187,7 +357,7 @@ class FieldSaverMixin:
         # This is slightly risky: if a filename happens to be the same
         # as a removed value originating from another field,
         # the deletion may be in error. But this should be rare...
-        for filename in self.doc.get("_attachments", {}):
+        for filename in anubis.blobs.get_stubs(self.doc):
             if filename in removed:
                 self.delete_attachment(filename)
 
@@ -270,23 +440,29 @@ class FieldSaverMixin:
             else:
                 infile = flask.request.files.get(fid)
                 if infile:  # New document given.
-                    if (
-                        self.doc["values"].get(fid)
-                        and self.doc["values"][fid] != infile.filename
-                    ):
-                        self.delete_attachment(self.doc["values"][fid])
-                    filename = self.add_attachment(
-                        infile.filename, infile.read(), infile.mimetype
-                    )
-                    self.doc["values"][fid] = filename
-                else:
-                    filename = self.doc["values"].get(fid)
+                    # Check before storing; the current document is kept if bad.
+                    try:
+                        anubis.uploads.check(infile, field)
+                    except ValueError as error:
+                        self.doc["errors"][fid] = str(error)
+                    else:
+                        if (
+                            self.doc["values"].get(fid)
+                            and self.doc["values"][fid] != infile.filename
+                        ):
+                            self.delete_attachment(self.doc["values"][fid])
+                        filename = self.add_attachment(
+                            infile.filename, infile.stream, infile.mimetype
+                        )
+                        self.doc["values"][fid] = filename
+                # The extensions may have been changed after the upload.
+                filename = self.doc["values"].get(fid)
                 if filename and field.get("extensions"):
                     extension = os.path.splitext(filename)[1].lstrip(".").lower()
                     if extension not in field["extensions"]:
-                        self.doc["errors"][fid] = "Invalid file type."
+                        self.doc["errors"].setdefault(fid, "Invalid file type.")
             if field["required"] and not self.doc["values"].get(fid):
-                self.doc["errors"][fid] = "Missing document."
+                self.doc["errors"].setdefault(fid, "Missing document.")
 
         elif field["type"] == constants.REPEAT:
             value = form.get(fid) or None
@@ -0,0 +1,122 @@
+"""Schedule of the calls: the open, closed and unpublished lists of calls,
+and the time of the next change of any of these states.
+
+The schedule is kept in memory between requests. It is recomputed from the
+calls in memory when the time of the next state change has passed, and the
+calls are reloaded from the database only when any call has been saved or
+deleted, which is detected by a single reduce query of the view 'calls/modified'.
+"""
+
+import bisect
+import copy
+import threading
+
+import flask
+
+from anubis import utils
+
+_schedule = None
+_lock = threading.Lock()
+
+
+def get_schedule():
+    """Return the current call schedule.
+    The check for changed calls is done at most once per request.
+    """
+    global _schedule
+    try:
+        return utils.cache_get("calls schedule")
+    except KeyError:
+        pass
+    result = flask.g.db.view("calls", "modified", reduce=True)
+    if result:
+        version = (result[0].value["count"], result[0].value["max"])
+    else:
+        version = (0, None)
+    with _lock:
+        if _schedule is None or _schedule.version != version:
+            _schedule = CallSchedule(version)
+        _schedule.update()
+        return utils.cache_put("calls schedule", _schedule)
+
+
+class CallSchedule:
+    """The calls, the sorted list of the times at which their states change
+    (opens, closes and reviews due dates), and the lists of call identifiers
+    for each state at the current time.
+    """
+
+    def __init__(self, version):
+        self.version = version
+        self.calls = {
+            r.doc["identifier"]: r.doc
+            for r in flask.g.db.view("calls", "identifier", include_docs=True)
+        }
+        transitions = set()
+        for call in self.calls.values():
+            for key in ["opens", "closes", "reviews_due"]:
+                if call.get(key):
+                    transitions.add(call[key])
+        self.transitions = sorted(transitions)
+        self.next = ""  # Force computation of the lists.
+
+    def update(self):
+        """Recompute the lists of calls if the time of the next state change
+        has been reached. The lists are ordered as the original view queries.
+        """
+        now = utils.get_now()
+        if self.next is None or now < self.next:
+            return
+        pos = bisect.bisect_left(self.transitions, now)
+        try:
+            self.next = self.transitions[pos]
+        except IndexError:
+            self.next = None
+        open_calls = []
+        closed_calls = []
+        unpublished_calls = []
+        for cid, call in self.calls.items():
+            if not call["opens"] or not call["closes"]:
+                unpublished_calls.append(cid)
+                continue
+            if call["opens"] > now:
+                unpublished_calls.append(cid)
+            elif call["closes"] >= now:
+                open_calls.append(cid)
+            # A call that closes right now is both open and closed.
+            if call["closes"] <= now:
+                closed_calls.append(cid)
+        closed_calls.sort(key=lambda cid: self.calls[cid]["closes"], reverse=True)
+        # Assign the complete lists; other threads may be reading them.
+        self.open = open_calls
+        self.closed = closed_calls
+        self.unpublished = unpublished_calls
+
+    def get_calls(self, identifiers):
+        """Return copies of the calls, which may be modified during the request.
+        If a call has already been obtained in this request, return that instead.
+        """
+        result = []
+        for cid in identifiers:
+            key = f"call {cid}"
+            try:
+                result.append(utils.cache_get(key))
+            except KeyError:
+                result.append(utils.cache_put(key, copy.deepcopy(self.calls[cid])))
+        return result
+
+    def get_open_calls(self):
+        "Return the open calls."
+        return self.get_calls(self.open)
+
+    def get_closed_calls(self):
+        "Return the closed calls, in descending order of the closes date."
+        return self.get_calls(self.closed)
+
+    def get_unpublished_calls(self):
+        "Return the calls not yet open, or with undefined opens or closes date."
+        return self.get_calls(self.unpublished)
+
+    def get_next_change(self):
+        "Return the time of the next state change of any call, or None if none."
+        return self.next
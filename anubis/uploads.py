@@ -0,0 +1,116 @@
+"""Uploaded document files: spooling, size and type limits, and metrics.
+
+A request larger than the configured maximum is refused before its body
+is read. Each uploaded file in a form is spooled to a temporary file once
+it exceeds a small size, so that it is not held in memory, and is then
+streamed from that file to CouchDB when the document is saved.
+
+The size and the extension of a file for a document field are checked
+before it is added as an attachment. The maximum size is set for the field,
+or else by the configured default.
+
+The metrics for the uploads stored by this server process are kept in memory.
+"""
+
+import os
+import tempfile
+import threading
+
+import flask
+import werkzeug.exceptions
+
+from anubis import constants, utils
+
+_metrics = {"count": 0, "bytes": 0, "seconds": 0.0, "rejected": 0}
+_lock = threading.Lock()
+
+
+class Request(flask.Request):
+    "Request spooling each uploaded file to a temporary file when not small."
+
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        return tempfile.SpooledTemporaryFile(max_size=constants.UPLOAD_SPOOL_SIZE)
+
+
+def init(app):
+    "Set the request class and the maximum request size for the app."
+    app.request_class = Request
+    if app.config.get("REQUEST_MAX_SIZE"):
+        app.config["MAX_CONTENT_LENGTH"] = (
+            app.config["REQUEST_MAX_SIZE"] * constants.MEGABYTE
+        )
+    app.register_error_handler(werkzeug.exceptions.RequestEntityTooLarge, too_large)
+
+
+def too_large(error):
+    "The request is larger than allowed; its body has not been read."
+    with _lock:
+        _metrics["rejected"] += 1
+    return utils.error(
+        "The upload is too large; maximum size is"
+        f" {flask.current_app.config['REQUEST_MAX_SIZE']} MB.",
+        flask.request.referrer,
+    )
+
+
+def get_max_size(field):
+    "Return the maximum size in bytes of a file for the document field, if any."
+    size = field.get("maxsize") or flask.current_app.config.get("DOCUMENT_MAX_SIZE")
+    if size:
+        return size * constants.MEGABYTE
+    return None
+
+
+def get_size(content):
+    "Return the size in bytes of the content, which is bytes or a seekable file."
+    if isinstance(content, bytes):
+        return len(content)
+    position = content.tell()
+    size = content.seek(0, os.SEEK_END)
+    content.seek(position)
+    return size
+
+
+def check(infile, field):
+    """Check the uploaded file against the extensions and the maximum size
+    of the document field. Raise ValueError if not allowed.
+    """
+    try:
+        if field.get("extensions"):
+            extension = os.path.splitext(infile.filename)[1].lstrip(".").lower()
+            if extension not in field["extensions"]:
+                raise ValueError("Invalid file type.")
+        max_size = get_max_size(field)
+        if max_size and get_size(infile.stream) > max_size:
+            raise ValueError(
+                "Document is too large; maximum size is"
+                f" {max_size // constants.MEGABYTE} MB."
+            )
+    except ValueError:
+        with _lock:
+            _metrics["rejected"] += 1
+        raise
+
+
+def record(size, seconds):
+    "Record an uploaded file of the given size stored in the given time."
+    with _lock:
+        _metrics["count"] += 1
+        _metrics["bytes"] += size
+        _metrics["seconds"] += seconds
+
+
+def get_metrics():
+    "Return the upload metrics for this server process."
+    with _lock:
+        result = dict(_metrics)
+    if result["seconds"]:
+        result["megabytes_per_second"] = round(
+            result["bytes"] / constants.MEGABYTE / result["seconds"], 3
+        )
+    else:
+        result["megabytes_per_second"] = None
+    result["seconds"] = round(result["seconds"], 3)
+    return result
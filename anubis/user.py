@@ -8,6 +8,7 @@ import werkzeug.security
 
 import anubis.call
 import anubis.database
+import anubis.outbox
 from anubis import constants
 from anubis import utils
 from anubis.saver import Saver
@@ -121,7 +122,7 @@ def register():
             )
             text = f"To enable the user account, go to {url}\n\n" "/The Anubis system"
             try:
-                utils.send_email(recipients, title, text)
+                anubis.outbox.send_email(recipients, title, text)
             except ValueError:
                 if flask.g.am_admin or flask.g.am_staff:
                     utils.flash_warning(
@@ -353,15 +354,24 @@ def logs(username):
         "logs.html",
         title=f"User {user['username']}",
         back_url=flask.url_for("user.display", username=user["username"]),
-        logs=anubis.database.get_logs(user["_id"]),
+        **anubis.database.get_logs_page(user["_id"]),
     )
 
 
 @blueprint.route("/all")
 @utils.staff_required
 def all():
-    "Display list of all user accounts."
-    users = get_users()
+    """Display list of all user accounts.
+    The rows of the table are fetched page by page from 'all_json'.
+    """
+    return flask.render_template("user/all.html")
+
+
+@blueprint.route("/all.json")
+@utils.staff_required
+def all_json():
+    "Return a page of the table of all user accounts; DataTables server-side."
+    users = list(get_users_summary().values())
     # A single call using group_level 1 is much more efficient
     # than calling once for each user.
     result = flask.g.db.view("proposals", "user", group_level=1, reduce=True)
@@ -383,7 +393,26 @@ def all():
         user["all_proposals_count"] = proposals_counts.get(username)
         user["all_reviews_count"] = reviews_counts.get(username)
         user["all_grants_count"] = grants_counts.get(username)
-    return flask.render_template("user/all.html", users=users)
+    columns = [
+        "username",
+        "all_proposals_count",
+        "all_reviews_count",
+        "all_grants_count",
+        "email",
+        "orcid",
+        "givenname",
+        "familyname",
+        "affiliation",
+        "role",
+        "status",
+        "modified",
+        "last_login",
+    ]
+    return utils.get_datatables_response(
+        users,
+        columns,
+        lambda page: utils.get_table_rows("user/all_rows.html", users=page),
+    )
 
 
 @blueprint.route("/pending")
@@ -439,11 +468,35 @@ def disable(username):
     return flask.redirect(flask.url_for("user.display", username=username))
 
 
+@blueprint.route("/api_key/<username>", methods=["POST", "DELETE"])
+@utils.login_required
+def api_key(username):
+    "Set a new API key for the user account, or remove it."
+    user = get_user(username=username)
+    if user is None:
+        return utils.error("No such user.")
+    if not allow_edit(user):
+        return utils.error("You may not set the API key of the user account.")
+
+    if utils.http_POST():
+        with UserSaver(user) as saver:
+            api_key = saver.set_api_key()
+        # Only the hash is stored, so this is the only time it is shown.
+        utils.flash_message(
+            f"The new API key is {api_key} ; copy it now, since it will"
+            " not be shown again."
+        )
+    elif utils.http_DELETE():
+        with UserSaver(user) as saver:
+            saver.set_api_key(remove=True)
+    return flask.redirect(flask.url_for("user.display", username=username))
+
+
 class UserSaver(Saver):
     "User account saver context manager."
 
     DOCTYPE = constants.USER
-    HIDDEN_FIELDS = ["password"]
+    HIDDEN_FIELDS = ["password", "api_key_hash"]
 
     def initialize(self):
         "Set the status for a new user."
@@ -582,6 +635,17 @@ class UserSaver(Saver):
     def set_last_login(self):
         self.doc["last_login"] = utils.get_now()
 
+    def set_api_key(self, remove=False):
+        """Set a new random API key, or remove it.
+        Only the hash of the key is stored. Return the new key.
+        """
+        if remove:
+            self.doc["api_key_hash"] = None
+            return None
+        api_key = utils.get_iuid()
+        self.doc["api_key_hash"] = utils.get_api_key_hash(api_key)
+        return api_key
+
 
 def get_user(username=None, email=None, orcid=None):
     """Return the user for the given username, email or ORCID.
@@ -648,11 +712,60 @@ def get_users(role=None, status=None):
     return result
 
 
+def get_users_lookup(usernames):
+    """Return a dictionary of the users for the given usernames, keyed by username.
+    Users not already in the cache are fetched in a single view request.
+    Usernames without an account are not included.
+    """
+    result = {}
+    missing = set()
+    for username in usernames:
+        if not username:
+            continue
+        try:
+            result[username] = utils.cache_get(f"username {username}")
+        except KeyError:
+            missing.add(username)
+    for user in anubis.database.get_docs_keys("users", "username", missing):
+        result[user["username"]] = user
+    return result
+
+
+def get_users_summary(usernames=None):
+    """Return a dictionary keyed by username of the summaries of the users;
+    username, email, ORCID, names, affiliation, role, status, modified and
+    last login. All users if no usernames are given.
+    Obtained from a view, so no user documents are loaded.
+    """
+    if usernames is None:
+        result = flask.g.db.view("users", "summary")
+    else:
+        keys = sorted({u for u in usernames if u})
+        if not keys:
+            return {}
+        result = anubis.database.get_view_rows("users", "summary", keys)
+    return {r.key: dict(username=r.key, **r.value) for r in result}
+
+
 def get_current_user():
-    """Return the user for the current session.
+    """Return the user for the current session, or else for the API key
+    given in the request header, if any, which is accepted only by the API.
     Return None if no such user, or disabled.
     """
-    user = get_user(username=flask.session.get("username"))
+    username = flask.session.get("username")
+    if not username:
+        if flask.request.blueprint != "api":
+            return None
+        api_key = flask.request.headers.get(constants.API_KEY_HEADER)
+        if not api_key:
+            return None
+        docs = anubis.database.get_docs(
+            "users", "api_key", utils.get_api_key_hash(api_key)
+        )
+        if len(docs) == 1 and docs[0]["status"] == constants.ENABLED:
+            return docs[0]
+        return None
+    user = get_user(username=username)
     if user is None or user["status"] != constants.ENABLED:
         flask.session.pop("username", None)
         return None
@@ -702,8 +815,8 @@ def do_login(username, password):
 def send_email_password_code(user, action):
     """Send an email with the one-time code to the user's email address.
     No action if no email address for user.
+    The email is put in the outbox, and sent in the background.
     Raise ValueError if email server not configured.
-    Raise KeyError if email could not be sent; server misconfigured.
     """
     if not user["email"]:
         return
@@ -726,7 +839,7 @@ def send_email_password_code(user, action):
         f" {action}.\n\nTo set your password, go to {url}\n\n"
         "/The Anubis system"
     )
-    utils.send_email(user["email"], title, text)
+    anubis.outbox.send_email(user["email"], title, text)
 
 
 def am_admin(user=None):
@@ -1,9 +1,16 @@
 "Various utility functions and classes."
 
+import base64
+import csv
 import datetime
 import functools
+import hashlib
 import http.client
-import smtplib
+import io
+import json
+import shutil
+import tempfile
+import urllib.parse
 import uuid
 
 import couchdb2
@@ -28,24 +35,32 @@ def init(app):
     MAIL.init_app(app)
 
 
-def send_email(recipients, title, text):
-    """Send an email.
-    Raise ValueError if the email server is not configured.
-    Raise KeyError if email could not be sent; server misconfigured.
-    """
-    if not flask.current_app.config["MAIL_SERVER"]:
-        raise ValueError("No mail server configured.")
+def get_email_message(recipients, title, text):
+    "Return the email message to send."
     if isinstance(recipients, str):
         recipients = [recipients]
     message = flask_mail.Message(
         title, recipients=recipients, reply_to=flask.current_app.config["MAIL_REPLY_TO"]
     )
     message.body = text
-    try:
-        MAIL.send(message)
-    except (ConnectionRefusedError, smtplib.SMTPAuthenticationError) as error:
-        flask.current_app.logger.error(str(error))
-        raise KeyError
+    return message
+
+
+def url_for_external(endpoint, **values):
+    """Return the external URL for the endpoint and values.
+    Outside of a request, e.g. in the background email sender, the base URL
+    is given by the configured EXTERNAL_URL.
+    Raise ValueError if outside of a request and EXTERNAL_URL is not set.
+    """
+    if flask.has_request_context():
+        return flask.url_for(endpoint, _external=True, **values)
+    if not flask.current_app.config.get("EXTERNAL_URL"):
+        raise ValueError("No external URL configured.")
+    base = urllib.parse.urlsplit(flask.current_app.config["EXTERNAL_URL"])
+    adapter = flask.current_app.url_map.bind(
+        base.netloc, script_name=base.path or "/", url_scheme=base.scheme
+    )
+    return adapter.build(endpoint, values, force_external=True)
 
 
 def get_software():
@@ -140,6 +155,13 @@ def get_iuid():
     return uuid.uuid4().hex
 
 
+def get_api_key_hash(api_key):
+    """Return the hash of the API key, which is stored instead of the key.
+    The key is a random IUID, so an unsalted hash allows lookup by a view.
+    """
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
 def to_bool(s):
     "Convert string or other value into boolean."
     if isinstance(s, str):
@@ -154,6 +176,269 @@ def to_list(value):
     return [s for s in values if s]
 
 
+def create_xlsx_workbook(constant_memory=True):
+    """Return a tuple of a new XLSX workbook and the temporary file it writes to.
+    In constant memory mode, the rows must be written in order; each row is
+    flushed to disk when the next one is started, so that memory use does not
+    grow with the number of rows. Merged cells spanning several rows require
+    this mode to be off.
+    The temporary file is not closed here, since it is returned; it is closed
+    by the response that streams it, which also deletes it.
+    """
+    outfile = tempfile.TemporaryFile()  # noqa: SIM115
+    wb = xlsxwriter.Workbook(outfile, {"constant_memory": constant_memory})
+    return wb, outfile
+
+
+def close_xlsx_workbook(wb, outfile):
+    "Close the XLSX workbook and return its temporary file, rewound for reading."
+    wb.close()
+    outfile.seek(0)
+    return outfile
+
+
+def send_xlsx_file(outfile, filename):
+    "Return a response streaming the XLSX temporary file as an attachment."
+    return flask.send_file(
+        outfile,
+        mimetype=constants.XLSX_MIMETYPE,
+        as_attachment=True,
+        download_name=filename,
+    )
+
+
+def write_zip_file(zip, filename, infile):
+    "Copy the contents of the file object into the zip file in chunks."
+    with zip.open(filename, "w") as outfile:
+        shutil.copyfileobj(infile, outfile)
+
+
+def get_selected_columns(columns):
+    """Return the columns selected by the request argument 'columns', which
+    is a comma-separated list of column names, in the order given.
+    Return all columns if the argument is not given.
+    Raise ValueError if an unknown column name is given.
+    """
+    selected = flask.request.args.get("columns")
+    if not selected:
+        return columns
+    result = [c.strip() for c in selected.split(",") if c.strip()]
+    unknown = [c for c in result if c not in columns]
+    if unknown:
+        raise ValueError(f"No such column(s): {', '.join(unknown)}")
+    return result
+
+
+def get_rows_response(format, columns, rows, filename):
+    """Return a response streaming the rows in the given format, 'csv' or 'jsonl'.
+    The rows are dictionaries keyed by column name, produced by an iterator,
+    and each is written out as soon as it is available.
+    """
+    if format == "csv":
+        mimetype = constants.CSV_MIMETYPE
+
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            yield buffer.getvalue()
+            for row in rows:
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerow([get_csv_value(row.get(c)) for c in columns])
+                yield buffer.getvalue()
+
+    elif format == "jsonl":
+        mimetype = constants.JSONL_MIMETYPE
+
+        def generate():
+            for row in rows:
+                yield json.dumps({c: row.get(c) for c in columns}) + "\n"
+
+    else:
+        raise ValueError(f"Unknown format '{format}'.")
+    response = flask.Response(flask.stream_with_context(generate()), mimetype=mimetype)
+    response.headers.set(
+        "Content-Disposition", "attachment", filename=f"{filename}.{format}"
+    )
+    return response
+
+
+def get_csv_value(value):
+    "Convert the value for output in a CSV file, similarly to the XLSX files."
+    if value is None:
+        return ""
+    elif isinstance(value, bool):
+        return value and "Yes" or "No"
+    elif isinstance(value, list):
+        return "; ".join([str(get_csv_value(v)) for v in value])
+    else:
+        return value
+
+
+def get_etag(*parts, user=True):
+    """Return an ETag value computed from the given JSON-able parts.
+    By default the state of the current user is included, since it
+    determines access to the content and the counts shown in the navbar.
+    """
+    values = list(parts)
+    if user:
+        values.append(flask.g.current_user and flask.g.current_user["_rev"])
+        values.append(flask.g.get("alert_text"))
+        for key in [
+            "my_proposals_count",
+            "my_unsubmitted_proposals_count",
+            "my_reviews_count",
+            "my_unfinalized_reviews_count",
+            "my_grants_count",
+            "my_incomplete_grants_count",
+        ]:
+            values.append(flask.g.get(key))
+    digest = hashlib.sha256(json.dumps(values, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_not_modified(etag):
+    """Return a '304 Not Modified' response if the request has an
+    If-None-Match header matching the given ETag, else None. This is checked
+    before doing any work. If-Modified-Since alone is not sufficient, since
+    the ETag depends also on state, such as the current user, which does not
+    change the modification time. Not if there are pending flashed messages,
+    since these must be shown.
+    """
+    if flask.request.method not in ("GET", "HEAD"):
+        return None
+    if flask.session.get("_flashes"):
+        return None
+    if not flask.request.if_none_match:
+        return None
+    if etag not in flask.request.if_none_match:
+        return None
+    return set_validators(flask.Response(status=304), etag)
+
+
+def set_validators(response, etag, last_modified=None, private=True):
+    """Set the ETag and optionally Last-Modified for the response.
+    The client must always revalidate, and by default only it may store it.
+    """
+    response = flask.make_response(response)
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    if private:
+        response.headers["Cache-Control"] = "private, no-cache"
+    else:
+        response.headers["Cache-Control"] = "public, no-cache"
+    return response
+
+
+def get_url_digest(digest):
+    """Return the digest of an attachment as a hexadecimal string, for use
+    in a URL. The CouchDB digest is MD5 in base64, the store digest SHA-256 in hex.
+    """
+    algorithm, value = digest.split("-", 1)
+    if algorithm == "md5":
+        return base64.b64decode(value).hex()
+    return value
+
+
+def set_immutable(response, private=False):
+    """Allow the response to be stored indefinitely without revalidation.
+    Only for a URL which contains the digest of the content.
+    """
+    response.headers["Cache-Control"] = (
+        f"{private and 'private' or 'public'},"
+        f" max-age={constants.IMMUTABLE_MAX_AGE}, immutable"
+    )
+    return response
+
+
+def get_site_file_url(filename):
+    """Return the immutable URL for the site file, which contains its digest.
+    If no such file, return the plain URL for it.
+    """
+    try:
+        filedata = flask.current_app.config[f"SITE_{filename.upper()}"]
+    except KeyError:
+        return flask.url_for("site", filename=filename)
+    return flask.url_for(
+        "site", filename=filename, digest=get_url_digest(filedata["etag"])
+    )
+
+
+def get_datatables_response(items, columns, get_rows):
+    """Return the JSON response for a DataTables server-side processing request.
+    The items are dictionaries with the values used to search and sort.
+    The list of columns gives the key in the items for each column in the
+    table, or None if the column can be neither searched nor sorted.
+    The function 'get_rows' is called with the items for the requested page,
+    and must return a list of rows, each being a list of HTML cells.
+    """
+    args = flask.request.args
+    try:
+        draw = int(args.get("draw") or 0)
+        start = max(0, int(args.get("start") or 0))
+        length = int(args.get("length") or constants.DATATABLES_PAGE_LENGTH)
+    except ValueError:
+        flask.abort(http.client.BAD_REQUEST)
+    if length < 0 or length > constants.DATATABLES_MAX_LENGTH:
+        length = constants.DATATABLES_MAX_LENGTH
+    total = len(items)
+
+    search = (args.get("search[value]") or "").strip().lower()
+    if search:
+        keys = [c for c in columns if c]
+        items = [
+            i for i in items if any(search in str(i.get(k) or "").lower() for k in keys)
+        ]
+
+    orders = []
+    n = 0
+    while f"order[{n}][column]" in args:
+        try:
+            column = columns[int(args[f"order[{n}][column]"])]
+        except (ValueError, IndexError):
+            flask.abort(http.client.BAD_REQUEST)
+        if column:
+            orders.append((column, args.get(f"order[{n}][dir]") == "desc"))
+        n += 1
+    # Stable sorts in reverse order of precedence give a multi-column sort.
+    for column, reverse in reversed(orders):
+        items = sorted(
+            items, key=lambda i: get_sort_key(i.get(column)), reverse=reverse
+        )
+
+    page = items[start : start + length]
+    return flask.jsonify(
+        {
+            "draw": draw,
+            "recordsTotal": total,
+            "recordsFiltered": len(items),
+            "data": page and get_rows(page) or [],
+        }
+    )
+
+
+def get_sort_key(value):
+    "Return a key for sorting values of possibly different types, None first."
+    if value is None:
+        return (0, 0, "")
+    elif isinstance(value, (bool, int, float)):
+        return (1, value, "")
+    else:
+        return (2, 0, str(value).lower())
+
+
+def get_table_rows(template, **context):
+    """Return the rows of a table as lists of the HTML of the cells.
+    The template appends each row as a list to the variable 'rows', and
+    each cell to its row using the macro in 'table_rows.html'.
+    """
+    rows = []
+    flask.render_template(template, rows=rows, **context)
+    return rows
+
+
 def create_xlsx_formats(wb):
     "Create and return the formats to use for the given XLSX workbook."
     return dict(
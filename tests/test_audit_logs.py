@@ -77,3 +77,14 @@ def test_logs_require_login(settings, page, populated_call):
     base = settings["BASE_URL"]
     page.goto(f"{base}/proposal/{populated_call['proposal']}/logs")
     assert page.url.startswith(f"{base}/user/login")
+
+
+def test_call_logs_load_older(settings, admin_page, populated_call):
+    "With one entry per page, 'Load older' appends the next entry to the table."
+    base = settings["BASE_URL"]
+    cid = populated_call["call"]
+    admin_page.goto(f"{base}/call/{cid}/logs?limit=1")
+    rows = admin_page.locator("#logs tbody tr")
+    expect(rows).to_have_count(1)
+    admin_page.get_by_role("button", name="Load older").click()
+    expect(rows).to_have_count(2)
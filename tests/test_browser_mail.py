@@ -175,3 +175,19 @@ def test_proposal_submission_email(settings, admin_page, seeded_call):
     admin_page.goto(proposal_url)
     admin_page.once("dialog", lambda d: d.accept())
     admin_page.get_by_role("button", name="Delete").click()
+
+
+def test_bulk_email_to_reviewers(settings, admin_page, seeded_call):
+    "Bulk email to the reviewers of a call sends a personalized message to each."
+    base = settings["BASE_URL"]
+    call_id = seeded_call
+
+    admin_page.goto(f"{base}/mail/call/{call_id}")
+    admin_page.get_by_label("Reviewers in the call").check()
+    admin_page.locator('input[name="title"]').fill("Reminder for {call}")
+    admin_page.locator('textarea[name="text"]').fill("Dear {username}, please review.")
+    admin_page.get_by_role("button", name="Send").click()
+    expect(admin_page.locator(".alert-info", has_text="put in the outbox")).to_be_visible()
+
+    msg = wait_for_email(lambda m: m["Subject"] == f"Reminder for {call_id}")
+    assert f"Dear {settings['REVIEWER_USERNAME']}, please review." in get_message_text(msg)
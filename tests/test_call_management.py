@@ -1,24 +1,31 @@
 """End-to-end tests for call management operations in anubis/call.py.
 
 Covers the call-lifecycle actions beyond field-schema editing: cloning a call,
-resetting its proposal counter, managing attached documents, and adding/removing
-reviewers. A regression in any of these silently corrupts or leaks call state
-(clone dropping fields, a counter reset wiping numbering, a stuck reviewer).
+resetting its proposal counter, numbering proposals created at the same time,
+managing attached documents, and adding/removing reviewers. A regression in any
+of these silently corrupts or leaks call state (clone dropping fields, a counter
+reset wiping numbering, duplicate proposal numbers, a stuck reviewer).
 
 Uses a dedicated session-scoped call (CI_CALL_CONFIG_CALL) so the mutating tests
 never disturb the shared seeded_call; the clone test reads seeded_call read-only.
 """
 
 import os
+import re
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from urllib.parse import unquote
 
 import pytest
+import requests
 from playwright.sync_api import expect
-from conftest import _create_call, _cleanup_call
+from conftest import _create_call, _cleanup_call, _dedicated_call, _delete_proposal
 
 CONFIG_CALL_ID = "CI_CALL_CONFIG_CALL"
 CLONE_TARGET_ID = "CI_CLONE_TARGET"
+COUNTER_CALL_ID = "CI_COUNTER_CALL"
 
 
 @pytest.fixture(scope="session")
@@ -105,6 +112,16 @@ def test_reset_counter_hidden_with_proposals(settings, admin_page, populated_cal
     expect(admin_page.get_by_role("button", name="Reset proposals counter")).to_have_count(0)
 
 
+def test_create_all_reviews_skips_existing(settings, admin_page, populated_call):
+    "Creating every review for all reviewers does not duplicate an existing review."
+    base = settings["BASE_URL"]
+    admin_page.goto(f"{base}/call/{populated_call['call']}/reviewers")
+    expect(admin_page.get_by_role("link", name="1 reviews")).to_be_visible()
+    admin_page.get_by_role("button", name="Create every review for all reviewers").click()
+    expect(admin_page.get_by_text("0 reviews created.")).to_be_visible()
+    expect(admin_page.get_by_role("link", name="1 reviews")).to_be_visible()
+
+
 def test_call_documents_round_trip(settings, admin_page, config_call, temp_text_file):
     "Admin uploads a call document; the same content downloads; deleting removes it."
     base = settings["BASE_URL"]
@@ -121,7 +138,17 @@ def test_call_documents_round_trip(settings, admin_page, config_call, temp_text_
     assert resp.status == 200
     assert resp.body() == content
 
+    # The call page links to the immutable URL containing the digest.
+    admin_page.goto(f"{base}/call/{config_call}")
+    href = admin_page.get_by_role("button", name="Download").first.get_attribute("href")
+    assert href.startswith(f"/call/{config_call}/documents/{filename}/")
+    resp = admin_page.context.request.get(f"{base}{href}")
+    assert resp.status == 200
+    assert resp.body() == content
+    assert "immutable" in resp.headers["cache-control"]
+
     # Delete removes the row (confirm dialog).
+    admin_page.goto(f"{base}/call/{config_call}/documents")
     admin_page.once("dialog", lambda d: d.accept())
     admin_page.locator("tr", has_text=filename).get_by_role("button", name="Delete").click()
     expect(admin_page.locator("tr", has_text=filename)).to_have_count(0)
@@ -150,3 +177,55 @@ def test_call_management_pages_admin_only(settings, admin_page, user_page, confi
 
         user_page.goto(target)
         expect(user_page).not_to_have_url(target)
+
+
+@pytest.fixture(scope="session")
+def counter_call(settings, browser, pre_session_cleanup):
+    "Call of its own, since the user may create only one proposal per call."
+    yield from _dedicated_call(browser, settings, COUNTER_CALL_ID)
+
+
+def _page_session(page):
+    "A requests.Session sharing the login of the browser page."
+    session = requests.Session()
+    for cookie in page.context.cookies():
+        session.cookies.set(
+            cookie["name"], cookie["value"], domain=cookie["domain"], path=cookie["path"]
+        )
+    return session
+
+
+def test_create_proposals_concurrently(
+    settings, counter_call, admin_page, user_page, user2_page
+):
+    "Proposals created at the same time by different users get unique numbers."
+    base = settings["BASE_URL"]
+    call_url = f"{base}/call/{counter_call}"
+    sessions = [_page_session(p) for p in (admin_page, user_page, user2_page)]
+    pattern = 'name="_csrf_token" value="([^"]+)'
+    tokens = [re.search(pattern, s.get(call_url).text).group(1) for s in sessions]
+    barrier = threading.Barrier(len(sessions))
+
+    def create(session, token):
+        barrier.wait()
+        return session.post(
+            f"{call_url}/create_proposal",
+            data={"_csrf_token": token},
+            allow_redirects=False,
+        )
+
+    with ThreadPoolExecutor(len(sessions)) as executor:
+        responses = list(executor.map(create, sessions, tokens))
+    # The redirect is to '/proposal/<pid>/edit' of the new proposal.
+    pids = [
+        unquote(r.headers["Location"].split("/proposal/")[1].split("/")[0])
+        for r in responses
+        if r.status_code == 302 and "/proposal/" in r.headers.get("Location", "")
+    ]
+    try:
+        assert len(pids) == len(sessions)
+        assert len(set(pids)) == len(pids)
+        assert all(pid.startswith(f"{counter_call}:") for pid in pids)
+    finally:
+        for pid in pids:
+            _delete_proposal(admin_page, f"{base}/proposal/{pid}")
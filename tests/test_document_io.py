@@ -264,3 +264,30 @@ def test_grant_document_field_upload_download(settings, doc_io_call, user_page,
             admin_page.wait_for_load_state("load")
         if proposal_url is not None:
             _delete_proposal(admin_page, proposal_url)
+
+
+def test_proposal_document_field_too_large_rejected(settings, doc_io_call, user_page, admin_page):
+    "A document larger than the default maximum size is rejected and not stored."
+    base = settings["BASE_URL"]
+    proposal_url = None
+
+    with tempfile.NamedTemporaryFile(suffix=".txt", delete=False) as f:
+        f.write(b"x" * (20 * 1024 * 1024 + 1))
+        tmp_path = f.name
+    try:
+        user_page.goto(f"{base}/call/{doc_io_call}")
+        user_page.locator("text=Create proposal").click()
+        user_page.locator("#_title").fill("Proposal with too large attachment")
+        user_page.locator("#project_title").fill("Project title")
+        user_page.locator('input[type="file"][name="attachment"]').set_input_files(tmp_path)
+        user_page.get_by_role("button", name="Save", exact=True).click()
+        proposal_url = user_page.url
+        expect(user_page.get_by_text("Document is too large")).to_be_visible()
+
+        pid = proposal_url.rstrip("/").rsplit("/", 1)[-1]
+        resp = user_page.context.request.get(f"{base}/proposal/{pid}/document/attachment")
+        assert resp.body() != b"x" * (20 * 1024 * 1024 + 1)
+    finally:
+        os.unlink(tmp_path)
+        if proposal_url is not None:
+            _delete_proposal(admin_page, proposal_url)
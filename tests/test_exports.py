@@ -11,7 +11,9 @@ so they use the session-scoped `populated_call` fixture from conftest.
 
 import json
 
+import pytest
 import requests
+from conftest import _dedicated_call, _delete_proposal, _submit_proposal
 from utils import get_admin_session
 
 # Content-Type substrings sent by the download endpoints (anubis/__init__.py).
@@ -164,3 +166,148 @@ def test_grants_call_zip(settings, populated_call):
     base = settings["BASE_URL"]
     session = get_admin_session(settings)
     _assert_download(session, f"{base}/grants/call/{populated_call['call']}.zip", ZIP_MIMETYPE)
+
+
+# Streamed tabular exports for data analysis; CSV and JSON Lines.
+
+CSV_MIMETYPE = "text/csv"
+JSONL_MIMETYPE = "application/jsonl"
+
+
+def test_proposals_call_csv(settings, populated_call):
+    base = settings["BASE_URL"]
+    session = get_admin_session(settings)
+    _assert_download(session, f"{base}/proposals/call/{populated_call['call']}.csv", CSV_MIMETYPE)
+
+
+def test_proposals_call_jsonl_columns(settings, populated_call):
+    "Only the selected columns are included, in the given order."
+    base = settings["BASE_URL"]
+    session = get_admin_session(settings)
+    url = f"{base}/proposals/call/{populated_call['call']}.jsonl?columns=title,proposal"
+    resp = session.get(url)
+    assert resp.status_code == 200
+    assert JSONL_MIMETYPE in resp.headers["Content-Type"]
+    rows = [json.loads(line) for line in resp.text.splitlines()]
+    assert populated_call["proposal"] in [r["proposal"] for r in rows]
+    assert all(list(r.keys()) == ["title", "proposal"] for r in rows)
+
+
+def test_proposals_call_decisions_csv(settings, populated_call):
+    base = settings["BASE_URL"]
+    session = get_admin_session(settings)
+    url = f"{base}/proposals/call/{populated_call['call']}/decisions.csv"
+    _assert_download(session, url, CSV_MIMETYPE)
+
+
+def test_reviews_call_jsonl(settings, populated_call):
+    base = settings["BASE_URL"]
+    session = get_admin_session(settings)
+    _assert_download(session, f"{base}/reviews/call/{populated_call['call']}.jsonl", JSONL_MIMETYPE)
+
+
+def test_grants_call_csv(settings, populated_call):
+    base = settings["BASE_URL"]
+    session = get_admin_session(settings)
+    _assert_download(session, f"{base}/grants/call/{populated_call['call']}.csv", CSV_MIMETYPE)
+
+
+def test_api_call_proposals_requires_auth(settings, populated_call):
+    base = settings["BASE_URL"]
+    resp = requests.get(f"{base}/api/calls/{populated_call['call']}/proposals")
+    assert resp.status_code == 401
+
+
+def test_api_call_proposals_paged(settings, populated_call):
+    "The first page has the proposal; the same page again is not modified."
+    base = settings["BASE_URL"]
+    session = get_admin_session(settings)
+    url = f"{base}/api/calls/{populated_call['call']}/proposals?limit=1"
+    resp = session.get(url)
+    assert resp.status_code == 200
+    j = json.loads(resp.content)
+    assert len(j["items"]) == 1
+    assert "next" in j
+    etag = resp.headers["ETag"]
+    resp = session.get(url, headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+
+
+def test_api_call_changes(settings, populated_call):
+    "All changes from the start include the proposal; none after the last sequence."
+    base = settings["BASE_URL"]
+    session = get_admin_session(settings)
+    url = f"{base}/api/calls/{populated_call['call']}/changes?doctype=proposal"
+    resp = session.get(url)
+    assert resp.status_code == 200
+    j = json.loads(resp.content)
+    assert populated_call["proposal"] in [i["id"] for i in j["items"]]
+    resp = session.get(j["next"])
+    assert resp.status_code == 200
+    assert json.loads(resp.content)["items"] == []
+
+
+def test_api_call_events_requires_auth(settings, populated_call):
+    base = settings["BASE_URL"]
+    resp = requests.get(f"{base}/api/calls/{populated_call['call']}/events")
+    assert resp.status_code == 401
+
+
+EVENTS_CALL_ID = "CI_EVENTS_CALL"
+
+
+@pytest.fixture(scope="session")
+def events_call(settings, browser, pre_session_cleanup):
+    "Call of its own, since the user may create only one proposal per call."
+    yield from _dedicated_call(browser, settings, EVENTS_CALL_ID)
+
+
+def test_api_call_events_deleted(settings, events_call, user_page, admin_page):
+    "A proposal deleted while the stream is open gives a 'deleted' event."
+    base = settings["BASE_URL"]
+    session = get_admin_session(settings)
+    resp = session.get(f"{base}/api/calls/{events_call}/changes")
+    since = json.loads(resp.content)["since"]
+    resp = session.get(
+        f"{base}/api/calls/{events_call}/events",
+        headers={"Last-Event-ID": since},
+        stream=True,
+        timeout=60,
+    )
+    assert resp.status_code == 200
+    lines = resp.iter_lines(decode_unicode=True)
+    assert next(lines).startswith("retry:")
+
+    proposal_url = _submit_proposal(settings, events_call, user_page, "Proposal")
+    _delete_proposal(admin_page, proposal_url)
+
+    events = []
+    for line in lines:
+        if line.startswith("event: "):
+            events.append(line[len("event: "):])
+        elif line.startswith("data: ") and events[-1] == "deleted":
+            assert json.loads(line[len("data: "):])["doctype"] == "proposal"
+            break
+    resp.close()
+    assert events[0] == "proposal"
+    assert events[-1] == "deleted"
+
+
+def test_api_calls_open_not_modified(settings):
+    base = settings["BASE_URL"]
+    resp = requests.get(f"{base}/api/calls/open")
+    assert resp.status_code == 200
+    etag = resp.headers["ETag"]
+    resp = requests.get(f"{base}/api/calls/open", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+
+
+def test_proposals_call_xlsx_not_modified(settings, populated_call):
+    base = settings["BASE_URL"]
+    session = get_admin_session(settings)
+    url = f"{base}/proposals/call/{populated_call['call']}.xlsx"
+    resp = session.get(url)
+    assert resp.status_code == 200
+    assert "Last-Modified" in resp.headers
+    resp = session.get(url, headers={"If-None-Match": resp.headers["ETag"]})
+    assert resp.status_code == 304
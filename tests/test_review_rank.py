@@ -0,0 +1,95 @@
+"""End-to-end tests for the rank field check when saving a review (anubis/review.py).
+
+A reviewer must give each of their reviews in a call a different value for a
+rank field. Saving a review looks up the same value in the reviewer's other
+reviews through a keyed query of the 'reviews/call_reviewer_rank' view, and
+records an error on the field if one is found.
+
+The reviews are created for the admin user (added as a reviewer) rather than the
+shared reviewer, so navigation never depends on the reviewer's "My reviews" list.
+Uses a dedicated call, with proposals by two users since a user may hold only
+one proposal per call.
+"""
+
+import pytest
+from conftest import (
+    _cleanup_call_fresh_context,
+    _create_call,
+    _open_call_dates,
+    _submit_proposal,
+)
+from playwright.sync_api import expect
+
+RANK_CALL_ID = "CI_REVIEW_RANK_CALL"
+RANK_FIELD_ID = "ci_rank"
+RANK_ERROR = "same value as in another review"
+
+
+@pytest.fixture(scope="session")
+def rank_reviews(settings, browser, admin_page, user_page, user2_page):
+    "Dedicated call with a rank review field, two proposals and two reviews by the admin."
+    base = settings["BASE_URL"]
+    admin_username = settings["ADMIN_USERNAME"]
+
+    # Clear any call left behind by a prior failed run, then build fresh.
+    _cleanup_call_fresh_context(browser, settings, RANK_CALL_ID)
+    opens, closes = _open_call_dates()
+    cid = _create_call(browser, settings, RANK_CALL_ID, opens, closes)
+
+    admin_page.goto(f"{base}/call/{cid}/review")
+    admin_page.get_by_role("button", name="Add rank field").click()
+    admin_page.locator("#_rank-identifier").fill(RANK_FIELD_ID)
+    admin_page.locator("#_rank-title").fill("Rank")
+    admin_page.locator("#_rankModal").get_by_role("button", name="Save").click()
+    expect(admin_page.locator("tr", has_text=RANK_FIELD_ID)).to_be_visible()
+
+    # Add admin as a reviewer so the reviews are created and edited without
+    # touching the shared reviewer's "My reviews" navigation.
+    admin_page.goto(f"{base}/call/{cid}/reviewers")
+    admin_page.locator("#reviewer").fill(admin_username)
+    admin_page.get_by_role("button", name="Add", exact=True).click()
+    expect(admin_page.get_by_role("link", name=admin_username)).to_be_visible()
+
+    # Title must be exactly "Proposal" so _cleanup_call's a[title='Proposal'] finds them.
+    _submit_proposal(settings, cid, user_page, "Proposal")
+    _submit_proposal(settings, cid, user2_page, "Proposal")
+
+    reviewer_url = f"{base}/reviews/call/{cid}/reviewer/{admin_username}"
+    admin_page.goto(reviewer_url)
+    for checkbox in admin_page.get_by_role("checkbox", name="Create").all():
+        checkbox.check()
+    admin_page.get_by_role("button", name="Create checked reviews").click()
+    review_urls = []
+    for index in range(2):
+        admin_page.goto(reviewer_url)
+        admin_page.get_by_role("link", name="Review", exact=True).nth(index).click()
+        review_urls.append(admin_page.url)
+
+    yield review_urls
+
+    # Teardown: before user2_page deletes the second user.
+    _cleanup_call_fresh_context(browser, settings, RANK_CALL_ID)
+
+
+def _save_rank(page, review_url, value):
+    "Set the rank field of the review and save it."
+    page.goto(review_url)
+    page.get_by_role("button", name="Edit").click()
+    page.locator(f"#{RANK_FIELD_ID}").fill(str(value))
+    page.get_by_role("button", name="Save").click()
+    expect(page).to_have_url(review_url)
+
+
+def test_rank_same_value_is_flagged(settings, admin_page, rank_reviews):
+    "The same rank in two reviews by the reviewer is an error; a different one is not."
+    first, second = rank_reviews
+    error = admin_page.get_by_text(RANK_ERROR)
+
+    _save_rank(admin_page, first, 1)
+    expect(error).to_have_count(0)
+
+    _save_rank(admin_page, second, 1)
+    expect(error).to_be_visible()
+
+    _save_rank(admin_page, second, 2)
+    expect(error).to_have_count(0)
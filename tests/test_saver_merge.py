@@ -0,0 +1,80 @@
+"""Tests for the merge of concurrent changes when saving a document.
+
+An update conflict happens only when two requests change the same document
+at the same time, which an end-to-end test cannot arrange reliably. So the
+saver is run here directly, in an application context, on an in-memory
+database that checks the revisions as CouchDB does.
+"""
+
+import copy
+import itertools
+
+import couchdb2
+import flask
+import pytest
+
+from anubis.proposal import ProposalSaver
+from anubis.saver import get_conflict_metrics
+
+
+class MemoryDatabase:
+    "Just enough of a couchdb2 database for the saver; 'get' and 'put'."
+
+    def __init__(self):
+        self.docs = {}
+        self.revisions = itertools.count(1)
+
+    def get(self, docid):
+        return copy.deepcopy(self.docs.get(docid))
+
+    def put(self, doc):
+        current = self.docs.get(doc["_id"])
+        if doc.get("_rev") != (current and current["_rev"]):
+            raise couchdb2.RevisionError("Document update conflict.")
+        doc["_rev"] = f"{next(self.revisions)}-x"
+        self.docs[doc["_id"]] = copy.deepcopy(doc)
+
+
+@pytest.fixture
+def db():
+    app = flask.Flask(__name__)
+    with app.app_context():
+        flask.g.current_user = None
+        flask.g.db = MemoryDatabase()
+        flask.g.db.put(
+            {
+                "_id": "proposal",
+                "doctype": "proposal",
+                "identifier": "CI_MERGE_CALL:001",
+                "title": "Proposal",
+                "values": {"a": "A", "b": "B"},
+            }
+        )
+        yield flask.g.db
+
+
+def test_merge_stale_copies(db):
+    "Changes to different values in two stale copies are both kept."
+    merged = get_conflict_metrics()["merged"]
+    first = db.get("proposal")
+    second = db.get("proposal")
+    with ProposalSaver(doc=first) as saver:
+        saver["values"]["a"] = "A changed"
+    with ProposalSaver(doc=second) as saver:
+        saver["values"]["b"] = "B changed"
+        saver["title"] = "Proposal changed"
+    assert get_conflict_metrics()["merged"] == merged + 1
+    doc = db.get("proposal")
+    assert doc["values"] == {"a": "A changed", "b": "B changed"}
+    assert doc["title"] == "Proposal changed"
+
+
+def test_merge_stale_copies_overlap(db):
+    "Different changes to the same value in two stale copies are refused."
+    first = db.get("proposal")
+    second = db.get("proposal")
+    with ProposalSaver(doc=first) as saver:
+        saver["values"]["a"] = "A changed"
+    with pytest.raises(ValueError), ProposalSaver(doc=second) as saver:
+        saver["values"]["a"] = "A changed differently"
+    assert db.get("proposal")["values"]["a"] == "A changed"
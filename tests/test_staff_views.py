@@ -67,3 +67,20 @@ def test_user_staff_list_admin_only(settings, admin_page, user_page):
 
     user_page.goto(target)
     expect(user_page).not_to_have_url(target)
+
+
+def test_user_all_json_paged(settings, admin_page, user_page):
+    "Admin gets one page of the users table as JSON; non-admin user is refused."
+    base = settings["BASE_URL"]
+    target = f"{base}/user/all.json?draw=3&start=0&length=1&order[0][column]=0&order[0][dir]=asc"
+
+    resp = admin_page.context.request.get(target)
+    assert resp.status == 200
+    body = resp.json()
+    assert body["draw"] == 3
+    assert body["recordsTotal"] >= 2
+    assert body["recordsFiltered"] == body["recordsTotal"]
+    assert len(body["data"]) == 1
+
+    resp = user_page.context.request.get(target, max_redirects=0)
+    assert resp.status != 200